@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from .conditional import forget_trip_response
+        from .models import Trip
+
+        post_save.connect(forget_trip_response, sender=Trip, dispatch_uid="trip-response-cache")
+        post_delete.connect(forget_trip_response, sender=Trip, dispatch_uid="trip-response-cache")
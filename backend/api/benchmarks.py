@@ -0,0 +1,254 @@
+"""Offline microbenchmarks for the trip planning pipeline.
+
+Nominatim and OSRM are replaced by deterministic stubs, so results only
+reflect local work: HOS scheduling, route parsing and plan assembly. Run
+with ``manage.py benchmark_planning`` and compare two result files with
+``manage.py compare_benchmarks``.
+"""
+import hashlib
+import json
+import platform
+import statistics
+import timeit
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+from urllib.parse import unquote, urlsplit
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Trip
+from .services import hos, singleflight
+from .services.geodesy import METERS_PER_MILE, haversine_miles
+
+RESULTS_VERSION = 1
+
+HOS_DISTANCES = [0, 55, 605, 2500, 12000]
+HOS_CYCLES = [0, 35, 69]
+FALLBACK_POINT_COUNTS = [2, 10, 100, 1000]
+ROUTE_GEOMETRY_SIZES = [1000, 10000, 50000]
+
+# none of these are in the gazetteer, so end-to-end runs reach the stub geocoder
+TRIP_LOCATIONS = ("Benchmark Yard, Reno", "Benchmark Depot, Omaha", "Benchmark Dock, Newark")
+
+
+class _StubLocation:
+    def __init__(self, query: str):
+        digest = hashlib.sha256(query.encode("utf-8")).digest()
+        # somewhere in the continental US so routes have realistic lengths
+        self.latitude = 25 + int.from_bytes(digest[:4], "big") / 0xFFFFFFFF * 23
+        self.longitude = -124 + int.from_bytes(digest[4:8], "big") / 0xFFFFFFFF * 57
+        self.address = f"{query}, United States"
+
+
+class _StubResponse:
+    def __init__(self, body: str):
+        self.body = body
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self):
+        return json.loads(self.body)
+
+
+def osrm_payload(waypoints: List[Tuple[float, float]], point_count: int) -> str:
+    """An OSRM route response with ``point_count`` geometry points."""
+    per_leg = max(point_count // max(len(waypoints) - 1, 1), 2)
+    geometry: List[List[float]] = []
+    legs = []
+    for (lat1, lon1), (lat2, lon2) in zip(waypoints, waypoints[1:]):
+        t = np.linspace(0.0, 1.0, per_leg)
+        # a little wiggle keeps simplification from collapsing the line
+        wiggle = np.sin(t * 40 * np.pi) * 0.01
+        lats = lat1 + (lat2 - lat1) * t + wiggle
+        lons = lon1 + (lon2 - lon1) * t
+        geometry.extend(np.column_stack((lons, lats)).round(6).tolist())
+        meters = float(haversine_miles(lat1, lon1, lat2, lon2)) * METERS_PER_MILE * 1.2
+        legs.append({"distance": meters, "duration": meters / 24.6})
+    route = {
+        "distance": sum(leg["distance"] for leg in legs),
+        "duration": sum(leg["duration"] for leg in legs),
+        "geometry": {"type": "LineString", "coordinates": geometry},
+        "legs": legs,
+    }
+    return json.dumps({"code": "Ok", "routes": [route]})
+
+
+class _StubSession:
+    def __init__(self, point_count: int):
+        self.point_count = point_count
+        self._bodies: Dict[str, str] = {}
+
+    def get(self, url, params=None, timeout=None):
+        # payloads are built once per URL so only parsing is measured
+        body = self._bodies.get(url)
+        if body is None:
+            path = unquote(urlsplit(url).path)
+            waypoints = [
+                (float(lat), float(lon))
+                for lon, lat in (pair.split(",") for pair in path.rsplit("/", 1)[-1].split(";"))
+            ]
+            body = self._bodies[url] = osrm_payload(waypoints, self.point_count)
+        return _StubResponse(body)
+
+
+class _ClosedCircuit:
+    def allow(self) -> bool:
+        return True
+
+    def record_success(self) -> None:
+        pass
+
+    def record_failure(self, count: int = 1) -> None:
+        pass
+
+
+@contextmanager
+def stubbed_upstreams(route_points: int = 2000) -> Iterator[None]:
+    # the breakers and the UpstreamLock table are bypassed too: a result published
+    # there by one case would otherwise be handed to the next one
+    session = _StubSession(route_points)
+    with mock.patch.object(hos, "_geocode", _StubLocation), \
+            mock.patch.object(hos, "get_session", lambda: session), \
+            mock.patch.object(hos, "osrm_breaker", _ClosedCircuit()), \
+            mock.patch.object(hos, "nominatim_breaker", _ClosedCircuit()), \
+            mock.patch.object(singleflight, "_acquire", lambda lock_key: singleflight._UNAVAILABLE):
+        yield
+
+
+@contextmanager
+def _rolled_back() -> Iterator[None]:
+    # cache rows written during a run must not leak into the next run or into the database
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def measure(func: Callable[[], object], repeat: int = 5, min_time: float = 0.2) -> Dict:
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    runs = [elapsed / number] + [run / number for run in timer.repeat(repeat - 1, number)]
+    return {
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "mean": statistics.fmean(runs),
+        "stdev": statistics.stdev(runs) if len(runs) > 1 else 0.0,
+        "loops": number,
+        "runs": len(runs),
+    }
+
+
+def _fallback_points(count: int) -> List[Dict]:
+    lats = np.linspace(30.0, 45.0, count)
+    lons = np.linspace(-120.0, -75.0, count)
+    return [{"latitude": lat, "longitude": lon} for lat, lon in zip(lats.tolist(), lons.tolist())]
+
+
+def _fetch_route_case(point_count: int) -> Callable[[], object]:
+    session = _StubSession(point_count)
+    points = _fallback_points(2)
+
+    def run():
+        hos.route_cache.clear()
+        with mock.patch.object(hos, "get_session", lambda: session):
+            route = hos._fetch_route(points)
+        if len(route["polyline"]) != point_count:
+            raise RuntimeError(
+                f"fetch_route[geometry={point_count}] got a {len(route['polyline'])}-point route; "
+                "the stub session was not used.")
+        return route
+
+    return run
+
+
+def _build_trip_plan_case(warm: bool) -> Callable[[], object]:
+    trip = Trip(
+        current_location=TRIP_LOCATIONS[0],
+        pickup_location=TRIP_LOCATIONS[1],
+        dropoff_location=TRIP_LOCATIONS[2],
+        current_cycle_used=20,
+    )
+
+    def run():
+        if not warm:
+            hos._geocode_cache.clear()
+            hos.route_cache.clear()
+        with _rolled_back():
+            return hos.build_trip_plan(trip)
+
+    return run
+
+
+def benchmark_cases() -> Iterator[Tuple[str, Callable[[], object]]]:
+    for distance in HOS_DISTANCES:
+        for cycle_used in HOS_CYCLES:
+            yield (
+                f"hos_plan[distance={distance},cycle={cycle_used}]",
+                lambda distance=distance, cycle_used=cycle_used: hos._generate_hos_plan(distance, cycle_used),
+            )
+    for count in FALLBACK_POINT_COUNTS:
+        points = _fallback_points(count)
+        yield f"fallback_route[points={count}]", lambda points=points: hos.fallback_route(points)
+    for count in ROUTE_GEOMETRY_SIZES:
+        yield f"fetch_route[geometry={count}]", _fetch_route_case(count)
+    yield "build_trip_plan[cold]", _build_trip_plan_case(warm=False)
+    yield "build_trip_plan[warm]", _build_trip_plan_case(warm=True)
+
+
+def run_benchmarks(
+    repeat: int = 5,
+    min_time: float = 0.2,
+    only: Optional[str] = None,
+    progress: Optional[Callable[[str, Dict], None]] = None,
+) -> Dict:
+    results: Dict[str, Dict] = {}
+    with stubbed_upstreams():
+        for name, func in benchmark_cases():
+            if only and only not in name:
+                continue
+            with _rolled_back():
+                results[name] = measure(func, repeat=repeat, min_time=min_time)
+            if progress:
+                progress(name, results[name])
+    return {
+        "version": RESULTS_VERSION,
+        "created_at": timezone.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "results": results,
+    }
+
+
+def compare_results(baseline: Dict, current: Dict, threshold: float = 0.1) -> List[Dict]:
+    """Pair up benchmarks by name and flag any whose best time grew past threshold."""
+    for data in (baseline, current):
+        if data.get("version") != RESULTS_VERSION:
+            raise ValueError("Unsupported benchmark results version.")
+
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            rows.append({"name": name, "baseline": None, "current": result["min"], "ratio": None, "status": "new"})
+            continue
+        ratio = result["min"] / base["min"] if base["min"] else float("inf")
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 - threshold:
+            status = "improvement"
+        else:
+            status = "unchanged"
+        rows.append({"name": name, "baseline": base["min"], "current": result["min"], "ratio": ratio, "status": status})
+    for name in baseline["results"].keys() - current["results"].keys():
+        rows.append({"name": name, "baseline": baseline["results"][name]["min"], "current": None,
+                     "ratio": None, "status": "missing"})
+    return rows
@@ -0,0 +1,93 @@
+"""ETags for trip responses, and a cache of rendered trip bodies.
+
+A trip's ETag comes from its id, updated_at and the response format, so it
+can be checked with a single-column query before the trip is loaded. A
+list's ETag comes from an aggregate over the user's trips (count, id sum,
+latest updated_at), so it changes whenever a trip is added, removed or
+modified. Every write that changes a trip payload must bump updated_at.
+"""
+import hashlib
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Count, Max, QuerySet, Sum
+from django.http import HttpResponseNotModified
+
+from .services.cache import CACHE_MISS, LRUCache
+
+TRIP_RESPONSE_CACHE_MAX_ENTRIES = getattr(settings, "TRIP_RESPONSE_CACHE_MAX_ENTRIES", 256)
+# the browsable API embeds per-request HTML, so only these formats are cached
+CACHED_FORMATS = ("json", "compact")
+# clients may keep responses but must revalidate them
+CACHE_CONTROL = "private, no-cache"
+# for responses requested under the current ?v= version, which never change
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# bump when the trip payload changes shape, so clients drop bodies cached under the old one
+PAYLOAD_VERSION = 2
+
+# trip id -> (etag, {origin: (content type, rendered body)}); bodies carry absolute
+# geometry URLs built from the request's scheme and host, so each origin gets its own
+_response_cache = LRUCache(TRIP_RESPONSE_CACHE_MAX_ENTRIES)
+
+
+def _stamp(value: Optional[datetime]) -> int:
+    return int(value.timestamp() * 1_000_000) if value else 0
+
+
+def trip_version(updated_at: Optional[datetime]) -> str:
+    return str(_stamp(updated_at))
+
+
+def trip_etag(trip_id: int, updated_at: datetime, response_format: str) -> str:
+    return f'"trip-{trip_id}-{_stamp(updated_at)}-{response_format}-v{PAYLOAD_VERSION}"'
+
+
+def list_etag(queryset: QuerySet, variant: str) -> str:
+    summary = queryset.aggregate(count=Count("id"), id_sum=Sum("id"), latest=Max("updated_at"))
+    digest = hashlib.sha1(
+        f"{PAYLOAD_VERSION}:{summary['count']}:{summary['id_sum'] or 0}:{_stamp(summary['latest'])}:{variant}".encode("utf-8")
+    ).hexdigest()[:20]
+    return f'"trips-{digest}"'
+
+
+def etag_matches(request, etag: str) -> bool:
+    # If-None-Match compares weakly, so a W/ prefix added by a proxy still matches
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return False
+    candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def not_modified(etag: str, cache_control: str = CACHE_CONTROL) -> HttpResponseNotModified:
+    response = HttpResponseNotModified()
+    response["ETag"] = etag
+    response["Cache-Control"] = cache_control
+    return response
+
+
+def request_origin(request) -> str:
+    return f"{request.scheme}://{request.get_host()}"
+
+
+def cached_body(trip_id: int, etag: str, origin: str) -> Optional[Tuple[str, bytes]]:
+    cached = _response_cache.get(trip_id)
+    if cached is CACHE_MISS or cached[0] != etag:
+        return None
+    return cached[1].get(origin)
+
+
+def store_body(trip_id: int, etag: str, origin: str, content_type: str, body: bytes) -> None:
+    cached = _response_cache.get(trip_id)
+    bodies = dict(cached[1]) if cached is not CACHE_MISS and cached[0] == etag else {}
+    bodies[origin] = (content_type, body)
+    _response_cache.set(trip_id, (etag, bodies), time.time() + 24 * 3600)
+
+
+def forget_trip_response(sender, instance, **kwargs) -> None:
+    # connected to Trip post_save/post_delete; writes through QuerySet.update() skip
+    # signals, but they bump updated_at, so the stale entry's ETag no longer matches
+    _response_cache.discard(instance.pk)
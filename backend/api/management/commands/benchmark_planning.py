@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import compare_results, run_benchmarks
+
+from .compare_benchmarks import report
+
+
+class Command(BaseCommand):
+    help = "Benchmark the trip planning pipeline against stubbed geocoder and OSRM responses."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", help="Write results as JSON to this file.")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--min-time",
+            type=float,
+            default=0.2,
+            help="Seconds each timing run should last; loops are scaled up to reach it.",
+        )
+        parser.add_argument("--only", help="Run only benchmarks whose name contains this text.")
+        parser.add_argument("--compare", help="Baseline results file to compare against.")
+        parser.add_argument("--threshold", type=float, default=0.1)
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1.")
+
+        def progress(name, result):
+            self.stdout.write(f"{name:<40} {result['min'] * 1e3:>12.4f} ms  (x{result['loops']})")
+
+        results = run_benchmarks(
+            repeat=options["repeat"],
+            min_time=options["min_time"],
+            only=options["only"],
+            progress=progress,
+        )
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as handle:
+                json.dump(results, handle, indent=2)
+            self.stdout.write(f"Wrote {len(results['results'])} result(s) to {options['output']}.")
+
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as handle:
+                baseline = json.load(handle)
+            try:
+                rows = compare_results(baseline, results, options["threshold"])
+            except ValueError as exc:
+                raise CommandError(str(exc)) from exc
+            report(self, rows, options["threshold"])
@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import compare_results
+
+
+def report(command: BaseCommand, rows, threshold: float) -> None:
+    for row in rows:
+        baseline = "-" if row["baseline"] is None else f"{row['baseline'] * 1e3:.4f}"
+        current = "-" if row["current"] is None else f"{row['current'] * 1e3:.4f}"
+        ratio = "-" if row["ratio"] is None else f"{row['ratio']:.2f}x"
+        line = f"{row['name']:<40} {baseline:>12} {current:>12} ms {ratio:>8}  {row['status']}"
+        if row["status"] == "regression":
+            command.stdout.write(command.style.ERROR(line))
+        elif row["status"] == "improvement":
+            command.stdout.write(command.style.SUCCESS(line))
+        else:
+            command.stdout.write(line)
+
+    regressions = [row["name"] for row in rows if row["status"] == "regression"]
+    if regressions:
+        raise CommandError(
+            f"{len(regressions)} benchmark(s) regressed by more than {threshold:.0%}: {', '.join(regressions)}")
+
+
+class Command(BaseCommand):
+    help = "Compare two benchmark_planning result files and fail on regressions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("baseline")
+        parser.add_argument("current")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.1,
+            help="Allowed slowdown as a fraction of the baseline's best time (default 0.1).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["baseline"], encoding="utf-8") as handle:
+                baseline = json.load(handle)
+            with open(options["current"], encoding="utf-8") as handle:
+                current = json.load(handle)
+            rows = compare_results(baseline, current, options["threshold"])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc)) from exc
+        report(self, rows, options["threshold"])
@@ -0,0 +1,53 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from api.services.planning import process_next_trip, requeue_stale_trips, run_worker
+
+
+class Command(BaseCommand):
+    help = "Drain the pending trip planning queue with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process every pending trip, then exit.",
+        )
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_trips()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale trip(s).")
+
+        if options["once"]:
+            processed = 0
+            while process_next_trip():
+                processed += 1
+            self.stdout.write(f"Processed {processed} trip(s).")
+            return
+
+        stop_event = threading.Event()
+        threads = [
+            threading.Thread(
+                target=run_worker,
+                args=(stop_event, options["poll_interval"]),
+                name=f"trip-planner-{index}",
+                daemon=True,
+            )
+            for index in range(options["workers"])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} trip planning worker(s).")
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            stop_event.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,56 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .services.metrics import (
+    SERVER_TIMING_ENABLED,
+    finish_request_timings,
+    server_timing_header,
+    start_request_timings,
+)
+
+
+class ServerTimingMiddleware:
+    """Report the planner stages timed during a request in a Server-Timing header."""
+
+    # async-capable so async views under ASGI are not pushed onto a thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not SERVER_TIMING_ENABLED:
+            return self.get_response(request)
+
+        token = start_request_timings()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = finish_request_timings(token)
+        return self._add_header(response, timings, started)
+
+    async def __acall__(self, request):
+        if not SERVER_TIMING_ENABLED:
+            return await self.get_response(request)
+
+        token = start_request_timings()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = finish_request_timings(token)
+        return self._add_header(response, timings, started)
+
+    def _add_header(self, response, timings, started):
+        # streaming bodies are produced after this returns, so "total" only covers the view
+        timings.append(("total", time.perf_counter() - started))
+        response["Server-Timing"] = server_timing_header(timings)
+        return response
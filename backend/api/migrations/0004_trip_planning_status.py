@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_geocodecacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='planning_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='completed', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='status_detail',
+            field=models.TextField(blank=True),
+        ),
+    ]
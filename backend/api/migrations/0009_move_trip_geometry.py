@@ -0,0 +1,144 @@
+import json
+import math
+import zlib
+
+import numpy as np
+from django.db import migrations, transaction
+
+BATCH_SIZE = 200
+
+# frozen copies of api.services.polyline as of this migration, so later changes
+# there (or to the POLYLINE_LEVELS setting) do not change what it writes
+_PRECISION = 5
+_LEVELS = {'high': 10.0, 'medium': 50.0, 'low': 250.0}
+_METERS_PER_DEGREE = 6371008.8 * math.pi / 180
+
+
+def _encode(points):
+    if len(points) == 0:
+        return ''
+    scaled = np.round(np.asarray(points, dtype=float) * 10 ** _PRECISION).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    chunks = []
+    for value in deltas.ravel().tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def _simplify(points, tolerance_meters):
+    array = np.asarray(points, dtype=float)
+    count = len(array)
+    if count < 3 or tolerance_meters <= 0:
+        return array.tolist()
+
+    scale = math.cos(math.radians(float(np.mean(array[:, 0]))))
+    xy = np.column_stack((array[:, 1] * scale, array[:, 0])) * _METERS_PER_DEGREE
+
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = xy[first], xy[last]
+        segment = end - start
+        length_sq = float(segment @ segment)
+        inner = xy[first + 1:last] - start
+        if length_sq == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            t = np.clip(inner @ segment / length_sq, 0.0, 1.0)
+            offsets = inner - np.outer(t, segment)
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_meters:
+            index = first + 1 + farthest
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return array[keep].tolist()
+
+
+def _build_geometry(points):
+    levels = {'full': _encode(points)}
+    for level, tolerance in _LEVELS.items():
+        levels[level] = _encode(_simplify(points, tolerance))
+    return {
+        'format': 'encoded-polyline',
+        'precision': _PRECISION,
+        'point_count': len(points),
+        'levels': levels,
+    }
+
+
+def _pack(geometry):
+    # same encoding as api.services.trip_geometry.pack_geometry
+    return zlib.compress(json.dumps(geometry, separators=(',', ':')).encode('utf-8'), 6)
+
+
+def move_geometry(apps, schema_editor):
+    Trip = apps.get_model('api', 'Trip')
+    TripGeometry = apps.get_model('api', 'TripGeometry')
+    last_pk = 0
+    while True:
+        # one short transaction per batch, so a large table is not locked for the whole move
+        with transaction.atomic():
+            trips = list(
+                Trip.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'map_data')[:BATCH_SIZE]
+            )
+            if not trips:
+                return
+            last_pk = trips[-1].pk
+            rows = []
+            moved = []
+            for trip in trips:
+                map_data = trip.map_data or {}
+                if 'geometry' in map_data:
+                    geometry = map_data['geometry']
+                elif map_data.get('polyline'):
+                    geometry = _build_geometry(map_data['polyline'])
+                else:
+                    continue
+                rows.append(TripGeometry(
+                    trip_id=trip.pk, data=_pack(geometry), point_count=geometry.get('point_count', 0)))
+                trip.map_data = {
+                    key: value for key, value in map_data.items() if key not in ('geometry', 'polyline')}
+                moved.append(trip)
+            TripGeometry.objects.bulk_create(rows, ignore_conflicts=True)
+            Trip.objects.bulk_update(moved, ['map_data'])
+
+
+def restore_geometry(apps, schema_editor):
+    Trip = apps.get_model('api', 'Trip')
+    TripGeometry = apps.get_model('api', 'TripGeometry')
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            rows = list(TripGeometry.objects.filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE])
+            if not rows:
+                return
+            last_pk = rows[-1].pk
+            trips = Trip.objects.in_bulk([row.trip_id for row in rows])
+            for row in rows:
+                trip = trips[row.trip_id]
+                trip.map_data = {**(trip.map_data or {}), 'geometry': json.loads(zlib.decompress(bytes(row.data)))}
+            Trip.objects.bulk_update(trips.values(), ['map_data'])
+
+
+class Migration(migrations.Migration):
+
+    # batches commit on their own
+    atomic = False
+
+    dependencies = [
+        ('api', '0008_tripgeometry'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_geometry, restore_geometry),
+    ]
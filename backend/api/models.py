@@ -1,8 +1,15 @@
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
 class Trip(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        PROCESSING = "processing", "Processing"
+        COMPLETED = "completed", "Completed"
+        FAILED = "failed", "Failed"
+
     created_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -17,8 +24,75 @@ class Trip(models.Model):
     route_summary = models.JSONField(default=dict, blank=True)
     hos_logs = models.JSONField(default=list, blank=True)
     map_data = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=16,
+        choices=Status.choices,
+        default=Status.COMPLETED,
+        db_index=True,
+    )
+    status_detail = models.TextField(blank=True)
+    planning_started_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_by", "created_at"], name="trip_owner_created_idx"),
+        ]
+
     def __str__(self):
         return f"Trip from {self.pickup_location} to {self.dropoff_location}"
+
+
+class TripGeometry(models.Model):
+    # the route polyline at every detail level, zlib-compressed JSON (see services.trip_geometry);
+    # kept out of Trip so loading a trip row does not drag megabytes of geometry along
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, primary_key=True, related_name="geometry")
+    data = models.BinaryField()
+    point_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Geometry for trip {self.trip_id}"
+
+
+class GeocodeCacheEntry(models.Model):
+    query_key = models.CharField(max_length=255, unique=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    display_name = models.TextField(blank=True)
+    found = models.BooleanField(default=True)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.query_key
+
+
+class UpstreamCircuit(models.Model):
+    class State(models.TextChoices):
+        CLOSED = "closed", "Closed"
+        OPEN = "open", "Open"
+        HALF_OPEN = "half_open", "Half-open"
+
+    name = models.CharField(max_length=64, unique=True)
+    state = models.CharField(max_length=16, choices=State.choices, default=State.CLOSED)
+    failures = models.PositiveIntegerField(default=0)
+    opened_at = models.DateTimeField(null=True, blank=True)
+    # set explicitly: state changes are conditional UPDATEs, which skip auto_now
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name}: {self.state}"
+
+
+class UpstreamLock(models.Model):
+    # one row per in-flight upstream lookup; the holder stores its result here for waiters
+    key = models.CharField(max_length=80, unique=True)
+    done = models.BooleanField(default=False)
+    result = models.JSONField(null=True, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,23 @@
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.utils.mediatypes import media_type_matches
+
+
+class StreamingContentNegotiation(DefaultContentNegotiation):
+    """Accepts the media types that streaming actions write themselves.
+
+    Their StreamingHttpResponse bypasses the renderers, so an Accept header
+    naming one of these types selects the first renderer, which then only
+    renders error responses (as JSON).
+    """
+
+    streamed_media_types = ("text/csv", "application/x-ndjson")
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            for accepted in self.get_accept_list(request):
+                if any(media_type_matches(streamed, accepted) for streamed in self.streamed_media_types):
+                    return renderers[0], renderers[0].media_type
+            raise
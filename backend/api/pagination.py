@@ -0,0 +1,8 @@
+from rest_framework.pagination import CursorPagination
+
+
+class TripCursorPagination(CursorPagination):
+    ordering = "-created_at"
+    page_size = 25
+    page_size_query_param = "page_size"
+    max_page_size = 100
@@ -0,0 +1,23 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class TextParser(BaseParser):
+    """Hands the decoded request body to the view untouched."""
+
+    media_type = "text/*"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get("encoding", "utf-8")
+        try:
+            return stream.read().decode(encoding)
+        except UnicodeDecodeError as exc:
+            raise ParseError(f"Request body is not valid {encoding}.") from exc
+
+
+class NDJSONParser(TextParser):
+    media_type = "application/x-ndjson"
+
+
+class JSONLinesParser(TextParser):
+    media_type = "application/jsonl"
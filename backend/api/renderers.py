@@ -0,0 +1,7 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """JSON selected with ?format=compact; trip HOS logs are sent in the columnar form."""
+
+    format = "compact"
@@ -1,9 +1,40 @@
+from django.urls import reverse
 from rest_framework import serializers
+from .conditional import trip_version
 from .models import Trip
+from .services.hos_logs import COMPACT_FORMAT, compact_hos_logs, expand_hos_logs
+from .services.feasibility import HOS_SWEEP_MAX_CELLS
+from .services.matrix import MATRIX_MAX_LOCATIONS, MATRIX_MAX_PLACE_NAMES
+
+
+class HosLogsField(serializers.JSONField):
+    def to_representation(self, value):
+        request = self.context.get("request")
+        renderer = getattr(request, "accepted_renderer", None)
+        if getattr(renderer, "format", None) == COMPACT_FORMAT:
+            return compact_hos_logs(value)
+        return expand_hos_logs(value)
+
+
+class MapDataField(serializers.JSONField):
+    """The trip's markers; the route polyline is fetched separately from geometry_url."""
+
+    def __init__(self, **kwargs):
+        super().__init__(source="*", read_only=True, **kwargs)
+
+    def to_representation(self, trip):
+        rendered = {key: value for key, value in (trip.map_data or {}).items() if key not in ("geometry", "polyline")}
+        # versioned by updated_at so the geometry response can be cached for good
+        url = f"{reverse('trip-geometry', args=[trip.pk])}?v={trip_version(trip.updated_at)}"
+        request = self.context.get("request")
+        rendered["geometry_url"] = request.build_absolute_uri(url) if request is not None else url
+        return rendered
 
 
 class TripSerializer(serializers.ModelSerializer):
     created_by = serializers.SerializerMethodField()
+    hos_logs = HosLogsField(read_only=True)
+    map_data = MapDataField()
 
     class Meta:
         model = Trip
@@ -17,6 +48,8 @@ class TripSerializer(serializers.ModelSerializer):
             "route_summary",
             "hos_logs",
             "map_data",
+            "status",
+            "status_detail",
             "created_at",
             "updated_at",
         ]
@@ -26,9 +59,92 @@ class TripSerializer(serializers.ModelSerializer):
             "route_summary",
             "hos_logs",
             "map_data",
+            "status",
+            "status_detail",
             "created_at",
             "updated_at",
         ]
 
     def get_created_by(self, obj):
         return obj.created_by.username if obj.created_by else None
+
+    def update(self, instance, validated_data):
+        # write only the edited inputs, never status or plan columns the queue worker may have moved on
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=[*validated_data, "updated_at"])
+        return instance
+
+
+class TripListSerializer(serializers.ModelSerializer):
+    created_by = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Trip
+        fields = [
+            "id",
+            "created_by",
+            "current_location",
+            "pickup_location",
+            "dropoff_location",
+            "current_cycle_used",
+            "status",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = fields
+
+    def get_created_by(self, obj):
+        return obj.created_by.username if obj.created_by else None
+
+
+class TripStatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Trip
+        fields = ["id", "status", "status_detail", "updated_at"]
+        read_only_fields = fields
+
+
+class MatrixLocationField(serializers.Field):
+    """A place name, or a {"lat": ..., "lon": ...} pair that needs no geocoding."""
+
+    default_error_messages = {"invalid": 'Expected a place name or an object with "lat" and "lon".'}
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            return serializers.CharField(max_length=255).run_validation(data)
+        if isinstance(data, dict) and set(data) == {"lat", "lon"}:
+            return {
+                "latitude": serializers.FloatField(min_value=-90, max_value=90).run_validation(data["lat"]),
+                "longitude": serializers.FloatField(min_value=-180, max_value=180).run_validation(data["lon"]),
+            }
+        self.fail("invalid")
+
+    def to_representation(self, value):
+        return value
+
+
+class DistanceMatrixRequestSerializer(serializers.Serializer):
+    origins = serializers.ListField(child=MatrixLocationField(), min_length=1)
+    destinations = serializers.ListField(child=MatrixLocationField(), min_length=1)
+
+    def validate(self, attrs):
+        locations = [*attrs["origins"], *attrs["destinations"]]
+        if len(locations) > MATRIX_MAX_LOCATIONS:
+            raise serializers.ValidationError(
+                f"A matrix may have at most {MATRIX_MAX_LOCATIONS} origins and destinations combined.")
+        if sum(isinstance(location, str) for location in locations) > MATRIX_MAX_PLACE_NAMES:
+            raise serializers.ValidationError(
+                f"A matrix may name at most {MATRIX_MAX_PLACE_NAMES} places; "
+                'give the others as {"lat": ..., "lon": ...} pairs.')
+        return attrs
+
+
+class FeasibilitySweepRequestSerializer(serializers.Serializer):
+    distances_miles = serializers.ListField(child=serializers.FloatField(min_value=0), min_length=1)
+    cycles_used = serializers.ListField(child=serializers.FloatField(min_value=0), min_length=1)
+
+    def validate(self, attrs):
+        if len(attrs["distances_miles"]) * len(attrs["cycles_used"]) > HOS_SWEEP_MAX_CELLS:
+            raise serializers.ValidationError(f"A sweep may have at most {HOS_SWEEP_MAX_CELLS} cells.")
+        return attrs
@@ -0,0 +1,168 @@
+"""Non-blocking trip planning for ASGI deployments.
+
+Produces the same plan as hos.build_trip_plan, but Nominatim and OSRM are
+called through httpx's AsyncClient, so a request waiting on an upstream
+holds no thread. The waypoints are geocoded concurrently with
+asyncio.gather; they draw on the same Nominatim token bucket as the
+blocking path, so the process as a whole keeps to Nominatim's rate limit.
+Database work (the geocode cache and circuit breakers) and the HOS and
+geometry computation run through sync_to_async. Identical lookups in
+flight on the same event loop share one upstream call; the UpstreamLock
+table used by the blocking path is not consulted.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import httpx
+from asgiref.sync import sync_to_async
+
+from .cache import CACHE_MISS
+from .hos import (
+    NOMINATIM_BASE_URL,
+    NOMINATIM_READ_TIMEOUT_SECONDS,
+    OSRM_READ_TIMEOUT_SECONDS,
+    OSRM_ROUTE_PARAMS,
+    approximate_location,
+    build_plan_for_locations,
+    fallback_route,
+    nominatim_breaker,
+    nominatim_bucket,
+    normalize_query,
+    osrm_breaker,
+    record_geocodes,
+    record_upstream,
+    resolve_locally,
+    route_cache,
+    route_from_payload,
+    route_url,
+)
+from .http import async_timeout, get_async_client
+from .metrics import COALESCED_LOOKUPS, ROUTE_FALLBACKS, increment, stage
+
+logger = logging.getLogger(__name__)
+
+# (event loop, kind, key) -> the task doing that lookup
+_inflight: Dict[Tuple[asyncio.AbstractEventLoop, str, Hashable], asyncio.Task] = {}
+
+
+async def _coalesced(kind: str, key: Hashable, factory: Callable[[], Awaitable]):
+    loop = asyncio.get_running_loop()
+    flight_key = (loop, kind, key)
+    task = _inflight.get(flight_key)
+    if task is None:
+        task = _inflight[flight_key] = loop.create_task(factory())
+        task.add_done_callback(lambda _: _inflight.pop(flight_key, None))
+    else:
+        increment(COALESCED_LOOKUPS, kind, "process")
+    # a cancelled caller must not cancel the lookup others are waiting on
+    return await asyncio.shield(task)
+
+
+async def _query_geocoder_async(query: str) -> Tuple[Dict, object]:
+    # same contract as hos._query_geocoder
+    await nominatim_bucket.wait_async()
+    started = time.perf_counter()
+    try:
+        response = await get_async_client().get(
+            f"{NOMINATIM_BASE_URL.rstrip('/')}/search",
+            params={"q": query, "format": "json", "limit": 1},
+            timeout=async_timeout(NOMINATIM_READ_TIMEOUT_SECONDS),
+        )
+        response.raise_for_status()
+        results = response.json()
+    except (httpx.HTTPError, ValueError) as exc:
+        logger.warning("Geocoder unavailable for '%s': %s", query, exc)
+        record_upstream("nominatim", "error", started)
+        return approximate_location(query), CACHE_MISS
+
+    if not results:
+        logger.info(
+            "No geocoding result for '%s'; using approximate coordinates", query)
+        record_upstream("nominatim", "not_found", started)
+        return approximate_location(query), None
+    record_upstream("nominatim", "ok", started)
+
+    resolved = {
+        "latitude": float(results[0]["lat"]),
+        "longitude": float(results[0]["lon"]),
+        "display_name": results[0]["display_name"],
+    }
+    return {"query": query, **resolved, "approximate": False}, resolved
+
+
+async def _geocode_remote_async(query: str) -> Dict:
+    outcome = await _query_geocoder_async(query)
+    resolved = await sync_to_async(record_geocodes)({query: outcome})
+    return resolved[query]
+
+
+def _resolve_all_locally(queries: List[str]) -> Dict[str, Optional[Dict]]:
+    return {query: resolve_locally(query) for query in queries}
+
+
+async def geocode_locations_async(queries: List[str]) -> List[Dict]:
+    distinct = list(dict.fromkeys(queries))
+    local = await sync_to_async(_resolve_all_locally)(distinct)
+    resolved = {query: location for query, location in local.items() if location is not None}
+    pending = [query for query in distinct if query not in resolved]
+
+    if pending:
+        if await sync_to_async(nominatim_breaker.allow)():
+            located = await asyncio.gather(*(
+                _coalesced("geocode", normalize_query(query), lambda query=query: _geocode_remote_async(query))
+                for query in pending
+            ))
+            # a coalesced result may come from a query differing only in case or spacing
+            resolved.update((query, {**location, "query": query}) for query, location in zip(pending, located))
+        else:
+            resolved.update((query, approximate_location(query)) for query in pending)
+
+    return [dict(resolved[query]) for query in queries]
+
+
+async def _request_route_async(points: List[Dict]) -> Dict:
+    if not await sync_to_async(osrm_breaker.allow)():
+        increment(ROUTE_FALLBACKS, "circuit_open")
+        return fallback_route(points)
+
+    started = time.perf_counter()
+    try:
+        response = await get_async_client().get(
+            route_url(points), params=OSRM_ROUTE_PARAMS, timeout=async_timeout(OSRM_READ_TIMEOUT_SECONDS))
+        response.raise_for_status()
+        payload = response.json()
+    except (httpx.HTTPError, ValueError):
+        record_upstream("osrm", "error", started)
+        await sync_to_async(osrm_breaker.record_failure)()
+        increment(ROUTE_FALLBACKS, "upstream_error")
+        return fallback_route(points)
+    await sync_to_async(osrm_breaker.record_success)()
+    return route_from_payload(payload, points, started)
+
+
+async def fetch_route_async(points: List[Dict]) -> Dict:
+    if len(points) < 2:
+        raise ValueError(
+            "At least two locations are required to build a route.")
+
+    cached = route_cache.get(points)
+    if cached is not CACHE_MISS:
+        return cached
+
+    route = await _coalesced("route", route_cache.key_for(points), lambda: _request_route_async(points))
+    route_cache.set(points, route)
+    return route
+
+
+async def build_trip_plan_async(trip) -> Dict:
+    with stage("geocode"):
+        origin, pickup, dropoff = await geocode_locations_async(
+            [trip.current_location, trip.pickup_location, trip.dropoff_location]
+        )
+    with stage("route"):
+        route = await fetch_route_async([origin, pickup, dropoff])
+    # HOS scheduling and Douglas-Peucker simplification are CPU work; keep them off the loop
+    return await sync_to_async(build_plan_for_locations, thread_sensitive=False)(
+        origin, pickup, dropoff, trip.current_cycle_used, route=route)
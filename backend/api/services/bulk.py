@@ -0,0 +1,152 @@
+import csv
+import io
+import json
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework.utils.encoders import JSONEncoder
+
+from ..models import Trip, TripGeometry
+from ..serializers import TripSerializer
+from .hos import build_plan_for_locations, geocode_locations
+from .trip_geometry import geometry_row, split_map_data
+
+BULK_MAX_ROWS = getattr(settings, "TRIP_BULK_MAX_ROWS", 1000)
+BULK_MAX_WORKERS = getattr(settings, "TRIP_BULK_MAX_WORKERS", 8)
+
+logger = logging.getLogger(__name__)
+
+LOCATION_FIELDS = ("current_location", "pickup_location", "dropoff_location")
+
+
+def parse_rows(body: str, is_csv: bool) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    # yields (row number, payload, parse error) so one bad line does not abort the batch
+    if is_csv:
+        reader = csv.DictReader(io.StringIO(body))
+        for row_number, row in enumerate(reader, start=1):
+            yield row_number, {key.strip(): value for key, value in row.items() if key}, None
+        return
+
+    row_number = 0
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            payload = json.loads(line)
+        except ValueError as exc:
+            yield row_number, None, f"Invalid JSON: {exc}"
+            continue
+        if not isinstance(payload, dict):
+            yield row_number, None, "Each line must be a JSON object."
+            continue
+        yield row_number, payload, None
+
+
+def _dumps(payload: Dict) -> bytes:
+    return (json.dumps(payload, cls=JSONEncoder) + "\n").encode("utf-8")
+
+
+def _error_line(row_number: int, errors) -> bytes:
+    return _dumps({"row": row_number, "status": "error", "errors": errors})
+
+
+def _plan_in_worker(*args) -> Dict:
+    # route lookups touch the database (circuit breaker, UpstreamLock), which opens a
+    # connection for this pool thread; close it rather than leak one per thread
+    try:
+        return build_plan_for_locations(*args)
+    finally:
+        connection.close()
+
+
+def stream_bulk_plan(rows, user) -> Iterator[bytes]:
+    """Validate, plan and persist a batch of trips, yielding one NDJSON line per row.
+
+    Locations shared between rows are geocoded once for the whole batch, the
+    route/HOS planning runs on a thread pool, and whichever trips finish
+    together are written with a single bulk_create before their lines are
+    emitted.
+    """
+    valid: List[Tuple[int, Dict]] = []
+    for row_number, payload, parse_error in rows:
+        if row_number > BULK_MAX_ROWS:
+            yield _error_line(row_number, f"Batch is limited to {BULK_MAX_ROWS} rows.")
+            break
+        if parse_error:
+            yield _error_line(row_number, parse_error)
+            continue
+        serializer = TripSerializer(data=payload)
+        if not serializer.is_valid():
+            yield _error_line(row_number, serializer.errors)
+            continue
+        valid.append((row_number, serializer.validated_data))
+
+    if not valid:
+        return
+
+    queries = sorted({data[field] for _, data in valid for field in LOCATION_FIELDS})
+    locations = dict(zip(queries, geocode_locations(queries)))
+
+    executor = ThreadPoolExecutor(max_workers=BULK_MAX_WORKERS, thread_name_prefix="bulk-plan")
+    try:
+        futures = {
+            executor.submit(
+                _plan_in_worker,
+                locations[data["current_location"]],
+                locations[data["pickup_location"]],
+                locations[data["dropoff_location"]],
+                data["current_cycle_used"],
+            ): (row_number, data)
+            for row_number, data in valid
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            planned: List[Tuple[int, Trip]] = []
+            geometries: List[Optional[Dict]] = []
+            for future in sorted(done, key=lambda item: futures[item][0]):
+                row_number, data = futures[future]
+                try:
+                    plan = future.result()
+                except ValueError as exc:
+                    yield _error_line(row_number, str(exc))
+                    continue
+                except Exception as exc:
+                    logger.exception("Bulk planning failed for row %s", row_number)
+                    yield _error_line(row_number, f"Planning error: {exc}")
+                    continue
+                map_data, geometry = split_map_data(plan["map_data"])
+                geometries.append(geometry)
+                planned.append(
+                    (
+                        row_number,
+                        Trip(
+                            created_by=user,
+                            route_summary=plan["route_summary"],
+                            hos_logs=plan["hos_logs"],
+                            map_data=map_data,
+                            status=Trip.Status.COMPLETED,
+                            **data,
+                        ),
+                    )
+                )
+
+            if not planned:
+                continue
+            with transaction.atomic():
+                Trip.objects.bulk_create([trip for _, trip in planned])
+                TripGeometry.objects.bulk_create([
+                    geometry_row(trip.pk, geometry)
+                    for (_, trip), geometry in zip(planned, geometries)
+                    if geometry is not None
+                ])
+            for row_number, trip in planned:
+                yield _dumps(
+                    {"row": row_number, "status": "created", "trip": TripSerializer(trip).data}
+                )
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
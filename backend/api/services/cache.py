@@ -0,0 +1,53 @@
+"""In-process caches shared by the planner, the distance matrix and the trip views."""
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Tuple
+
+# sentinel distinguishing "not cached" from a cached "no result" (None)
+CACHE_MISS = object()
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU where every entry carries its own expiry."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        now = time.time()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                expires, value = cached
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return CACHE_MISS
+
+    def set(self, key: Hashable, value, expires: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,145 @@
+"""Circuit breakers for the OSRM and Nominatim upstreams.
+
+State lives in the UpstreamCircuit table so every worker process sees the
+same circuit. After failure_threshold failures in a row a circuit opens and
+callers go straight to their fallbacks; once reset_seconds have passed a
+single caller is let through as a probe (half-open), which closes the
+circuit on success or reopens it on failure. Transitions are conditional
+UPDATEs, so only one process wins each of them.
+"""
+import logging
+import threading
+from datetime import timedelta
+from typing import List, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import UpstreamCircuit
+from .metrics import UPSTREAM_SHORT_CIRCUITS, increment, register_collector
+
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = getattr(settings, "CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5)
+CIRCUIT_BREAKER_RESET_SECONDS = getattr(settings, "CIRCUIT_BREAKER_RESET_SECONDS", 30)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = UpstreamCircuit.State.CLOSED
+OPEN = UpstreamCircuit.State.OPEN
+HALF_OPEN = UpstreamCircuit.State.HALF_OPEN
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = CIRCUIT_BREAKER_RESET_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        # per thread: whether this thread's last allow() saw a closed circuit with no
+        # failures, in which case record_success has nothing to reset and skips the write
+        self._local = threading.local()
+
+    @property
+    def _clean(self) -> bool:
+        return getattr(self._local, "clean", False)
+
+    @_clean.setter
+    def _clean(self, value: bool) -> None:
+        self._local.clean = value
+
+    def _circuit(self):
+        return UpstreamCircuit.objects.filter(name=self.name)
+
+    def allow(self) -> bool:
+        """Whether the caller may go upstream; a database error fails open."""
+        try:
+            row = self._circuit().values_list("state", "failures", "opened_at", "updated_at").first()
+            if row is None:
+                self._clean = True
+                return True
+            state, failures, opened_at, updated_at = row
+            if state == CLOSED:
+                self._clean = failures == 0
+                return True
+
+            self._clean = False
+            now = timezone.now()
+            cutoff = now - timedelta(seconds=self.reset_seconds)
+            claimed = 0
+            if state == OPEN and opened_at is not None and opened_at <= cutoff:
+                claimed = self._circuit().filter(state=OPEN, opened_at=opened_at).update(
+                    state=HALF_OPEN, updated_at=now)
+            elif state == HALF_OPEN and updated_at <= cutoff:
+                # the previous probe never reported back; let another one through
+                claimed = self._circuit().filter(state=HALF_OPEN, updated_at=updated_at).update(updated_at=now)
+        except DatabaseError as exc:
+            logger.warning("Could not read the %s circuit: %s", self.name, exc)
+            return True
+
+        if claimed:
+            logger.info("Probing the %s circuit", self.name)
+            return True
+        increment(UPSTREAM_SHORT_CIRCUITS, self.name)
+        return False
+
+    def record_success(self) -> None:
+        if self._clean:
+            return
+        try:
+            reset = self._circuit().filter(~Q(state=CLOSED) | Q(failures__gt=0)).update(
+                state=CLOSED, failures=0, opened_at=None, updated_at=timezone.now())
+        except DatabaseError as exc:
+            logger.warning("Could not reset the %s circuit: %s", self.name, exc)
+            return
+        self._clean = True
+        if reset:
+            logger.info("The %s circuit is closed", self.name)
+
+    def record_failure(self, count: int = 1) -> None:
+        now = timezone.now()
+        self._clean = False
+        try:
+            UpstreamCircuit.objects.get_or_create(name=self.name)
+            self._circuit().update(failures=F("failures") + count, updated_at=now)
+            # a failed probe, or too many failures in a row, opens the circuit
+            opened = self._circuit().filter(
+                Q(state=HALF_OPEN) | Q(state=CLOSED, failures__gte=self.failure_threshold)
+            ).update(state=OPEN, opened_at=now)
+        except DatabaseError as exc:
+            logger.warning("Could not record a %s failure: %s", self.name, exc)
+            return
+        if opened:
+            logger.warning(
+                "The %s circuit is open; using fallbacks for %s seconds", self.name, self.reset_seconds)
+
+
+def _circuit_metrics() -> List[Tuple]:
+    try:
+        rows = list(UpstreamCircuit.objects.order_by("name").values_list("name", "state", "failures"))
+    except DatabaseError as exc:
+        logger.warning("Could not read circuit states: %s", exc)
+        return []
+    return [
+        (
+            "routelog_upstream_circuit_state",
+            "gauge",
+            "Upstream circuit state (0 closed, 1 half-open, 2 open).",
+            [({"service": name}, _STATE_VALUES[state]) for name, state, _ in rows],
+        ),
+        (
+            "routelog_upstream_circuit_failures",
+            "gauge",
+            "Upstream failures in a row counted by the circuit breaker.",
+            [({"service": name}, failures) for name, _, failures in rows],
+        ),
+    ]
+
+
+register_collector(_circuit_metrics)
@@ -0,0 +1,99 @@
+import csv
+import json
+from typing import Dict, Iterator
+
+from django.conf import settings
+from django.db.models import QuerySet
+
+from .hos_logs import iter_hos_entries
+
+# trips per database round trip; each carries its whole hos_logs blob
+EXPORT_CHUNK_SIZE = getattr(settings, "TRIP_EXPORT_CHUNK_SIZE", 200)
+# rows are joined into writes of about this many bytes rather than sent one by one
+EXPORT_BUFFER_BYTES = 64 * 1024
+
+EXPORT_FIELDS = (
+    "trip_id",
+    "driver",
+    "trip_created_at",
+    "current_location",
+    "pickup_location",
+    "dropoff_location",
+    "day",
+    "activity",
+    "status",
+    "start",
+    "end",
+    "duration_hours",
+)
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class _Echo:
+    # csv.writer only needs write(); returning the line lets us yield it straight away
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_log_rows(queryset: QuerySet) -> Iterator[Dict]:
+    trips = (
+        queryset.select_related("created_by")
+        .only(
+            "id",
+            "created_at",
+            "current_location",
+            "pickup_location",
+            "dropoff_location",
+            "hos_logs",
+            "created_by__username",
+        )
+        .order_by("created_at", "id")
+    )
+    for trip in trips.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        trip_fields = {
+            "trip_id": trip.id,
+            "driver": trip.created_by.username if trip.created_by else None,
+            "trip_created_at": trip.created_at.isoformat(),
+            "current_location": trip.current_location,
+            "pickup_location": trip.pickup_location,
+            "dropoff_location": trip.dropoff_location,
+        }
+        for day, entry in iter_hos_entries(trip.hos_logs):
+            yield {
+                **trip_fields,
+                "day": day,
+                "activity": entry["activity"],
+                "status": entry["status"],
+                "start": entry["start"],
+                "end": entry["end"],
+                "duration_hours": entry["duration_hours"],
+            }
+
+
+def _lines(rows: Iterator[Dict], export_format: str) -> Iterator[str]:
+    if export_format == "csv":
+        writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_FIELDS)
+        yield writer.writeheader()
+        for row in rows:
+            yield writer.writerow(row)
+        return
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+def stream_log_export(queryset: QuerySet, export_format: str) -> Iterator[bytes]:
+    buffer = []
+    size = 0
+    for line in _lines(iter_log_rows(queryset), export_format):
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_BUFFER_BYTES:
+            yield "".join(buffer).encode("utf-8")
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
@@ -0,0 +1,197 @@
+"""Vectorized HOS feasibility over a grid of cycle hours x trip distances.
+
+hos_feasibility runs the same day-by-day state machine as
+hos._schedule_hos_events, for every grid cell at once: each step is applied
+under a mask of the cells it concerns, in the same order and with the same
+float arithmetic, so the results match the scalar planner exactly.
+"""
+from typing import Dict, Sequence
+
+import numpy as np
+from django.conf import settings
+
+from .hos import (
+    AVERAGE_SPEED_MPH,
+    BREAK_DURATION_HOURS,
+    BREAK_TRIGGER_DRIVING_HOURS,
+    CYCLE_LIMIT_HOURS,
+    DROPOFF_DURATION_HOURS,
+    FUELING_DURATION_HOURS,
+    FUELING_INTERVAL_MILES,
+    MAX_DRIVING_HOURS_PER_DAY,
+    MAX_ON_DUTY_HOURS_PER_DAY,
+    PICKUP_DURATION_HOURS,
+    SLEEPER_BERTH_HOURS,
+)
+from .hos_logs import MICROSECONDS_PER_DAY, hours_to_microseconds, hours_to_microseconds_array
+
+HOS_SWEEP_MAX_CELLS = getattr(settings, "HOS_SWEEP_MAX_CELLS", 250_000)
+
+_BREAK_US = hours_to_microseconds(BREAK_DURATION_HOURS)
+_FUELING_US = hours_to_microseconds(FUELING_DURATION_HOURS)
+_DROPOFF_US = hours_to_microseconds(DROPOFF_DURATION_HOURS)
+_SLEEPER_US = hours_to_microseconds(SLEEPER_BERTH_HOURS)
+
+
+def hos_feasibility(distances_miles: Sequence[float], cycles_used: Sequence[float]) -> Dict[str, np.ndarray]:
+    """Schedule every (cycle_used, distance) pair; arrays are shaped (len(cycles), len(distances)).
+
+    Returns the _schedule_hos_events fields days_planned, completion_day,
+    completion_offset (microseconds into completion_day), cycle_total,
+    distance_remaining and limit_reached. Cells whose cycle_used already
+    reaches the limit, which the scalar planner rejects, come back with
+    limit_reached set and nothing planned.
+    """
+    cycle_grid, distance_grid = np.meshgrid(
+        np.asarray(cycles_used, dtype=float), np.asarray(distances_miles, dtype=float), indexing="ij")
+    shape = cycle_grid.shape
+    size = cycle_grid.size
+
+    cycle_total = cycle_grid.ravel().copy()
+    distance_remaining = distance_grid.ravel().copy()
+    distance_since_fuel = np.zeros(size)
+    days_planned = np.zeros(size, dtype=np.int64)
+    day_index = np.ones(size, dtype=np.int64)
+    completion_day = np.ones(size, dtype=np.int64)
+    completion_offset = np.zeros(size, dtype=np.int64)
+    limit_reached = cycle_total >= CYCLE_LIMIT_HOURS
+    pickup_recorded = np.zeros(size, dtype=bool)
+    active = (distance_remaining > 0) & ~limit_reached
+
+    def complete(mask):
+        completion_day[mask] = day_index[mask]
+        completion_offset[mask] = now[mask]
+
+    while active.any():
+        out_of_cycle = active & (cycle_total >= CYCLE_LIMIT_HOURS)
+        limit_reached |= out_of_cycle
+        active &= ~out_of_cycle
+
+        now = np.zeros(size, dtype=np.int64)
+        driving_today = np.zeros(size)
+        on_duty_today = np.zeros(size)
+        hours_since_break = np.zeros(size)
+
+        # pre-trip inspection
+        pretrip_hours = np.minimum(0.5, CYCLE_LIMIT_HOURS - cycle_total)
+        no_time = active & (pretrip_hours <= 0)
+        limit_reached |= no_time
+        active &= ~no_time
+        now[active] += hours_to_microseconds_array(pretrip_hours[active])
+        on_duty_today[active] += pretrip_hours[active]
+        cycle_total[active] += pretrip_hours[active]
+        complete(active)
+
+        # pickup, first day only; running out here abandons the day unrecorded
+        pickup = active & ~pickup_recorded
+        pickup_hours = np.minimum(PICKUP_DURATION_HOURS, CYCLE_LIMIT_HOURS - cycle_total)
+        no_time = pickup & (pickup_hours <= 0)
+        limit_reached |= no_time
+        active &= ~no_time
+        pickup &= ~no_time
+        now[pickup] += hours_to_microseconds_array(pickup_hours[pickup])
+        on_duty_today[pickup] += pickup_hours[pickup]
+        cycle_total[pickup] += pickup_hours[pickup]
+        complete(pickup)
+        pickup_recorded |= pickup
+
+        driving = active.copy()
+        while True:
+            driving &= (distance_remaining > 0) & (cycle_total < CYCLE_LIMIT_HOURS)
+            driving &= (driving_today < MAX_DRIVING_HOURS_PER_DAY) & (on_duty_today < MAX_ON_DUTY_HOURS_PER_DAY)
+            if not driving.any():
+                break
+
+            drive_hours = np.minimum.reduce([
+                MAX_DRIVING_HOURS_PER_DAY - driving_today,
+                MAX_ON_DUTY_HOURS_PER_DAY - on_duty_today,
+                CYCLE_LIMIT_HOURS - cycle_total,
+                BREAK_TRIGGER_DRIVING_HOURS - hours_since_break,
+                distance_remaining / AVERAGE_SPEED_MPH,
+            ])
+
+            stalled = driving & (drive_hours <= 0)
+            take_break = (
+                stalled
+                & (hours_since_break >= BREAK_TRIGGER_DRIVING_HOURS)
+                & (on_duty_today < MAX_ON_DUTY_HOURS_PER_DAY)
+            )
+            now[take_break] += _BREAK_US
+            hours_since_break[take_break] = 0.0
+            complete(take_break)
+            driving &= ~(stalled & ~take_break)
+
+            drive = driving & ~stalled
+            hours = drive_hours[drive]
+            chunk = hours * AVERAGE_SPEED_MPH
+            now[drive] += hours_to_microseconds_array(hours)
+            driving_today[drive] += hours
+            on_duty_today[drive] += hours
+            hours_since_break[drive] += hours
+            cycle_total[drive] += hours
+            distance_remaining[drive] -= chunk
+            distance_since_fuel[drive] += chunk
+            complete(drive)
+
+            arrived = drive & (distance_remaining <= 0)
+            driving &= ~arrived
+            drive &= ~arrived
+
+            fuel = drive & (distance_since_fuel >= FUELING_INTERVAL_MILES)
+            no_time = fuel & (cycle_total + FUELING_DURATION_HOURS > CYCLE_LIMIT_HOURS)
+            limit_reached |= no_time
+            driving &= ~no_time
+            drive &= ~no_time
+            fuel &= ~no_time
+            now[fuel] += _FUELING_US
+            on_duty_today[fuel] += FUELING_DURATION_HOURS
+            cycle_total[fuel] += FUELING_DURATION_HOURS
+            complete(fuel)
+            distance_since_fuel[fuel] = 0.0
+
+            out_of_cycle = drive & (cycle_total >= CYCLE_LIMIT_HOURS)
+            limit_reached |= out_of_cycle
+            driving &= ~out_of_cycle
+
+        # end of day: dropoff if arrived, otherwise the sleeper berth if cycle hours remain
+        arrived = active & (distance_remaining <= 0)
+        dropoff = arrived & (cycle_total + DROPOFF_DURATION_HOURS <= CYCLE_LIMIT_HOURS)
+        now[dropoff] += _DROPOFF_US
+        cycle_total[dropoff] += DROPOFF_DURATION_HOURS
+        complete(dropoff)
+        en_route = active & ~arrived
+        sleeper = en_route & (cycle_total < CYCLE_LIMIT_HOURS)
+        now[sleeper] += _SLEEPER_US
+        complete(sleeper)
+        limit_reached |= en_route & ~sleeper
+
+        days_planned[active] += 1
+        active &= ~(arrived | limit_reached)
+        day_index[active] += 1
+
+    return {
+        "days_planned": days_planned.reshape(shape),
+        "completion_day": completion_day.reshape(shape),
+        "completion_offset": completion_offset.reshape(shape),
+        "cycle_total": cycle_total.reshape(shape),
+        "distance_remaining": distance_remaining.reshape(shape),
+        "limit_reached": limit_reached.reshape(shape),
+    }
+
+
+def feasibility_sweep(distances_miles: Sequence[float], cycles_used: Sequence[float]) -> Dict:
+    if len(distances_miles) * len(cycles_used) > HOS_SWEEP_MAX_CELLS:
+        raise ValueError(f"A sweep may have at most {HOS_SWEEP_MAX_CELLS} cells.")
+    result = hos_feasibility(distances_miles, cycles_used)
+    # completion measured from the start of day 1 (08:00 on the planning day)
+    completion_hours = (
+        (result["completion_day"] - 1) * MICROSECONDS_PER_DAY + result["completion_offset"]
+    ) / 3_600_000_000
+    return {
+        "distances_miles": list(distances_miles),
+        "cycles_used": list(cycles_used),
+        "days_planned": result["days_planned"].tolist(),
+        "completion_hours": np.round(completion_hours, 4).tolist(),
+        "cycle_limit_reached": result["limit_reached"].tolist(),
+        "remaining_distance_miles": np.round(np.maximum(result["distance_remaining"], 0), 2).tolist(),
+    }
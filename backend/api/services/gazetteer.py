@@ -0,0 +1,151 @@
+"""Offline gazetteer of known places with a sorted-key prefix index.
+
+Places are loaded once from GAZETTEER_PATH, a CSV (name, state, latitude,
+longitude, population) or a JSON list of objects with the same keys. Each
+place is indexed under a handful of normalized keys ("st louis",
+"st louis mo", "st louis missouri"); exact lookups and prefix searches are
+both a bisect into the sorted key list.
+"""
+import csv
+import json
+import logging
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+GAZETTEER_PATH = getattr(
+    settings, "GAZETTEER_PATH", Path(__file__).resolve().parent.parent / "data" / "gazetteer.csv")
+
+logger = logging.getLogger(__name__)
+
+# prefix searches stop after this many index keys so one-letter queries stay cheap
+_MAX_PREFIX_SCAN = 2000
+
+US_STATES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+    "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "DC": "District of Columbia",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois",
+    "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana",
+    "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota",
+    "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon",
+    "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota",
+    "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia",
+    "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming",
+}
+
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+_COUNTRY_SUFFIX_RE = re.compile(r"\s+(usa|us|united states( of america)?)$")
+
+
+def normalize_place(text: str) -> str:
+    text = _NON_WORD_RE.sub(" ", text.lower())
+    return _COUNTRY_SUFFIX_RE.sub("", " ".join(text.split()))
+
+
+class Gazetteer:
+    def __init__(self, records: List[Dict]):
+        self.names: List[str] = []
+        self.states: List[str] = []
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.populations = array("L")
+
+        entries = []
+        for record in records:
+            place = len(self.names)
+            name = record["name"].strip()
+            state = (record.get("state") or "").strip().upper()
+            self.names.append(name)
+            self.states.append(state)
+            self.latitudes.append(float(record["latitude"]))
+            self.longitudes.append(float(record["longitude"]))
+            self.populations.append(int(record.get("population") or 0))
+
+            keys = {normalize_place(name)}
+            if state:
+                keys.add(normalize_place(f"{name} {state}"))
+                if state in US_STATES:
+                    keys.add(normalize_place(f"{name} {US_STATES[state]}"))
+            entries.extend((key, place) for key in keys)
+
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.key_places = array("L", (place for _, place in entries))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def label(self, place: int) -> str:
+        state = self.states[place]
+        return f"{self.names[place]}, {state}" if state else self.names[place]
+
+    def place(self, place: int) -> Dict:
+        state = self.states[place]
+        return {
+            "label": self.label(place),
+            "value": self.label(place),
+            "state": state,
+            "latitude": self.latitudes[place],
+            "longitude": self.longitudes[place],
+            "display_name": f"{self.label(place)}, United States" if state in US_STATES else self.label(place),
+        }
+
+    def lookup(self, query: str) -> Optional[Dict]:
+        key = normalize_place(query)
+        if not key:
+            return None
+        index = bisect_left(self.keys, key)
+        best = None
+        # a bare city name can match several places; prefer the largest
+        while index < len(self.keys) and self.keys[index] == key:
+            place = self.key_places[index]
+            if best is None or self.populations[place] > self.populations[best]:
+                best = place
+            index += 1
+        return None if best is None else self.place(best)
+
+    def search(self, prefix: str, limit: int = 10) -> List[Dict]:
+        key = normalize_place(prefix)
+        if not key:
+            return []
+        index = bisect_left(self.keys, key)
+        matches = set()
+        end = min(len(self.keys), index + _MAX_PREFIX_SCAN)
+        while index < end and self.keys[index].startswith(key):
+            matches.add(self.key_places[index])
+            index += 1
+        ranked = sorted(matches, key=lambda place: (-self.populations[place], self.label(place)))
+        return [self.place(place) for place in ranked[:limit]]
+
+
+def load_records(path) -> List[Dict]:
+    path = Path(path)
+    with path.open(encoding="utf-8", newline="") as handle:
+        if path.suffix.lower() == ".json":
+            return json.load(handle)
+        return list(csv.DictReader(handle))
+
+
+_gazetteer: Optional[Gazetteer] = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                try:
+                    records = load_records(GAZETTEER_PATH)
+                except (OSError, ValueError) as exc:
+                    logger.warning("Could not load gazetteer from %s: %s", GAZETTEER_PATH, exc)
+                    records = []
+                _gazetteer = Gazetteer(records)
+    return _gazetteer
@@ -1,16 +1,54 @@
 import hashlib
 import logging
 import math
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 import requests
+from django.conf import settings
+from django.db import DatabaseError
 from django.utils import timezone
-from geopy.distance import geodesic
 from geopy.exc import GeocoderServiceError, GeocoderTimedOut, GeocoderUnavailable
 from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
 
+from ..models import GeocodeCacheEntry
+from .cache import CACHE_MISS, LRUCache
+from .circuit import CircuitBreaker
+from .gazetteer import get_gazetteer
+from .geodesy import PathInterpolator, path_distances
+from .hos_logs import (
+    BREAK,
+    DRIVING,
+    DROPOFF,
+    FUELING,
+    PICKUP,
+    PRETRIP,
+    SLEEPER,
+    HosEntries,
+    hours_to_microseconds,
+)
+from .http import HTTP_USER_AGENT, SharedSessionAdapter, TokenBucket, get_session
+from .http import timeout as http_timeout
+from .metrics import (
+    METRICS_ENABLED,
+    ROUTE_FALLBACKS,
+    UPSTREAM_REQUESTS,
+    UPSTREAM_SECONDS,
+    increment,
+    register_collector,
+    stage,
+)
+from .polyline import FULL_LEVEL, build_geometry, decode_polyline
+from .singleflight import MISSING, SingleFlight
+from .spatial import get_place_index
+from .trip_geometry import load_trip_geometry
+
 # the constrants below are based on US FMCSA regulations for property-carrying drivers
 AVERAGE_SPEED_MPH = 55
 MAX_DRIVING_HOURS_PER_DAY = 11
@@ -23,14 +61,263 @@ DROPOFF_DURATION_HOURS = 1
 FUELING_INTERVAL_MILES = 1000
 FUELING_DURATION_HOURS = 1
 CYCLE_LIMIT_HOURS = 70
+# OSRM distances have always been stored with this factor; geodesy.METERS_PER_MILE is the
+# exact one, but switching would shift stored trip distances against older plans
+ROUTE_METERS_PER_MILE = 1609.34
+
+GEOCODE_CACHE_MAX_ENTRIES = getattr(settings, "GEOCODE_CACHE_MAX_ENTRIES", 2048)
+GEOCODE_CACHE_TTL_SECONDS = getattr(
+    settings, "GEOCODE_CACHE_TTL_SECONDS", 30 * 24 * 3600)
+GEOCODE_CACHE_NEGATIVE_TTL_SECONDS = getattr(
+    settings, "GEOCODE_CACHE_NEGATIVE_TTL_SECONDS", 24 * 3600)
+# GeocodeCacheEntry.query_key's max_length
+GEOCODE_QUERY_KEY_MAX_LENGTH = 255
+
+GEOCODE_MAX_WORKERS = getattr(settings, "GEOCODE_MAX_WORKERS", 4)
+# pinned map locations are labelled after the nearest known place within this radius
+PINNED_SNAP_RADIUS_MILES = getattr(settings, "PINNED_SNAP_RADIUS_MILES", 50)
+# planned fuel stops are matched to a known fuel station within this radius
+
+# point these at self-hosted instances to lift the public servers' limits
+OSRM_BASE_URL = getattr(settings, "OSRM_BASE_URL", "https://router.project-osrm.org")
+OSRM_PROFILE = getattr(settings, "OSRM_PROFILE", "driving")
+OSRM_READ_TIMEOUT_SECONDS = getattr(settings, "OSRM_READ_TIMEOUT_SECONDS", 15)
+NOMINATIM_BASE_URL = getattr(settings, "NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org")
+NOMINATIM_READ_TIMEOUT_SECONDS = getattr(settings, "NOMINATIM_READ_TIMEOUT_SECONDS", 10)
+NOMINATIM_MIN_DELAY_SECONDS = getattr(settings, "NOMINATIM_MIN_DELAY_SECONDS", 1)
+
+ROUTE_CACHE_MAX_ENTRIES = getattr(settings, "ROUTE_CACHE_MAX_ENTRIES", 512)
+ROUTE_CACHE_COORD_PRECISION = getattr(settings, "ROUTE_CACHE_COORD_PRECISION", 4)
+ROUTE_CACHE_TTL_SECONDS = getattr(settings, "ROUTE_CACHE_TTL_SECONDS", 7 * 24 * 3600)
+ROUTE_CACHE_FALLBACK_TTL_SECONDS = getattr(
+    settings, "ROUTE_CACHE_FALLBACK_TTL_SECONDS", 5 * 60)
 
 logger = logging.getLogger(__name__)
 
-_geolocator = Nominatim(user_agent="RouteLogPro/1.0", timeout=10)
-_geocode = RateLimiter(_geolocator.geocode, min_delay_seconds=1, max_retries=3)
+_nominatim_url = urlsplit(NOMINATIM_BASE_URL)
+_geolocator = Nominatim(
+    user_agent=HTTP_USER_AGENT,
+    domain=f"{_nominatim_url.netloc}{_nominatim_url.path}".rstrip("/"),
+    scheme=_nominatim_url.scheme or "https",
+    timeout=http_timeout(NOMINATIM_READ_TIMEOUT_SECONDS),
+    adapter_factory=SharedSessionAdapter,
+)
+# one Nominatim budget per process, drawn on by this path and by async_planning
+nominatim_bucket = TokenBucket(1 / NOMINATIM_MIN_DELAY_SECONDS if NOMINATIM_MIN_DELAY_SECONDS else None)
+
+
+def _paced_geocode(query: str):
+    nominatim_bucket.wait()
+    return _geolocator.geocode(query)
+
+
+# pacing (retries included) comes from the shared bucket, so RateLimiter adds no delay of its own
+_geocode = RateLimiter(_paced_geocode, min_delay_seconds=0, max_retries=3)
+
+_geocode_executor = ThreadPoolExecutor(
+    max_workers=GEOCODE_MAX_WORKERS, thread_name_prefix="geocode")
+
+# the route and table services share one OSRM circuit
+osrm_breaker = CircuitBreaker("osrm")
+nominatim_breaker = CircuitBreaker("nominatim")
+
+# identical lookups already in flight (here or in another worker) are waited on, not repeated
+_geocode_flights = SingleFlight("geocode")
+_route_flights = SingleFlight("route")
+
+_PINNED_LOCATION_RE = re.compile(
+    r'Pinned location \((-?\d+\.\d+),\s*(-?\d+\.\d+)\)')
+
+def normalize_query(query: str) -> str:
+    normalized = " ".join(query.lower().split())
+    if len(normalized) <= GEOCODE_QUERY_KEY_MAX_LENGTH:
+        return normalized
+    # a plain cut would let long queries sharing a prefix share a cache entry
+    digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    return f"{normalized[:GEOCODE_QUERY_KEY_MAX_LENGTH - len(digest) - 1]}#{digest}"
+
+
+class GeocodeCache:
+    """In-process LRU in front of the GeocodeCacheEntry table.
+
+    Values are either a dict with latitude/longitude/display_name or None
+    for a negative ("no result") entry.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, negative_ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._memory = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, query: str):
+        key = normalize_query(query)
+        value = self._memory.get(key)
+        if value is not CACHE_MISS:
+            return value
+
+        value = self._load(key)
+        with self._lock:
+            if value is CACHE_MISS:
+                self.misses += 1
+            else:
+                self.db_hits += 1
+        return value
+
+    def set(self, query: str, value: Optional[Dict]) -> None:
+        key = normalize_query(query)
+        ttl = self.ttl_seconds if value is not None else self.negative_ttl_seconds
+        expires_at = timezone.now() + timedelta(seconds=ttl)
+        self._memory.set(key, value, expires_at.timestamp())
+        try:
+            GeocodeCacheEntry.objects.update_or_create(
+                query_key=key,
+                defaults={
+                    "latitude": value["latitude"] if value else None,
+                    "longitude": value["longitude"] if value else None,
+                    "display_name": value["display_name"] if value else "",
+                    "found": value is not None,
+                    "expires_at": expires_at,
+                },
+            )
+        except DatabaseError as exc:
+            logger.warning("Could not persist geocode cache entry for '%s': %s", key, exc)
+
+    def clear(self) -> None:
+        self._memory.clear()
+        with self._lock:
+            self.db_hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "memory_hits": self._memory.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "size": len(self._memory),
+            }
+
+    def _load(self, key: str):
+        try:
+            entry = GeocodeCacheEntry.objects.filter(
+                query_key=key, expires_at__gt=timezone.now()
+            ).first()
+        except DatabaseError as exc:
+            logger.warning("Geocode cache lookup failed for '%s': %s", key, exc)
+            return CACHE_MISS
+        if entry is None:
+            return CACHE_MISS
+
+        value = None
+        if entry.found:
+            value = {
+                "latitude": entry.latitude,
+                "longitude": entry.longitude,
+                "display_name": entry.display_name,
+            }
+        self._memory.set(key, value, entry.expires_at.timestamp())
+        return value
+
+
+class RouteCache:
+    """Size-bounded cache of routes keyed by the ordered, rounded waypoints.
+
+    Routes produced by fallback_route expire after fallback_ttl_seconds so
+    the cache picks up real OSRM geometry once the router is reachable again.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        precision: int,
+        ttl_seconds: float,
+        fallback_ttl_seconds: float,
+    ):
+        self.precision = precision
+        self.ttl_seconds = ttl_seconds
+        self.fallback_ttl_seconds = fallback_ttl_seconds
+        self._memory = LRUCache(max_entries)
+
+    def key_for(self, points: List[Dict]) -> Tuple[Tuple[float, float], ...]:
+        return tuple(
+            (round(point["latitude"], self.precision),
+             round(point["longitude"], self.precision))
+            for point in points
+        )
+
+    def get(self, points: List[Dict]):
+        route = self._memory.get(self.key_for(points))
+        if route is CACHE_MISS:
+            return route
+        return dict(route)
+
+    def set(self, points: List[Dict], route: Dict) -> None:
+        ttl = self.fallback_ttl_seconds if route.get("fallback") else self.ttl_seconds
+        entry = {
+            "distance_miles": route["distance_miles"],
+            "duration_hours": route["duration_hours"],
+            "polyline": route["polyline"],
+            "legs": route["legs"],
+            "fallback": route.get("fallback", False),
+        }
+        self._memory.set(self.key_for(points), entry, time.time() + ttl)
+
+    def clear(self) -> None:
+        self._memory.clear()
 
+    def stats(self) -> Dict:
+        return {
+            "hits": self._memory.hits,
+            "misses": self._memory.misses,
+            "size": len(self._memory),
+        }
+
+
+_geocode_cache = GeocodeCache(
+    max_entries=GEOCODE_CACHE_MAX_ENTRIES,
+    ttl_seconds=GEOCODE_CACHE_TTL_SECONDS,
+    negative_ttl_seconds=GEOCODE_CACHE_NEGATIVE_TTL_SECONDS,
+)
+route_cache = RouteCache(
+    max_entries=ROUTE_CACHE_MAX_ENTRIES,
+    precision=ROUTE_CACHE_COORD_PRECISION,
+    ttl_seconds=ROUTE_CACHE_TTL_SECONDS,
+    fallback_ttl_seconds=ROUTE_CACHE_FALLBACK_TTL_SECONDS,
+)
+
+
+def _cache_metrics() -> List[Tuple]:
+    geocode = _geocode_cache.stats()
+    route = route_cache.stats()
+    return [
+        (
+            "routelog_cache_lookups_total",
+            "counter",
+            "Geocode and route cache lookups by result.",
+            [
+                ({"cache": "geocode", "result": "memory_hit"}, geocode["memory_hits"]),
+                ({"cache": "geocode", "result": "db_hit"}, geocode["db_hits"]),
+                ({"cache": "geocode", "result": "miss"}, geocode["misses"]),
+                ({"cache": "route", "result": "hit"}, route["hits"]),
+                ({"cache": "route", "result": "miss"}, route["misses"]),
+            ],
+        ),
+        (
+            "routelog_cache_entries",
+            "gauge",
+            "Entries held in each in-process cache.",
+            [({"cache": "geocode"}, geocode["size"]), ({"cache": "route"}, route["size"])],
+        ),
+    ]
 
-def _approximate_location(query: str) -> Dict:
+
+register_collector(_cache_metrics)
+
+
+def approximate_location(query: str) -> Dict:
     digest = hashlib.sha256(query.lower().encode("utf-8")).digest()
     lat_seed = int.from_bytes(digest[:4], "big") / 0xFFFFFFFF
     lon_seed = int.from_bytes(digest[4:8], "big") / 0xFFFFFFFF
@@ -48,10 +335,18 @@ def _approximate_location(query: str) -> Dict:
     }
 
 
-def _geocode_location(query: str) -> Dict:
+def _pinned_display_name(lat: float, lng: float) -> str:
+    place = get_place_index().nearest(lat, lng, max_miles=PINNED_SNAP_RADIUS_MILES)
+    if place is None:
+        return f"Pinned location ({lat:.4f}, {lng:.4f})"
+    if place["distance_miles"] < 1:
+        return place["display_name"]
+    return f"{place['distance_miles']:.0f} mi from {place['display_name']} ({lat:.4f}, {lng:.4f})"
+
+
+def resolve_locally(query: str) -> Optional[Dict]:
     # Check if this is already a coordinate string from map selection
-    import re
-    coord_match = re.search(r'Pinned location \((-?\d+\.\d+),\s*(-?\d+\.\d+)\)', query)
+    coord_match = _PINNED_LOCATION_RE.search(query)
     if coord_match:
         lat = float(coord_match.group(1))
         lng = float(coord_match.group(2))
@@ -59,48 +354,170 @@ def _geocode_location(query: str) -> Dict:
             "query": query,
             "latitude": lat,
             "longitude": lng,
-            "display_name": f"Pinned location ({lat:.4f}, {lng:.4f})",
+            "display_name": _pinned_display_name(lat, lng),
             "approximate": False,
         }
 
+    place = get_gazetteer().lookup(query)
+    if place is not None:
+        return {
+            "query": query,
+            "latitude": place["latitude"],
+            "longitude": place["longitude"],
+            "display_name": place["display_name"],
+            "approximate": False,
+        }
+
+    cached = _geocode_cache.get(query)
+    if cached is not CACHE_MISS:
+        if cached is None:
+            return approximate_location(query)
+        return {"query": query, **cached, "approximate": False}
+
+    return None
+
+
+def _geocode_location(query: str) -> Dict:
+    local = resolve_locally(query)
+    if local is not None:
+        return local
+    return _geocode_remote(query)
+
+
+def _geocode_remote(query: str) -> Dict:
+    return _geocode_pending([query])[query]
+
+
+def _geocode_pending(pending: List[str]) -> Dict[str, Dict]:
+    flights = {query: _geocode_flights.begin(normalize_query(query)) for query in pending}
+    resolved: Dict[str, Dict] = {}
+    lookups: List[str] = []
+    for query, (flight, leader) in flights.items():
+        if leader:
+            shared = _geocode_flights.wait_remote(flight)
+            if shared is MISSING:
+                lookups.append(query)
+            else:
+                resolved[query] = {**shared, "query": query}
+
+    error = None
+    if lookups:
+        try:
+            resolved.update(_lookup_pending(lookups))
+        except BaseException as exc:
+            error = exc
+    for query, (flight, leader) in flights.items():
+        if not leader:
+            continue
+        if query in resolved:
+            _geocode_flights.finish(normalize_query(query), flight, resolved[query])
+        else:
+            _geocode_flights.abandon(normalize_query(query), flight, error)
+    if error is not None:
+        raise error
+
+    # followers last, so two callers leading each other's queries cannot deadlock
+    for query, (flight, leader) in flights.items():
+        if not leader:
+            resolved[query] = {**flight.wait(), "query": query}
+    return resolved
+
+
+def _lookup_pending(pending: List[str]) -> Dict[str, Dict]:
+    # cache writes and circuit bookkeeping stay on this thread: they touch the database
+    if not nominatim_breaker.allow():
+        return {query: approximate_location(query) for query in pending}
+
+    if len(pending) == 1:
+        results = {pending[0]: _query_geocoder(pending[0])}
+    else:
+        futures = {query: _geocode_executor.submit(_query_geocoder, query) for query in pending}
+        results = {query: future.result() for query, future in futures.items()}
+    return record_geocodes(results)
+
+
+def record_geocodes(results: Dict[str, Tuple[Dict, object]]) -> Dict[str, Dict]:
+    # caches _query_geocoder results and reports the outcome to the Nominatim circuit
+    resolved: Dict[str, Dict] = {}
+    failures = 0
+    for query, (result, cache_value) in results.items():
+        resolved[query] = result
+        if cache_value is CACHE_MISS:
+            failures += 1
+        else:
+            _geocode_cache.set(query, cache_value)
+    if failures < len(results):
+        nominatim_breaker.record_success()
+    else:
+        nominatim_breaker.record_failure(failures)
+    return resolved
+
+
+def _query_geocoder(query: str) -> Tuple[Dict, object]:
+    # returns the location plus the value to cache (CACHE_MISS for transient errors);
+    # it does not touch the database so it can run on the geocode worker threads
+    started = time.perf_counter()
     try:
         location = _geocode(query)
     except (GeocoderTimedOut, GeocoderUnavailable, GeocoderServiceError, requests.RequestException) as exc:
         logger.warning("Geocoder unavailable for '%s': %s", query, exc)
-        return _approximate_location(query)
+        record_upstream("nominatim", "error", started)
+        return approximate_location(query), CACHE_MISS
     except Exception as exc:  # unexpected geocoder errors
         logger.warning("Unexpected geocoding error for '%s': %s", query, exc)
-        return _approximate_location(query)
+        record_upstream("nominatim", "error", started)
+        return approximate_location(query), CACHE_MISS
 
     if not location:
         logger.info(
             "No geocoding result for '%s'; using approximate coordinates", query)
-        return _approximate_location(query)
+        record_upstream("nominatim", "not_found", started)
+        return approximate_location(query), None
+    record_upstream("nominatim", "ok", started)
 
-    return {
-        "query": query,
+    resolved = {
         "latitude": location.latitude,
         "longitude": location.longitude,
         "display_name": location.address,
-        "approximate": False,
     }
+    return {"query": query, **resolved, "approximate": False}, resolved
+
+
+def geocode_locations(queries: List[str]) -> List[Dict]:
+    """Resolve several queries, running only the network lookups concurrently.
+
+    Pinned coordinates and cache hits are answered inline; the remaining
+    distinct queries share the process-wide Nominatim token bucket, which
+    spaces out the actual Nominatim calls.
+    """
+    resolved: Dict[str, Dict] = {}
+    pending: List[str] = []
+    for query in queries:
+        if query in resolved or query in pending:
+            continue
+        local = resolve_locally(query)
+        if local is not None:
+            resolved[query] = local
+        else:
+            pending.append(query)
 
+    if pending:
+        resolved.update(_geocode_pending(pending))
 
-def _fallback_route(points: List[Dict]) -> Dict:
-    total_distance = 0.0
-    legs_summary = []
-    for index in range(len(points) - 1):
-        start = (points[index]["latitude"], points[index]["longitude"])
-        end = (points[index + 1]["latitude"], points[index + 1]["longitude"])
-        distance_miles = geodesic(start, end).miles
-        total_distance += distance_miles
-        legs_summary.append(
-            {
-                "segment": index + 1,
-                "distance_miles": round(distance_miles, 2),
-                "duration_hours": round(distance_miles / AVERAGE_SPEED_MPH, 2),
-            }
-        )
+    return [dict(resolved[query]) for query in queries]
+
+
+def fallback_route(points: List[Dict]) -> Dict:
+    distances = path_distances([(point["latitude"], point["longitude"]) for point in points])
+    total_distance = distances.total
+    legs_summary = [
+        {
+            "segment": index + 1,
+            "distance_miles": round(float(distance_miles), 2),
+            "duration_hours": round(float(distance_miles) / AVERAGE_SPEED_MPH, 2),
+        }
+        for index, distance_miles in enumerate(distances.legs)
+    ]
     duration_hours = total_distance / AVERAGE_SPEED_MPH if total_distance else 0
     return {
         "distance_miles": round(total_distance, 2),
@@ -116,22 +533,57 @@ def _fetch_route(points: List[Dict]) -> Dict:
         raise ValueError(
             "At least two locations are required to build a route.")
 
+    cached = route_cache.get(points)
+    if cached is not CACHE_MISS:
+        return cached
+
+    route = _route_flights.run(route_cache.key_for(points), lambda: _request_route(points))
+    route_cache.set(points, route)
+    return route
+
+
+def record_upstream(service: str, outcome: str, started: float) -> None:
+    if METRICS_ENABLED:
+        UPSTREAM_REQUESTS.inc(service, outcome)
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, service)
+
+
+def route_url(points: List[Dict]) -> str:
     coordinates = ";".join(
         f"{point['longitude']},{point['latitude']}" for point in points
     )
-    url = f"https://router.project-osrm.org/route/v1/driving/{coordinates}"
-    params = {"overview": "full", "geometries": "geojson", "steps": "false"}
+    return f"{OSRM_BASE_URL.rstrip('/')}/route/v1/{OSRM_PROFILE}/{coordinates}"
+
+
+OSRM_ROUTE_PARAMS = {"overview": "full", "geometries": "geojson", "steps": "false"}
+
+
+def _request_route(points: List[Dict]) -> Dict:
+    if not osrm_breaker.allow():
+        increment(ROUTE_FALLBACKS, "circuit_open")
+        return fallback_route(points)
 
+    started = time.perf_counter()
     try:
-        response = requests.get(url, params=params, timeout=15)
+        response = get_session().get(
+            route_url(points), params=OSRM_ROUTE_PARAMS, timeout=http_timeout(OSRM_READ_TIMEOUT_SECONDS))
         response.raise_for_status()
     except (requests.RequestException, ValueError):
-        return _fallback_route(points)
+        record_upstream("osrm", "error", started)
+        osrm_breaker.record_failure()
+        increment(ROUTE_FALLBACKS, "upstream_error")
+        return fallback_route(points)
+    osrm_breaker.record_success()
+    return route_from_payload(response.json(), points, started)
 
-    payload = response.json()
+
+def route_from_payload(payload: Dict, points: List[Dict], started: float) -> Dict:
     routes = payload.get("routes")
     if not routes:
-        return _fallback_route(points)
+        record_upstream("osrm", "no_route", started)
+        increment(ROUTE_FALLBACKS, "no_route")
+        return fallback_route(points)
+    record_upstream("osrm", "ok", started)
 
     route = routes[0]
     geometry = route.get("geometry", {}).get("coordinates", [])
@@ -142,13 +594,13 @@ def _fetch_route(points: List[Dict]) -> Dict:
         legs_summary.append(
             {
                 "segment": index + 1,
-                "distance_miles": round(leg["distance"] / 1609.34, 2),
+                "distance_miles": round(leg["distance"] / ROUTE_METERS_PER_MILE, 2),
                 "duration_hours": round(leg["duration"] / 3600, 2),
             }
         )
 
     return {
-        "distance_miles": round(route["distance"] / 1609.34, 2),
+        "distance_miles": round(route["distance"] / ROUTE_METERS_PER_MILE, 2),
         "duration_hours": round(route["duration"] / 3600, 2),
         "polyline": [[lat, lon] for lon, lat in geometry] if geometry else [
             [point["latitude"], point["longitude"]] for point in points
@@ -158,35 +610,30 @@ def _fetch_route(points: List[Dict]) -> Dict:
     }
 
 
-def _generate_hos_plan(distance_miles: float, cycle_used: float) -> Dict:
-    cycle_total = float(cycle_used)
-    initial_cycle = cycle_total
-    if cycle_total >= CYCLE_LIMIT_HOURS:
-        raise ValueError("Driver has no remaining cycle hours available.")
+def _schedule_hos_events(distance_miles: float, cycle_used: float) -> Dict:
+    """Work out the HOS schedule one event at a time into an HosEntries.
 
-    start_of_day = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
+    Time is tracked as integer microseconds into the current day, so the
+    planning loop does no datetime or string work; _render_hos_plan turns
+    the entries into timestamps afterwards.
+    """
+    cycle_total = float(cycle_used)
     distance_remaining = distance_miles
-    logs = []
-    stops: List[Dict] = []
     distance_since_fuel = 0.0
-    fueling_index = 1
-    pickup_timestamp: Optional[str] = None
-    dropoff_timestamp: Optional[str] = None
-    total_on_duty_hours = 0.0
-    completion_time = start_of_day
-
-    day_index = 1
+    entries = HosEntries()
+    days_planned = 0
+    completion = (1, 0)
     limit_reached = False
     pickup_recorded = False
+    day_index = 1
 
     while distance_remaining > 0:
         if cycle_total >= CYCLE_LIMIT_HOURS:
             limit_reached = True
             break
 
-        day_start = start_of_day + timedelta(days=day_index - 1)
-        current_time = day_start
-        day_entries: List[Dict] = []
+        events: List[Tuple[int, int, float]] = []
+        now = 0
         driving_today = 0.0
         on_duty_today = 0.0
         hours_since_break = 0.0
@@ -196,20 +643,11 @@ def _generate_hos_plan(distance_miles: float, cycle_used: float) -> Dict:
         if pretrip_hours <= 0:
             limit_reached = True
             break
-        day_entries.append(
-            {
-                "activity": "Pre-Trip Inspection",
-                "status": "On Duty",
-                "start": current_time.isoformat(),
-                "end": (current_time + timedelta(hours=pretrip_hours)).isoformat(),
-                "duration_hours": round(pretrip_hours, 2),
-            }
-        )
-        current_time += timedelta(hours=pretrip_hours)
+        events.append((PRETRIP, now, pretrip_hours))
+        now += hours_to_microseconds(pretrip_hours)
         on_duty_today += pretrip_hours
         cycle_total += pretrip_hours
-        total_on_duty_hours += pretrip_hours
-        completion_time = current_time
+        completion = (day_index, now)
 
         if not pickup_recorded:
             pickup_hours = min(PICKUP_DURATION_HOURS,
@@ -217,28 +655,12 @@ def _generate_hos_plan(distance_miles: float, cycle_used: float) -> Dict:
             if pickup_hours <= 0:
                 limit_reached = True
                 break
-            pickup_entry = {
-                "activity": "Pickup Service",
-                "status": "On Duty",
-                "start": current_time.isoformat(),
-                "end": (current_time + timedelta(hours=pickup_hours)).isoformat(),
-                "duration_hours": round(pickup_hours, 2),
-            }
-            day_entries.append(pickup_entry)
-            pickup_timestamp = pickup_entry["end"]
-            current_time += timedelta(hours=pickup_hours)
+            events.append((PICKUP, now, pickup_hours))
+            now += hours_to_microseconds(pickup_hours)
             on_duty_today += pickup_hours
             cycle_total += pickup_hours
-            total_on_duty_hours += pickup_hours
-            completion_time = current_time
+            completion = (day_index, now)
             pickup_recorded = True
-            stops.append(
-                {
-                    "type": "Pickup",
-                    "details": "Pickup service completed",
-                    "timestamp": pickup_timestamp,
-                }
-            )
 
         while distance_remaining > 0 and cycle_total < CYCLE_LIMIT_HOURS:
             if (
@@ -247,54 +669,36 @@ def _generate_hos_plan(distance_miles: float, cycle_used: float) -> Dict:
             ):
                 break
 
-            break_limit = BREAK_TRIGGER_DRIVING_HOURS - hours_since_break
-            drive_capacity = min(
+            drive_hours = min(
                 MAX_DRIVING_HOURS_PER_DAY - driving_today,
                 MAX_ON_DUTY_HOURS_PER_DAY - on_duty_today,
                 CYCLE_LIMIT_HOURS - cycle_total,
-                break_limit,
+                BREAK_TRIGGER_DRIVING_HOURS - hours_since_break,
+                distance_remaining / AVERAGE_SPEED_MPH,
             )
 
-            distance_hours_possible = distance_remaining / AVERAGE_SPEED_MPH
-            drive_hours = min(drive_capacity, distance_hours_possible)
-
             if drive_hours <= 0:
                 if (
                     hours_since_break >= BREAK_TRIGGER_DRIVING_HOURS
                     and on_duty_today < MAX_ON_DUTY_HOURS_PER_DAY
                 ):
-                    break_entry = {
-                        "activity": "30-Minute Break",
-                        "status": "Off Duty",
-                        "start": current_time.isoformat(),
-                        "end": (current_time + timedelta(hours=BREAK_DURATION_HOURS)).isoformat(),
-                        "duration_hours": BREAK_DURATION_HOURS,
-                    }
-                    day_entries.append(break_entry)
-                    current_time += timedelta(hours=BREAK_DURATION_HOURS)
+                    events.append((BREAK, now, BREAK_DURATION_HOURS))
+                    now += hours_to_microseconds(BREAK_DURATION_HOURS)
                     hours_since_break = 0.0
-                    completion_time = current_time
+                    completion = (day_index, now)
                     continue
                 break
 
             distance_chunk = drive_hours * AVERAGE_SPEED_MPH
-            drive_entry = {
-                "activity": "Driving",
-                "status": "Driving",
-                "start": current_time.isoformat(),
-                "end": (current_time + timedelta(hours=drive_hours)).isoformat(),
-                "duration_hours": round(drive_hours, 2),
-            }
-            day_entries.append(drive_entry)
-            current_time += timedelta(hours=drive_hours)
+            events.append((DRIVING, now, drive_hours))
+            now += hours_to_microseconds(drive_hours)
             driving_today += drive_hours
             on_duty_today += drive_hours
             hours_since_break += drive_hours
             cycle_total += drive_hours
-            total_on_duty_hours += drive_hours
             distance_remaining -= distance_chunk
             distance_since_fuel += distance_chunk
-            completion_time = current_time
+            completion = (day_index, now)
 
             if distance_remaining <= 0:
                 break
@@ -303,121 +707,235 @@ def _generate_hos_plan(distance_miles: float, cycle_used: float) -> Dict:
                 if cycle_total + FUELING_DURATION_HOURS > CYCLE_LIMIT_HOURS:
                     limit_reached = True
                     break
-                fuel_entry = {
-                    "activity": "Fueling",
-                    "status": "On Duty",
-                    "start": current_time.isoformat(),
-                    "end": (current_time + timedelta(hours=FUELING_DURATION_HOURS)).isoformat(),
-                    "duration_hours": FUELING_DURATION_HOURS,
-                }
-                day_entries.append(fuel_entry)
-                current_time += timedelta(hours=FUELING_DURATION_HOURS)
+                events.append((FUELING, now, FUELING_DURATION_HOURS))
+                now += hours_to_microseconds(FUELING_DURATION_HOURS)
                 on_duty_today += FUELING_DURATION_HOURS
                 cycle_total += FUELING_DURATION_HOURS
-                total_on_duty_hours += FUELING_DURATION_HOURS
-                completion_time = current_time
-                stops.append(
-                    {
-                        "type": "Fuel Stop",
-                        "details": f"Fuel stop {fueling_index}",
-                        "timestamp": fuel_entry["end"],
-                    }
-                )
-                fueling_index += 1
+                completion = (day_index, now)
                 distance_since_fuel = 0.0
 
             if cycle_total >= CYCLE_LIMIT_HOURS:
                 limit_reached = True
                 break
 
-        day_completed = False
         if distance_remaining <= 0:
             if cycle_total + DROPOFF_DURATION_HOURS <= CYCLE_LIMIT_HOURS:
-                drop_entry = {
-                    "activity": "Dropoff Service",
-                    "status": "On Duty",
-                    "start": current_time.isoformat(),
-                    "end": (current_time + timedelta(hours=DROPOFF_DURATION_HOURS)).isoformat(),
-                    "duration_hours": DROPOFF_DURATION_HOURS,
-                }
-                day_entries.append(drop_entry)
-                current_time += timedelta(hours=DROPOFF_DURATION_HOURS)
-                dropoff_timestamp = drop_entry["end"]
-                on_duty_today += DROPOFF_DURATION_HOURS
+                events.append((DROPOFF, now, DROPOFF_DURATION_HOURS))
+                now += hours_to_microseconds(DROPOFF_DURATION_HOURS)
                 cycle_total += DROPOFF_DURATION_HOURS
-                total_on_duty_hours += DROPOFF_DURATION_HOURS
-                completion_time = current_time
-                stops.append(
-                    {
-                        "type": "Dropoff",
-                        "details": "Dropoff service completed",
-                        "timestamp": dropoff_timestamp,
-                    }
-                )
-            day_completed = True
+                completion = (day_index, now)
         elif cycle_total < CYCLE_LIMIT_HOURS:
-            sleeper_entry = {
-                "activity": "Sleeper Berth",
-                "status": "Off Duty",
-                "start": current_time.isoformat(),
-                "end": (current_time + timedelta(hours=SLEEPER_BERTH_HOURS)).isoformat(),
-                "duration_hours": SLEEPER_BERTH_HOURS,
-            }
-            day_entries.append(sleeper_entry)
-            current_time += timedelta(hours=SLEEPER_BERTH_HOURS)
-            completion_time = current_time
-            stops.append(
-                {
-                    "type": "Rest",
-                    "details": f"Day {day_index} 10-hour rest",
-                    "timestamp": sleeper_entry["start"],
-                }
-            )
-            day_completed = True
+            events.append((SLEEPER, now, SLEEPER_BERTH_HOURS))
+            now += hours_to_microseconds(SLEEPER_BERTH_HOURS)
+            completion = (day_index, now)
         else:
             limit_reached = True
 
-        if day_entries:
-            logs.append(
-                {
-                    "day": day_index,
-                    "start": day_start.isoformat(),
-                    "entries": day_entries,
-                }
-            )
+        entries.add_day(day_index, events)
+        days_planned += 1
 
         if distance_remaining <= 0 or limit_reached:
             break
 
         day_index += 1
 
+    return {
+        "entries": entries,
+        "days_planned": days_planned,
+        "completion": completion,
+        "cycle_total": cycle_total,
+        "distance_remaining": distance_remaining,
+        "limit_reached": limit_reached,
+    }
+
+
+def _render_hos_plan(schedule: Dict, start_of_day, distance_miles: float, initial_cycle: float) -> Dict:
+    entries: HosEntries = schedule["entries"]
+    stops: List[Dict] = []
+    waypoints: List[Dict] = []
+    pickup_timestamp: Optional[str] = None
+    dropoff_timestamp: Optional[str] = None
+    fueling_index = 1
+    miles_driven = 0.0
+
+    def timestamp(offset: int) -> str:
+        return (start_of_day + timedelta(microseconds=offset)).isoformat()
+
+    def waypoint(stop_type: str, details: str, stamp: str) -> Dict:
+        stop = {"type": stop_type, "details": details, "timestamp": stamp}
+        waypoints.append({**stop, "miles_from_start": round(miles_driven, 2)})
+        return stop
+
+    # only the stop-producing entries need real timestamps here
+    for index, activity in enumerate(entries.activity):
+        if activity == DRIVING:
+            # same per-chunk arithmetic as the scheduler, so stops land where it placed them
+            miles_driven += entries.duration[index] * AVERAGE_SPEED_MPH
+        elif activity == PICKUP:
+            pickup_timestamp = timestamp(entries.end_offset(index))
+            stops.append(
+                {"type": "Pickup", "details": "Pickup service completed", "timestamp": pickup_timestamp})
+        elif activity == BREAK:
+            waypoint("Break", "30-minute break", timestamp(entries.offset[index]))
+        elif activity == FUELING:
+            stops.append(
+                waypoint("Fuel Stop", f"Fuel stop {fueling_index}", timestamp(entries.end_offset(index))))
+            fueling_index += 1
+        elif activity == DROPOFF:
+            dropoff_timestamp = timestamp(entries.end_offset(index))
+            stops.append(
+                {"type": "Dropoff", "details": "Dropoff service completed", "timestamp": dropoff_timestamp})
+        elif activity == SLEEPER:
+            stops.append(
+                waypoint(
+                    "Rest",
+                    f"Day {entries.day[index]} 10-hour rest",
+                    timestamp(entries.offset[index]),
+                )
+            )
+
+    completion_day, completion_offset = schedule["completion"]
+    completion_time = start_of_day + timedelta(
+        days=completion_day - 1, microseconds=completion_offset)
+    cycle_total = schedule["cycle_total"]
+
     summary = {
         "total_distance_miles": round(distance_miles, 2),
         "estimated_drive_hours": round(distance_miles / AVERAGE_SPEED_MPH, 2),
-        "days_planned": len(logs),
+        "days_planned": schedule["days_planned"],
         "cycle_hours_start": round(initial_cycle, 2),
         "cycle_hours_consumed": round(max(cycle_total - initial_cycle, 0), 2),
-        "cycle_limit_reached": limit_reached,
-        "remaining_distance_miles": round(max(distance_remaining, 0), 2),
+        "cycle_limit_reached": schedule["limit_reached"],
+        "remaining_distance_miles": round(max(schedule["distance_remaining"], 0), 2),
         "estimated_completion": completion_time.isoformat(),
     }
 
     return {
         "summary": summary,
-        "logs": logs,
+        "logs": entries.to_compact(start_of_day),
         "stops": stops,
+        "waypoints": waypoints,
         "pickup_timestamp": pickup_timestamp,
         "dropoff_timestamp": dropoff_timestamp,
     }
 
 
-def build_trip_plan(trip) -> Dict:
-    origin = _geocode_location(trip.current_location)
-    pickup = _geocode_location(trip.pickup_location)
-    dropoff = _geocode_location(trip.dropoff_location)
+def _generate_hos_plan(distance_miles: float, cycle_used: float) -> Dict:
+    initial_cycle = float(cycle_used)
+    if initial_cycle >= CYCLE_LIMIT_HOURS:
+        raise ValueError("Driver has no remaining cycle hours available.")
+
+    start_of_day = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
+    schedule = _schedule_hos_events(distance_miles, initial_cycle)
+    return _render_hos_plan(schedule, start_of_day, distance_miles, initial_cycle)
+
+
+def _locate_waypoints(route: Dict, waypoints: List[Dict]) -> List[Dict]:
+    if not waypoints or not route["polyline"]:
+        return []
+
+    path = PathInterpolator(route["polyline"])
+    # the schedule counts routed (road) miles; rescale onto the polyline's own length
+    scale = path.total / route["distance_miles"] if route["distance_miles"] else 0.0
+    positions = path.locate([waypoint["miles_from_start"] * scale for waypoint in waypoints])
 
+    return [
+        {
+            "label": waypoint["details"],
+            "type": waypoint["type"],
+            "latitude": round(latitude, 6),
+            "longitude": round(longitude, 6),
+            "timestamp": waypoint["timestamp"],
+            "miles_from_start": waypoint["miles_from_start"],
+            "approximate": route.get("fallback", False),
+        }
+        for waypoint, (latitude, longitude) in zip(waypoints, positions.tolist())
+    ]
+
+
+def _stored_locations(trip) -> Optional[List[Dict]]:
+    # geocoding notes and the first three markers are origin, pickup and dropoff
+    notes = (trip.route_summary or {}).get("geocoding") or []
+    markers = (trip.map_data or {}).get("markers") or []
+    if len(notes) < 3 or len(markers) < 3:
+        return None
+    return [
+        {
+            "query": note["query"],
+            "latitude": marker["latitude"],
+            "longitude": marker["longitude"],
+            "display_name": note["display_name"],
+            "approximate": note.get("approximate", False),
+        }
+        for note, marker in zip(notes[:3], markers[:3])
+    ]
+
+
+def _stored_route(trip) -> Optional[Dict]:
+    summary = trip.route_summary or {}
+    geometry = load_trip_geometry(trip)
+    # fallback routes are re-requested so a recovered OSRM replaces the straight line
+    if "distance_miles" not in summary or geometry is None or summary.get("fallback_route"):
+        return None
+    return {
+        "distance_miles": summary["distance_miles"],
+        "duration_hours": summary["duration_hours"],
+        "legs": summary.get("legs", []),
+        "polyline": decode_polyline(geometry["levels"][FULL_LEVEL], geometry["precision"]),
+        "fallback": False,
+        "geometry": geometry,
+    }
+
+
+def replan_trip(trip) -> Dict:
+    """Rebuild a trip's plan after its inputs were edited, reusing what still applies.
+
+    Locations whose query matches the stored plan keep their coordinates;
+    only edited ones are geocoded again. When no location changed, the
+    stored route is reused and only the HOS schedule is recomputed.
+    """
+    stored = _stored_locations(trip)
+    if stored is None:
+        return build_trip_plan(trip)
+
+    queries = [trip.current_location, trip.pickup_location, trip.dropoff_location]
+    changed = [index for index, query in enumerate(queries) if stored[index]["query"] != query]
+    points = list(stored)
+    if changed:
+        with stage("geocode"):
+            resolved = geocode_locations([queries[index] for index in changed])
+        for index, location in zip(changed, resolved):
+            points[index] = location
+        return build_plan_for_locations(*points, trip.current_cycle_used)
+
+    route = _stored_route(trip)
+    if route is None:
+        return build_plan_for_locations(*points, trip.current_cycle_used)
+    geometry = route.pop("geometry")
+    return build_plan_for_locations(*points, trip.current_cycle_used, route=route, geometry=geometry)
+
+
+def build_trip_plan(trip) -> Dict:
+    with stage("geocode"):
+        origin, pickup, dropoff = geocode_locations(
+            [trip.current_location, trip.pickup_location, trip.dropoff_location]
+        )
+    return build_plan_for_locations(origin, pickup, dropoff, trip.current_cycle_used)
+
+
+def build_plan_for_locations(
+    origin: Dict,
+    pickup: Dict,
+    dropoff: Dict,
+    cycle_used,
+    route: Optional[Dict] = None,
+    geometry: Optional[Dict] = None,
+) -> Dict:
+    # route/geometry let replan_trip reuse a stored route instead of fetching one
     points = [origin, pickup, dropoff]
-    route = _fetch_route(points)
+    if route is None:
+        with stage("route"):
+            route = _fetch_route(points)
 
     geocoding_notes = [
         {
@@ -428,10 +946,11 @@ def build_trip_plan(trip) -> Dict:
         for location in points
     ]
 
-    hos_plan = _generate_hos_plan(
-        distance_miles=route["distance_miles"],
-        cycle_used=float(trip.current_cycle_used),
-    )
+    with stage("hos"):
+        hos_plan = _generate_hos_plan(
+            distance_miles=route["distance_miles"],
+            cycle_used=float(cycle_used),
+        )
 
     route_summary = {
         "distance_miles": route["distance_miles"],
@@ -459,29 +978,31 @@ def build_trip_plan(trip) -> Dict:
         "geocoding": geocoding_notes,
     }
 
-    map_data = {
-        "polyline": route["polyline"],
-        "markers": [
-            {
-                "label": "Current Location",
-                "latitude": origin["latitude"],
-                "longitude": origin["longitude"],
-                "approximate": origin.get("approximate", False),
-            },
-            {
-                "label": "Pickup",
-                "latitude": pickup["latitude"],
-                "longitude": pickup["longitude"],
-                "approximate": pickup.get("approximate", False),
-            },
-            {
-                "label": "Dropoff",
-                "latitude": dropoff["latitude"],
-                "longitude": dropoff["longitude"],
-                "approximate": dropoff.get("approximate", False),
-            },
-        ],
-    }
+    with stage("geometry"):
+        map_data = {
+            "geometry": geometry or build_geometry(route["polyline"]),
+            "markers": [
+                {
+                    "label": "Current Location",
+                    "latitude": origin["latitude"],
+                    "longitude": origin["longitude"],
+                    "approximate": origin.get("approximate", False),
+                },
+                {
+                    "label": "Pickup",
+                    "latitude": pickup["latitude"],
+                    "longitude": pickup["longitude"],
+                    "approximate": pickup.get("approximate", False),
+                },
+                {
+                    "label": "Dropoff",
+                    "latitude": dropoff["latitude"],
+                    "longitude": dropoff["longitude"],
+                    "approximate": dropoff.get("approximate", False),
+                },
+                *_locate_waypoints(route, hos_plan["waypoints"]),
+            ],
+        }
 
     return {
         "route_summary": route_summary,
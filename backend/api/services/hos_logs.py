@@ -0,0 +1,232 @@
+"""Compact, array-backed storage for HOS log entries.
+
+Plans are stored in ``Trip.hos_logs`` in the columnar "compact" format
+produced by :meth:`HosEntries.to_compact`::
+
+    {
+        "format": "compact",
+        "version": 1,
+        "start": "<ISO start of day 1>",
+        "activities": [...],  "statuses": [...],
+        "day": [...], "activity": [...], "status": [...],
+        "offset": [...],    # entry start, microseconds after "start"
+        "duration": [...],  # exact hours
+    }
+
+The verbose day/entries structure the API has always returned is only
+built when a response is serialized (:func:`expand_hos_logs`). Trips saved
+before this format existed still hold the verbose list, and every helper
+here accepts both.
+"""
+from array import array
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+COMPACT_FORMAT = "compact"
+COMPACT_VERSION = 1
+
+ACTIVITIES = (
+    "Pre-Trip Inspection",
+    "Pickup Service",
+    "Driving",
+    "30-Minute Break",
+    "Fueling",
+    "Dropoff Service",
+    "Sleeper Berth",
+)
+STATUSES = ("On Duty", "Driving", "Off Duty")
+
+PRETRIP, PICKUP, DRIVING, BREAK, FUELING, DROPOFF, SLEEPER = range(len(ACTIVITIES))
+ON_DUTY, DRIVING_STATUS, OFF_DUTY = range(len(STATUSES))
+
+ACTIVITY_STATUS = (ON_DUTY, ON_DUTY, DRIVING_STATUS, OFF_DUTY, ON_DUTY, ON_DUTY, OFF_DUTY)
+
+# these durations come from whole-hour constants and have always been rendered as ints
+_INTEGRAL_ACTIVITIES = frozenset({PICKUP, FUELING, DROPOFF, SLEEPER})
+
+MICROSECONDS_PER_DAY = 24 * 3600 * 1_000_000
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+@lru_cache(maxsize=4096)
+def hours_to_microseconds(hours: float) -> int:
+    # timedelta does the float -> microsecond rounding, so offsets match datetime arithmetic
+    return timedelta(hours=hours) // _ONE_MICROSECOND
+
+
+_MICROSECONDS_PER_HOUR = 3600 * 1_000_000
+
+
+def hours_to_microseconds_array(hours) -> np.ndarray:
+    """Vectorized hours_to_microseconds for non-negative hours.
+
+    Mirrors how timedelta converts a float: the whole hours are exact, the
+    fraction is scaled in double precision and truncated, and the leftover
+    is rounded half-to-even on the total.
+    """
+    hours = np.asarray(hours, dtype=float)
+    fraction, whole = np.modf(hours)
+    scaled_fraction, scaled_whole = np.modf(fraction * float(_MICROSECONDS_PER_HOUR))
+    total = whole.astype(np.int64) * _MICROSECONDS_PER_HOUR + scaled_whole.astype(np.int64)
+    round_up = (scaled_fraction > 0.5) | ((scaled_fraction == 0.5) & (total % 2 == 1))
+    return total + round_up
+
+
+def display_duration(activity: int, hours: float) -> Union[int, float]:
+    if activity in _INTEGRAL_ACTIVITIES and float(hours).is_integer():
+        return int(hours)
+    return round(hours, 2)
+
+
+class HosEntries:
+    __slots__ = ("day", "activity", "status", "offset", "duration")
+
+    def __init__(self):
+        self.day = array("H")
+        self.activity = array("B")
+        self.status = array("B")
+        self.offset = array("q")
+        self.duration = array("d")
+
+    def __len__(self) -> int:
+        return len(self.activity)
+
+    def append(
+        self, day: int, activity: int, offset: int, duration: float, status: Optional[int] = None
+    ) -> None:
+        self.day.append(day)
+        self.activity.append(activity)
+        self.status.append(ACTIVITY_STATUS[activity] if status is None else status)
+        self.offset.append(offset)
+        self.duration.append(duration)
+
+    def add_day(self, day: int, events: Sequence[Tuple[int, int, float]]) -> None:
+        # events are (activity, start microseconds into the day, hours)
+        base = (day - 1) * MICROSECONDS_PER_DAY
+        for activity, start, duration in events:
+            self.append(day, activity, base + start, duration)
+
+    def end_offset(self, index: int) -> int:
+        return self.offset[index] + hours_to_microseconds(self.duration[index])
+
+    def to_compact(self, start: Optional[datetime]) -> Dict:
+        return {
+            "format": COMPACT_FORMAT,
+            "version": COMPACT_VERSION,
+            "start": start.isoformat() if start else None,
+            "activities": list(ACTIVITIES),
+            "statuses": list(STATUSES),
+            "day": self.day.tolist(),
+            "activity": self.activity.tolist(),
+            "status": self.status.tolist(),
+            "offset": self.offset.tolist(),
+            "duration": self.duration.tolist(),
+        }
+
+    @classmethod
+    def from_compact(cls, data: Dict) -> Tuple["HosEntries", Optional[datetime]]:
+        if data.get("format") != COMPACT_FORMAT or data.get("version") != COMPACT_VERSION:
+            raise ValueError("Unsupported HOS log format.")
+        # map stored code tables onto ours so older payloads survive reordering
+        activity_map = [ACTIVITIES.index(name) for name in data["activities"]]
+        status_map = [STATUSES.index(name) for name in data["statuses"]]
+        entries = cls()
+        entries.day.extend(data["day"])
+        entries.activity.extend(activity_map[code] for code in data["activity"])
+        entries.status.extend(status_map[code] for code in data["status"])
+        entries.offset.extend(data["offset"])
+        entries.duration.extend(data["duration"])
+        start = datetime.fromisoformat(data["start"]) if data["start"] else None
+        return entries, start
+
+    def iter_entries(self, start: datetime) -> Iterator[Tuple[int, Dict]]:
+        """Yield (day, verbose entry) pairs in order without building the day lists."""
+        previous_end = None
+        previous_end_iso = None
+        for index in range(len(self.activity)):
+            offset = self.offset[index]
+            if offset == previous_end:
+                start_iso = previous_end_iso
+            else:
+                start_iso = (start + timedelta(microseconds=offset)).isoformat()
+            previous_end = self.end_offset(index)
+            previous_end_iso = (start + timedelta(microseconds=previous_end)).isoformat()
+
+            activity = self.activity[index]
+            yield self.day[index], {
+                "activity": ACTIVITIES[activity],
+                "status": STATUSES[self.status[index]],
+                "start": start_iso,
+                "end": previous_end_iso,
+                "duration_hours": display_duration(activity, self.duration[index]),
+            }
+
+    def to_logs(self, start: datetime) -> List[Dict]:
+        logs: List[Dict] = []
+        day_entries: List[Dict] = []
+        current_day = None
+        for day, entry in self.iter_entries(start):
+            if day != current_day:
+                day_entries = []
+                logs.append(
+                    {
+                        "day": day,
+                        "start": (start + timedelta(days=day - 1)).isoformat(),
+                        "entries": day_entries,
+                    }
+                )
+                current_day = day
+            day_entries.append(entry)
+        return logs
+
+
+def is_compact(value) -> bool:
+    return isinstance(value, dict) and value.get("format") == COMPACT_FORMAT
+
+
+def expand_hos_logs(value) -> List[Dict]:
+    if is_compact(value):
+        entries, start = HosEntries.from_compact(value)
+        return entries.to_logs(start)
+    return value or []
+
+
+def iter_hos_entries(value) -> Iterator[Tuple[int, Dict]]:
+    """Yield (day, verbose entry) pairs from either stored format."""
+    if is_compact(value):
+        entries, start = HosEntries.from_compact(value)
+        yield from entries.iter_entries(start)
+        return
+    for day in value or []:
+        for entry in day["entries"]:
+            yield day["day"], entry
+
+
+def compact_hos_logs(value) -> Dict:
+    """Return the compact form of either stored format.
+
+    Verbose logs only carry rounded durations, so their exact hours are
+    recovered from the start/end timestamps instead.
+    """
+    if is_compact(value):
+        return value
+    if not value:
+        return HosEntries().to_compact(None)
+
+    start = datetime.fromisoformat(value[0]["start"])
+    entries = HosEntries()
+    for day in value:
+        for entry in day["entries"]:
+            entry_start = datetime.fromisoformat(entry["start"])
+            entry_end = datetime.fromisoformat(entry["end"])
+            entries.append(
+                day["day"],
+                ACTIVITIES.index(entry["activity"]),
+                (entry_start - start) // _ONE_MICROSECOND,
+                (entry_end - entry_start) / timedelta(hours=1),
+                status=STATUSES.index(entry["status"]),
+            )
+    return entries.to_compact(start)
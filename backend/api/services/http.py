@@ -0,0 +1,130 @@
+"""Shared, pooled HTTP clients for the routing and geocoding upstreams."""
+import asyncio
+import threading
+import time
+import weakref
+from typing import Optional, Tuple
+
+import httpx
+import requests
+from django.conf import settings
+from geopy.adapters import RequestsAdapter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_CONNECT_TIMEOUT_SECONDS = getattr(settings, "HTTP_CONNECT_TIMEOUT_SECONDS", 3.05)
+HTTP_MAX_RETRIES = getattr(settings, "HTTP_MAX_RETRIES", 2)
+HTTP_POOL_MAXSIZE = getattr(settings, "HTTP_POOL_MAXSIZE", 20)
+HTTP_USER_AGENT = "RouteLogPro/1.0"
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+# an AsyncClient is bound to the event loop it was first used on
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary())
+
+
+def timeout(read_seconds: float) -> Tuple[float, float]:
+    return (HTTP_CONNECT_TIMEOUT_SECONDS, read_seconds)
+
+
+def _build_session() -> requests.Session:
+    # retry refused connections and gateway errors, but never a read timeout:
+    # that would multiply the worst-case wait instead of bounding it
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        read=0,
+        status=HTTP_MAX_RETRIES,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        backoff_factor=0.2,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.headers["User-Agent"] = HTTP_USER_AGENT
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def async_timeout(read_seconds: float) -> httpx.Timeout:
+    return httpx.Timeout(read_seconds, connect=HTTP_CONNECT_TIMEOUT_SECONDS)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """The pooled AsyncClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        # httpx only retries failed connections, matching the session's read=0 policy
+        transport = httpx.AsyncHTTPTransport(
+            retries=HTTP_MAX_RETRIES,
+            limits=httpx.Limits(max_connections=HTTP_POOL_MAXSIZE, max_keepalive_connections=HTTP_POOL_MAXSIZE),
+        )
+        client = _async_clients[loop] = httpx.AsyncClient(
+            transport=transport, headers={"User-Agent": HTTP_USER_AGENT})
+    return client
+
+
+class SharedSessionAdapter(RequestsAdapter):
+    """geopy adapter that sends geocoder traffic through the shared session."""
+
+    def __init__(self, *, proxies, ssl_context, **kwargs):
+        super().__init__(proxies=proxies, ssl_context=ssl_context, **kwargs)
+        self.session.close()
+        self.session = get_session()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def __del__(self):
+        # the shared session outlives any one geocoder instance
+        pass
+
+
+class TokenBucket:
+    """Admits ``rate`` calls per second on average, with bursts of up to ``burst``.
+
+    Callers that find the bucket empty take a token anyway and wait until it
+    would have refilled, so waiting callers are served in arrival order. One
+    bucket can pace blocking threads and event loops (wait / wait_async) alike.
+    """
+
+    def __init__(self, rate: Optional[float], burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token; returns the seconds to wait before using it."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def wait(self) -> None:
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def wait_async(self) -> None:
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
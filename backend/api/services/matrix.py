@@ -0,0 +1,195 @@
+"""Origin x destination distance/duration matrices from OSRM's table service.
+
+Every cell is cached under its rounded origin/destination coordinates, so
+only cells not seen before go upstream, and all of those go in a single
+table request. Cells OSRM cannot answer (or every cell, when it is down)
+are estimated from the ellipsoidal distance at AVERAGE_SPEED_MPH, like
+fallback_route, and cached only briefly.
+
+Locations are place names or {"lat", "lon"} pairs. Pairs are resolved
+inline like pinned map locations; each name may cost a Nominatim lookup
+at one request per second, so names are capped at MATRIX_MAX_PLACE_NAMES.
+"""
+import logging
+import time
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import requests
+from django.conf import settings
+
+from .cache import CACHE_MISS, LRUCache
+from .geodesy import METERS_PER_MILE, vincenty_miles
+from .hos import (
+    AVERAGE_SPEED_MPH,
+    OSRM_BASE_URL,
+    OSRM_PROFILE,
+    OSRM_READ_TIMEOUT_SECONDS,
+    ROUTE_CACHE_COORD_PRECISION,
+    ROUTE_CACHE_FALLBACK_TTL_SECONDS,
+    ROUTE_CACHE_TTL_SECONDS,
+    geocode_locations,
+    osrm_breaker,
+)
+from .http import get_session
+from .http import timeout as http_timeout
+from .metrics import (
+    METRICS_ENABLED,
+    ROUTE_FALLBACKS,
+    UPSTREAM_REQUESTS,
+    UPSTREAM_SECONDS,
+    increment,
+    register_collector,
+    stage,
+)
+
+MATRIX_CACHE_MAX_ENTRIES = getattr(settings, "MATRIX_CACHE_MAX_ENTRIES", 20000)
+# the public OSRM demo server rejects table requests with more coordinates than this
+MATRIX_MAX_LOCATIONS = getattr(settings, "MATRIX_MAX_LOCATIONS", 100)
+# a cold name costs up to a second of Nominatim pacing; coordinate pairs cost nothing
+MATRIX_MAX_PLACE_NAMES = getattr(settings, "MATRIX_MAX_PLACE_NAMES", 10)
+
+logger = logging.getLogger(__name__)
+
+Point = Tuple[float, float]
+# a place name, or {"latitude": ..., "longitude": ...} from a {"lat", "lon"} pair
+MatrixLocation = Union[str, Dict[str, float]]
+
+_cell_cache = LRUCache(MATRIX_CACHE_MAX_ENTRIES)
+
+
+def _point(location: Dict) -> Point:
+    return (
+        round(location["latitude"], ROUTE_CACHE_COORD_PRECISION),
+        round(location["longitude"], ROUTE_CACHE_COORD_PRECISION),
+    )
+
+
+def _request_table(sources: List[Point], destinations: List[Point]) -> Optional[Tuple[List, List]]:
+    coordinates = ";".join(f"{lon},{lat}" for lat, lon in (*sources, *destinations))
+    url = f"{OSRM_BASE_URL.rstrip('/')}/table/v1/{OSRM_PROFILE}/{coordinates}"
+    params = {
+        "sources": ";".join(str(index) for index in range(len(sources))),
+        "destinations": ";".join(str(len(sources) + index) for index in range(len(destinations))),
+        "annotations": "distance,duration",
+    }
+
+    if not osrm_breaker.allow():
+        return None
+
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        response = get_session().get(url, params=params, timeout=http_timeout(OSRM_READ_TIMEOUT_SECONDS))
+        response.raise_for_status()
+        payload = response.json()
+    except (requests.RequestException, ValueError) as exc:
+        logger.warning("OSRM table request failed: %s", exc)
+        outcome = "error"
+        osrm_breaker.record_failure()
+        return None
+    finally:
+        if METRICS_ENABLED:
+            UPSTREAM_REQUESTS.inc("osrm_table", outcome)
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, "osrm_table")
+    osrm_breaker.record_success()
+
+    if payload.get("code") != "Ok" or "distances" not in payload or "durations" not in payload:
+        return None
+    return payload["distances"], payload["durations"]
+
+
+def _estimate(sources: Sequence[Point], destinations: Sequence[Point]) -> np.ndarray:
+    source_array = np.asarray(sources, dtype=float).reshape(-1, 1, 2)
+    destination_array = np.asarray(destinations, dtype=float).reshape(1, -1, 2)
+    return vincenty_miles(
+        source_array[..., 0], source_array[..., 1], destination_array[..., 0], destination_array[..., 1])
+
+
+def distance_matrix(origins: List[Dict], destinations: List[Dict]) -> Dict:
+    if not origins or not destinations:
+        raise ValueError("At least one origin and one destination are required.")
+    if len(origins) + len(destinations) > MATRIX_MAX_LOCATIONS:
+        raise ValueError(f"A matrix may have at most {MATRIX_MAX_LOCATIONS} origins and destinations combined.")
+
+    origin_points = [_point(location) for location in origins]
+    destination_points = [_point(location) for location in destinations]
+
+    cells: Dict[Tuple[Point, Point], Tuple[float, float, bool]] = {}
+    missing_sources: List[Point] = []
+    missing_destinations: List[Point] = []
+    for source in dict.fromkeys(origin_points):
+        for destination in dict.fromkeys(destination_points):
+            cached = _cell_cache.get((source, destination))
+            if cached is not CACHE_MISS:
+                cells[(source, destination)] = cached
+                continue
+            if source not in missing_sources:
+                missing_sources.append(source)
+            if destination not in missing_destinations:
+                missing_destinations.append(destination)
+
+    if missing_sources:
+        # one table request covers every uncached cell (plus, at worst, a few cached ones)
+        table = _request_table(missing_sources, missing_destinations)
+        estimates = None
+        now = time.time()
+        for row, source in enumerate(missing_sources):
+            for column, destination in enumerate(missing_destinations):
+                if (source, destination) in cells:
+                    continue
+                meters = seconds = None
+                if table is not None:
+                    meters, seconds = table[0][row][column], table[1][row][column]
+                if meters is None or seconds is None:
+                    if estimates is None:
+                        estimates = _estimate(missing_sources, missing_destinations)
+                        increment(ROUTE_FALLBACKS, "matrix_estimate")
+                    miles = float(estimates[row, column])
+                    cell = (miles, miles / AVERAGE_SPEED_MPH, True)
+                    expires = now + ROUTE_CACHE_FALLBACK_TTL_SECONDS
+                else:
+                    cell = (meters / METERS_PER_MILE, seconds / 3600, False)
+                    expires = now + ROUTE_CACHE_TTL_SECONDS
+                cells[(source, destination)] = cell
+                _cell_cache.set((source, destination), cell, expires)
+
+    rows = [[cells[(source, destination)] for destination in destination_points] for source in origin_points]
+    return {
+        "distances_miles": [[round(cell[0], 2) for cell in row] for row in rows],
+        "durations_hours": [[round(cell[1], 2) for cell in row] for row in rows],
+        "estimated": [[cell[2] for cell in row] for row in rows],
+    }
+
+
+def _query(location: MatrixLocation) -> str:
+    if isinstance(location, str):
+        return location
+    # the map picker's format, which geocoding resolves inline
+    return f"Pinned location ({location['latitude']:.6f}, {location['longitude']:.6f})"
+
+
+def matrix_for_queries(origins: List[MatrixLocation], destinations: List[MatrixLocation]) -> Dict:
+    with stage("geocode"):
+        locations = geocode_locations([_query(location) for location in (*origins, *destinations)])
+    with stage("matrix"):
+        matrix = distance_matrix(locations[:len(origins)], locations[len(origins):])
+    return {"origins": locations[:len(origins)], "destinations": locations[len(origins):], **matrix}
+
+
+def clear_cache() -> None:
+    _cell_cache.clear()
+
+
+def _cache_metrics() -> List[Tuple]:
+    return [
+        (
+            "routelog_matrix_cell_lookups_total",
+            "counter",
+            "Distance matrix cell cache lookups by result.",
+            [({"result": "hit"}, _cell_cache.hits), ({"result": "miss"}, _cell_cache.misses)],
+        ),
+    ]
+
+
+register_collector(_cache_metrics)
@@ -0,0 +1,203 @@
+"""Planner stage timings, counters and histograms.
+
+``stage(name)`` times a block of work. The duration goes to the current
+request's Server-Timing header (see ServerTimingMiddleware) and, when
+METRICS_ENABLED is on, to the ``routelog_stage_seconds`` histogram served
+in Prometheus text format at /api/metrics to METRICS_ALLOWED_IPS and staff
+users. With both off, ``stage`` hands back a shared no-op context manager
+and ``increment``/``observe`` return immediately.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+METRICS_ENABLED = getattr(settings, "METRICS_ENABLED", False)
+METRICS_ALLOWED_IPS = frozenset(getattr(settings, "METRICS_ALLOWED_IPS", ("127.0.0.1", "::1")))
+SERVER_TIMING_ENABLED = getattr(settings, "SERVER_TIMING_ENABLED", False)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NULL_STAGE = nullcontext()
+
+# (name, seconds) pairs recorded while a request is being handled
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar(
+    "request_timings", default=None)
+
+LabelValues = Tuple[str, ...]
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield self.name, label_values, value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines.extend(_sample_line(name, self.labels, values, value) for name, values, value in self.samples())
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # per label set: bucket counts (last is +Inf), sum, count
+        self._values: Dict[LabelValues, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((key, ([*series[0]], series[1], series[2])) for key, series in self._values.items())
+        bucket_labels = (*self.labels, "le")
+        for label_values, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(_sample_line(f"{self.name}_bucket", bucket_labels, (*label_values, le), cumulative))
+            lines.append(_sample_line(f"{self.name}_sum", self.labels, label_values, total))
+            lines.append(_sample_line(f"{self.name}_count", self.labels, label_values, count))
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _sample_line(name: str, labels: Sequence[str], values: Sequence[str], value: float) -> str:
+    if labels:
+        pairs = ",".join(f'{label}="{_escape(item)}"' for label, item in zip(labels, values))
+        return f"{name}{{{pairs}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+STAGE_SECONDS = Histogram(
+    "routelog_stage_seconds", "Time spent in each trip planning stage.", labels=("stage",))
+UPSTREAM_SECONDS = Histogram(
+    "routelog_upstream_request_seconds", "Latency of OSRM and Nominatim requests.", labels=("service",))
+UPSTREAM_REQUESTS = Counter(
+    "routelog_upstream_requests_total", "OSRM and Nominatim requests by outcome.", labels=("service", "outcome"))
+ROUTE_FALLBACKS = Counter(
+    "routelog_route_fallbacks_total", "Routes built from straight-line distances instead of OSRM.",
+    labels=("reason",))
+UPSTREAM_SHORT_CIRCUITS = Counter(
+    "routelog_upstream_short_circuits_total", "Upstream calls skipped because the circuit was open.",
+    labels=("service",))
+COALESCED_LOOKUPS = Counter(
+    "routelog_coalesced_lookups_total", "Lookups answered by another caller's in-flight upstream call.",
+    labels=("kind", "scope"))
+
+_METRICS = [
+    STAGE_SECONDS, UPSTREAM_SECONDS, UPSTREAM_REQUESTS, ROUTE_FALLBACKS, UPSTREAM_SHORT_CIRCUITS, COALESCED_LOOKUPS,
+]
+# callables returning (name, type, documentation, [(labels dict, value), ...]) at scrape time
+_collectors: List[Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+
+
+def register_collector(collector: Callable) -> None:
+    _collectors.append(collector)
+
+
+def increment(counter: Counter, *label_values: str, amount: float = 1) -> None:
+    if METRICS_ENABLED:
+        counter.inc(*label_values, amount=amount)
+
+
+def observe(histogram: Histogram, value: float, *label_values: str) -> None:
+    if METRICS_ENABLED:
+        histogram.observe(value, *label_values)
+
+
+@contextmanager
+def _timed_stage(name: str, timings: Optional[List[Tuple[str, float]]]) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if timings is not None:
+            timings.append((name, elapsed))
+        if METRICS_ENABLED:
+            STAGE_SECONDS.observe(elapsed, name)
+
+
+def stage(name: str):
+    timings = _request_timings.get()
+    if timings is None and not METRICS_ENABLED:
+        return _NULL_STAGE
+    return _timed_stage(name, timings)
+
+
+def start_request_timings() -> object:
+    return _request_timings.set([])
+
+
+def finish_request_timings(token) -> List[Tuple[str, float]]:
+    timings = _request_timings.get() or []
+    _request_timings.reset(token)
+    return timings
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    # repeated stages (e.g. several DB writes) are summed into one entry
+    totals: Dict[str, float] = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, metric_type, documentation, samples in collector():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(_sample_line(name, tuple(labels), tuple(labels.values()), value))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from ..models import Trip
+from .hos import build_trip_plan
+from .metrics import stage
+from .trip_geometry import save_trip_geometry, split_map_data
+
+# a trip stuck in "processing" longer than this is assumed to belong to a dead worker
+PLANNING_STALE_AFTER_SECONDS = getattr(settings, "TRIP_PLANNING_STALE_AFTER_SECONDS", 300)
+# how often each running worker looks for trips orphaned by a crashed one
+PLANNING_REQUEUE_INTERVAL_SECONDS = getattr(settings, "TRIP_PLANNING_REQUEUE_INTERVAL_SECONDS", 60)
+
+# the inputs a plan is built from; editing any of them invalidates the plan
+PLANNING_FIELDS = ("current_location", "pickup_location", "dropoff_location", "current_cycle_used")
+
+logger = logging.getLogger(__name__)
+
+
+def _planned(trip: Trip):
+    # the row only while it still carries the inputs this trip instance was planned from
+    return Trip.objects.filter(pk=trip.pk, **{field: getattr(trip, field) for field in PLANNING_FIELDS})
+
+
+def store_plan(trip: Trip, plan: dict) -> bool:
+    # a plan for inputs edited since it was started is dropped; the edit requeued the trip
+    map_data, geometry = split_map_data(plan["map_data"])
+    with transaction.atomic():
+        stored = _planned(trip).update(
+            route_summary=plan["route_summary"],
+            hos_logs=plan["hos_logs"],
+            map_data=map_data,
+            status=Trip.Status.COMPLETED,
+            status_detail="",
+            updated_at=timezone.now(),
+        )
+        if stored:
+            save_trip_geometry(trip.pk, geometry)
+    return bool(stored)
+
+
+def requeue_trip(trip: Trip) -> bool:
+    return bool(_planned(trip).update(
+        status=Trip.Status.PENDING, status_detail="", planning_started_at=None, updated_at=timezone.now()))
+
+
+def claim_next_trip() -> Optional[Trip]:
+    # a conditional UPDATE acts as compare-and-set, so the claim is safe on
+    # SQLite as well as Postgres without SELECT ... FOR UPDATE SKIP LOCKED
+    candidates = (
+        Trip.objects.filter(status=Trip.Status.PENDING)
+        .order_by("created_at")
+        .values_list("pk", flat=True)[:10]
+    )
+    for pk in candidates:
+        now = timezone.now()
+        claimed = Trip.objects.filter(pk=pk, status=Trip.Status.PENDING).update(
+            status=Trip.Status.PROCESSING,
+            planning_started_at=now,
+            updated_at=now,
+        )
+        if claimed:
+            return Trip.objects.get(pk=pk)
+    return None
+
+
+def requeue_stale_trips() -> int:
+    cutoff = timezone.now() - timedelta(seconds=PLANNING_STALE_AFTER_SECONDS)
+    return Trip.objects.filter(
+        status=Trip.Status.PROCESSING, planning_started_at__lt=cutoff
+    ).update(status=Trip.Status.PENDING, planning_started_at=None, updated_at=timezone.now())
+
+
+def process_trip(trip: Trip) -> None:
+    try:
+        plan = build_trip_plan(trip)
+    except ValueError as exc:
+        _planned(trip).update(
+            status=Trip.Status.FAILED, status_detail=str(exc), updated_at=timezone.now())
+        return
+    except Exception as exc:
+        logger.exception("Planning failed for trip %s", trip.pk)
+        _planned(trip).update(
+            status=Trip.Status.FAILED, status_detail=f"Planning error: {exc}", updated_at=timezone.now())
+        return
+    with stage("db"):
+        if not store_plan(trip, plan):
+            logger.info("Dropped the plan for trip %s: its inputs changed while planning", trip.pk)
+
+
+def process_next_trip() -> bool:
+    trip = claim_next_trip()
+    if trip is None:
+        return False
+    process_trip(trip)
+    return True
+
+
+def run_worker(stop_event: threading.Event, poll_interval: float = 1.0) -> None:
+    next_requeue = time.monotonic() + PLANNING_REQUEUE_INTERVAL_SECONDS
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                if time.monotonic() >= next_requeue:
+                    next_requeue = time.monotonic() + PLANNING_REQUEUE_INTERVAL_SECONDS
+                    requeued = requeue_stale_trips()
+                    if requeued:
+                        logger.info("Requeued %d stale trip(s)", requeued)
+                worked = process_next_trip()
+            except DatabaseError as exc:
+                logger.warning("Trip queue worker database error: %s", exc)
+                worked = False
+            if not worked:
+                stop_event.wait(poll_interval)
+    finally:
+        connection.close()
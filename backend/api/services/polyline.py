@@ -0,0 +1,145 @@
+"""Route geometry simplification and Google encoded-polyline storage.
+
+Trip geometry (stored in TripGeometry, see trip_geometry) is one encoded
+polyline per detail level: the full OSRM geometry plus Douglas-Peucker
+simplifications whose tolerances (in metres) come from POLYLINE_LEVELS.
+"""
+import math
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from django.conf import settings
+
+POLYLINE_FORMAT = "encoded-polyline"
+POLYLINE_PRECISION = 5
+FULL_LEVEL = "full"
+
+# Douglas-Peucker tolerance in metres per level, roughly street / city / country zoom
+POLYLINE_LEVELS: Dict[str, float] = getattr(
+    settings, "POLYLINE_LEVELS", {"high": 10.0, "medium": 50.0, "low": 250.0})
+POLYLINE_DEFAULT_LEVEL = getattr(settings, "POLYLINE_DEFAULT_LEVEL", "medium")
+
+_METERS_PER_DEGREE = 6371008.8 * math.pi / 180
+
+
+def encode_polyline(points: Sequence[Sequence[float]], precision: int = POLYLINE_PRECISION) -> str:
+    if len(points) == 0:
+        return ""
+    scaled = np.round(np.asarray(points, dtype=float) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    chunks: List[str] = []
+    for value in deltas.ravel().tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def decode_polyline(encoded: str, precision: int = POLYLINE_PRECISION) -> List[List[float]]:
+    values: List[int] = []
+    result = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        result |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(result >> 1) if result & 1 else result >> 1)
+            result = shift = 0
+    if len(values) % 2:
+        raise ValueError("Encoded polyline has an odd number of values.")
+
+    factor = 10 ** precision
+    coordinates = np.cumsum(np.asarray(values, dtype=np.int64).reshape(-1, 2), axis=0)
+    return (coordinates / factor).tolist()
+
+
+def simplify_polyline(points: Sequence[Sequence[float]], tolerance_meters: float) -> List[List[float]]:
+    """Douglas-Peucker simplification of a [lat, lon] path.
+
+    Distances are measured on a local equirectangular projection, which is
+    plenty accurate for picking which vertices to drop.
+    """
+    array = np.asarray(points, dtype=float)
+    count = len(array)
+    if count < 3 or tolerance_meters <= 0:
+        return array.tolist()
+
+    scale = math.cos(math.radians(float(np.mean(array[:, 0]))))
+    xy = np.column_stack((array[:, 1] * scale, array[:, 0])) * _METERS_PER_DEGREE
+
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = xy[first], xy[last]
+        segment = end - start
+        length_sq = float(segment @ segment)
+        inner = xy[first + 1:last] - start
+        if length_sq == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            t = np.clip(inner @ segment / length_sq, 0.0, 1.0)
+            offsets = inner - np.outer(t, segment)
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_meters:
+            index = first + 1 + farthest
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return array[keep].tolist()
+
+
+def build_geometry(points: Sequence[Sequence[float]]) -> Dict:
+    levels = {FULL_LEVEL: encode_polyline(points)}
+    for level, tolerance in POLYLINE_LEVELS.items():
+        levels[level] = encode_polyline(simplify_polyline(points, tolerance))
+    return {
+        "format": POLYLINE_FORMAT,
+        "precision": POLYLINE_PRECISION,
+        "point_count": len(points),
+        "levels": levels,
+    }
+
+
+def available_levels() -> List[str]:
+    return [FULL_LEVEL, *POLYLINE_LEVELS]
+
+
+def geometry_for_map_data(map_data: Dict) -> Optional[Dict]:
+    # trips stored before encoded geometry kept a raw "polyline" coordinate list
+    if not map_data:
+        return None
+    if "geometry" in map_data:
+        return map_data["geometry"]
+    if map_data.get("polyline"):
+        return build_geometry(map_data["polyline"])
+    return None
+
+
+def full_polyline(map_data: Dict) -> List[List[float]]:
+    geometry = geometry_for_map_data(map_data)
+    if not geometry:
+        return []
+    return decode_polyline(geometry["levels"][FULL_LEVEL], geometry["precision"])
+
+
+def render_geometry(geometry: Optional[Dict], level: str = POLYLINE_DEFAULT_LEVEL, encoded: bool = False) -> Dict:
+    """Shape stored geometry for the API: one level, as coordinates or encoded."""
+    if geometry is None:
+        return {"polyline": "" if encoded else [], "polyline_level": level}
+
+    # simplified levels can be tuned later; fall back to full for unknown stored levels
+    encoded_line = geometry["levels"].get(level, geometry["levels"][FULL_LEVEL])
+    rendered = {
+        "polyline": encoded_line if encoded else decode_polyline(encoded_line, geometry["precision"]),
+        "polyline_level": level if level in geometry["levels"] else FULL_LEVEL,
+    }
+    if encoded:
+        rendered["polyline_encoding"] = {"format": geometry["format"], "precision": geometry["precision"]}
+    return rendered
@@ -0,0 +1,161 @@
+"""Coalescing of identical in-flight upstream lookups.
+
+Within a process, the first caller for a key leads and later callers wait
+for its result. The leader also tries to take the key's UpstreamLock row:
+if it gets it, it publishes its result there when done; if another process
+holds it, the leader polls the row for that process's result, and only
+calls upstream itself when none arrives in time. A published result is
+only for callers that were already waiting: one arriving after it takes
+the row over and does its own lookup, so the table never acts as a cache
+behind the in-process caches' TTLs. Inside an atomic block the
+lock row would stay invisible to other processes until commit, so there
+only the in-process coalescing applies.
+"""
+import hashlib
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Dict, Hashable, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection
+from django.utils import timezone
+
+from ..models import UpstreamLock
+from .metrics import COALESCED_LOOKUPS, increment
+
+SINGLE_FLIGHT_LOCK_SECONDS = getattr(settings, "SINGLE_FLIGHT_LOCK_SECONDS", 60)
+SINGLE_FLIGHT_WAIT_SECONDS = getattr(settings, "SINGLE_FLIGHT_WAIT_SECONDS", 30)
+SINGLE_FLIGHT_POLL_SECONDS = getattr(settings, "SINGLE_FLIGHT_POLL_SECONDS", 0.05)
+# published results stay readable this long for processes that were polling for them
+_RESULT_SECONDS = 10
+
+logger = logging.getLogger(__name__)
+
+# returned by wait_remote when no other process answered
+MISSING = object()
+
+_ACQUIRED = "acquired"
+_HELD = "held"
+_UNAVAILABLE = "unavailable"
+
+
+class _Flight:
+    def __init__(self, lock_key: str):
+        self.lock_key = lock_key
+        self.lock_state = _UNAVAILABLE
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def wait(self):
+        self._event.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class SingleFlight:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key: Hashable) -> Tuple[_Flight, bool]:
+        """Join the flight for key; the bool says whether this caller leads it."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                increment(COALESCED_LOOKUPS, self.kind, "process")
+                return flight, False
+            digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+            flight = self._flights[key] = _Flight(f"{self.kind}:{digest}")
+        flight.lock_state = _acquire(flight.lock_key)
+        return flight, True
+
+    def wait_remote(self, flight: _Flight):
+        """The result published by the process holding the lock, or MISSING."""
+        if flight.lock_state != _HELD:
+            return MISSING
+        deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                row = UpstreamLock.objects.filter(
+                    key=flight.lock_key, expires_at__gt=timezone.now()
+                ).values_list("done", "result").first()
+            except DatabaseError as exc:
+                logger.warning("Could not read upstream lock %s: %s", flight.lock_key, exc)
+                return MISSING
+            if row is None:
+                # the holder gave up or its lease ran out
+                return MISSING
+            if row[0]:
+                increment(COALESCED_LOOKUPS, self.kind, "cluster")
+                return row[1]
+            time.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+        return MISSING
+
+    def finish(self, key: Hashable, flight: _Flight, value) -> None:
+        if flight.lock_state == _ACQUIRED:
+            try:
+                UpstreamLock.objects.filter(key=flight.lock_key).update(
+                    done=True, result=value, expires_at=timezone.now() + timedelta(seconds=_RESULT_SECONDS))
+            except DatabaseError as exc:
+                logger.warning("Could not publish upstream lock %s: %s", flight.lock_key, exc)
+        flight._value = value
+        self._land(key, flight)
+
+    def abandon(self, key: Hashable, flight: _Flight, error: BaseException) -> None:
+        if flight.lock_state == _ACQUIRED:
+            _release(flight.lock_key)
+        flight._error = error
+        self._land(key, flight)
+
+    def run(self, key: Hashable, func: Callable[[], object]):
+        flight, leader = self.begin(key)
+        if not leader:
+            return flight.wait()
+        value = self.wait_remote(flight)
+        if value is MISSING:
+            try:
+                value = func()
+            except BaseException as exc:
+                self.abandon(key, flight, exc)
+                raise
+        self.finish(key, flight, value)
+        return value
+
+    def _land(self, key: Hashable, flight: _Flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight._event.set()
+
+
+def _acquire(lock_key: str) -> str:
+    # rows inserted inside a transaction are invisible to other processes until commit
+    if connection.in_atomic_block:
+        return _UNAVAILABLE
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=SINGLE_FLIGHT_LOCK_SECONDS)
+    try:
+        UpstreamLock.objects.filter(expires_at__lte=now).delete()
+        try:
+            UpstreamLock.objects.create(key=lock_key, expires_at=expires_at)
+        except IntegrityError:
+            # a finished lookup's row is taken over rather than its result reused
+            taken = UpstreamLock.objects.filter(key=lock_key, done=True).update(
+                done=False, result=None, expires_at=expires_at)
+            return _ACQUIRED if taken else _HELD
+    except DatabaseError as exc:
+        logger.warning("Could not take upstream lock %s: %s", lock_key, exc)
+        return _UNAVAILABLE
+    return _ACQUIRED
+
+
+def _release(lock_key: str) -> None:
+    try:
+        UpstreamLock.objects.filter(key=lock_key).delete()
+    except DatabaseError as exc:
+        logger.warning("Could not release upstream lock %s: %s", lock_key, exc)
@@ -0,0 +1,250 @@
+"""In-memory k-d tree over known places for offline nearest-place lookups.
+
+Points are stored as unit vectors on the sphere, so straight-line (chord)
+distance orders neighbours exactly like great-circle distance and the tree
+never has to deal with the antimeridian or the poles. Results are reported
+in statute miles.
+
+The index holds every gazetteer place (kind "city") plus any terminals or
+truck stops listed in SPATIAL_PLACES_PATH, a CSV with name, kind,
+latitude, longitude and an optional state column.
+"""
+import csv
+import logging
+import math
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .gazetteer import US_STATES, get_gazetteer
+from .geodesy import EARTH_MEAN_RADIUS_MILES
+
+SPATIAL_PLACES_PATH = getattr(
+    settings, "SPATIAL_PLACES_PATH", Path(__file__).resolve().parent.parent / "data" / "places.csv")
+
+CITY = "city"
+
+# leaves are scanned with numpy rather than split further
+_LEAF_SIZE = 8
+
+logger = logging.getLogger(__name__)
+
+
+def _unit_vectors(latitudes, longitudes) -> np.ndarray:
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def _unit_vector(latitude: float, longitude: float) -> np.ndarray:
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return np.array((cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)))
+
+
+def _chord_to_miles(chord: float) -> float:
+    return 2 * EARTH_MEAN_RADIUS_MILES * math.asin(min(chord / 2, 1.0))
+
+
+def _miles_to_chord(miles: float) -> float:
+    return 2 * math.sin(min(miles / EARTH_MEAN_RADIUS_MILES, math.pi) / 2)
+
+
+class KDTree:
+    """Static k-d tree laid out in flat arrays.
+
+    Node ``n`` covers ``order[start[n]:end[n]]``; inner nodes split on
+    ``axis[n]`` at ``split[n]`` with children ``2n + 1`` and ``2n + 2``.
+    """
+
+    def __init__(self, points: np.ndarray):
+        self.points = points
+        count = len(points)
+        self.order = np.arange(count)
+        self.start: List[int] = []
+        self.end: List[int] = []
+        self.axis: List[int] = []
+        self.split: List[float] = []
+        if count:
+            self._build(0, 0, count)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _node(self, node: int, start: int, end: int, axis: int, split: float) -> None:
+        missing = node + 1 - len(self.start)
+        if missing > 0:
+            self.start.extend([0] * missing)
+            self.end.extend([0] * missing)
+            self.axis.extend([-1] * missing)
+            self.split.extend([0.0] * missing)
+        self.start[node], self.end[node] = start, end
+        self.axis[node], self.split[node] = axis, split
+
+    def _build(self, node: int, start: int, end: int) -> None:
+        stack = [(node, start, end)]
+        while stack:
+            node, start, end = stack.pop()
+            if end - start <= _LEAF_SIZE:
+                self._node(node, start, end, -1, 0.0)
+                continue
+            block = self.points[self.order[start:end]]
+            axis = int(np.argmax(block.max(axis=0) - block.min(axis=0)))
+            middle = (end - start) // 2
+            partitioned = np.argpartition(block[:, axis], middle)
+            self.order[start:end] = self.order[start:end][partitioned]
+            split = float(self.points[self.order[start + middle], axis])
+            self._node(node, start, end, axis, split)
+            stack.append((2 * node + 1, start, start + middle))
+            stack.append((2 * node + 2, start + middle, end))
+
+    def nearest(self, point: np.ndarray, max_chord: float = math.inf) -> Optional[Tuple[int, float]]:
+        if not len(self.points):
+            return None
+        best_index, best_chord = -1, max_chord
+        stack = [(0, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if bound >= best_chord:
+                continue
+            axis = self.axis[node]
+            if axis < 0:
+                members = self.order[self.start[node]:self.end[node]]
+                offsets = self.points[members] - point
+                chords = np.sqrt(np.einsum("ij,ij->i", offsets, offsets))
+                closest = int(np.argmin(chords))
+                if chords[closest] < best_chord:
+                    best_index, best_chord = int(members[closest]), float(chords[closest])
+                continue
+            gap = float(point[axis]) - self.split[node]
+            near, far = (2 * node + 1, 2 * node + 2) if gap < 0 else (2 * node + 2, 2 * node + 1)
+            # visit the near side first so the far side is usually pruned
+            stack.append((far, max(bound, abs(gap))))
+            stack.append((near, bound))
+        return None if best_index < 0 else (best_index, best_chord)
+
+    def within(self, point: np.ndarray, max_chord: float) -> List[Tuple[int, float]]:
+        found: List[Tuple[int, float]] = []
+        if not len(self.points):
+            return found
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            axis = self.axis[node]
+            if axis < 0:
+                members = self.order[self.start[node]:self.end[node]]
+                offsets = self.points[members] - point
+                chords = np.sqrt(np.einsum("ij,ij->i", offsets, offsets))
+                hits = np.nonzero(chords <= max_chord)[0]
+                found.extend((int(members[hit]), float(chords[hit])) for hit in hits)
+                continue
+            gap = float(point[axis]) - self.split[node]
+            if gap - max_chord <= 0:
+                stack.append(2 * node + 1)
+            if gap + max_chord >= 0:
+                stack.append(2 * node + 2)
+        found.sort(key=lambda item: item[1])
+        return found
+
+
+class PlaceIndex:
+    def __init__(self, places: Iterable[Dict]):
+        self.places: List[Dict] = list(places)
+        self._trees: Dict[Optional[str], Tuple[KDTree, np.ndarray]] = {}
+        kinds = {place["kind"] for place in self.places}
+        for kind in (None, *kinds):
+            members = np.array(
+                [i for i, place in enumerate(self.places) if kind is None or place["kind"] == kind],
+                dtype=np.intp,
+            )
+            vectors = _unit_vectors(
+                [self.places[i]["latitude"] for i in members],
+                [self.places[i]["longitude"] for i in members],
+            ) if len(members) else np.empty((0, 3))
+            self._trees[kind] = (KDTree(vectors), members)
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def _result(self, members: np.ndarray, index: int, chord: float) -> Dict:
+        return {**self.places[int(members[index])], "distance_miles": _chord_to_miles(chord)}
+
+    def nearest(
+        self, latitude: float, longitude: float, kind: Optional[str] = None, max_miles: Optional[float] = None
+    ) -> Optional[Dict]:
+        if kind not in self._trees:
+            return None
+        tree, members = self._trees[kind]
+        max_chord = math.inf if max_miles is None else _miles_to_chord(max_miles)
+        hit = tree.nearest(_unit_vector(latitude, longitude), max_chord)
+        return None if hit is None else self._result(members, *hit)
+
+    def within(
+        self, latitude: float, longitude: float, radius_miles: float, kind: Optional[str] = None
+    ) -> List[Dict]:
+        if kind not in self._trees:
+            return []
+        tree, members = self._trees[kind]
+        hits = tree.within(_unit_vector(latitude, longitude), _miles_to_chord(radius_miles))
+        return [self._result(members, index, chord) for index, chord in hits]
+
+
+def _gazetteer_places() -> List[Dict]:
+    gazetteer = get_gazetteer()
+    places = []
+    for place in range(len(gazetteer)):
+        state = gazetteer.states[place]
+        places.append(
+            {
+                "name": gazetteer.names[place],
+                "kind": CITY,
+                "label": gazetteer.label(place),
+                "display_name": f"{gazetteer.label(place)}, United States" if state in US_STATES else gazetteer.label(place),
+                "latitude": gazetteer.latitudes[place],
+                "longitude": gazetteer.longitudes[place],
+            }
+        )
+    return places
+
+
+def load_places(path) -> List[Dict]:
+    places = []
+    with Path(path).open(encoding="utf-8", newline="") as handle:
+        for record in csv.DictReader(handle):
+            name = record["name"].strip()
+            state = (record.get("state") or "").strip().upper()
+            label = f"{name}, {state}" if state else name
+            places.append(
+                {
+                    "name": name,
+                    "kind": record["kind"].strip().lower(),
+                    "label": label,
+                    "display_name": label,
+                    "latitude": float(record["latitude"]),
+                    "longitude": float(record["longitude"]),
+                }
+            )
+    return places
+
+
+_index: Optional[PlaceIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_place_index() -> PlaceIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                places = _gazetteer_places()
+                if Path(SPATIAL_PLACES_PATH).exists():
+                    try:
+                        places.extend(load_places(SPATIAL_PLACES_PATH))
+                    except (OSError, KeyError, ValueError) as exc:
+                        logger.warning("Could not load places from %s: %s", SPATIAL_PLACES_PATH, exc)
+                _index = PlaceIndex(places)
+    return _index
@@ -0,0 +1,51 @@
+"""Storage of trip route geometry in the TripGeometry table.
+
+Plans come out of the planner with the geometry inside map_data; before
+saving, split_map_data takes it out so Trip.map_data keeps only the
+markers. The geometry dict (see polyline.build_geometry) is stored as
+zlib-compressed JSON.
+"""
+import json
+import zlib
+from typing import Dict, Optional, Tuple
+
+from ..models import Trip, TripGeometry
+from .polyline import geometry_for_map_data
+
+GEOMETRY_COMPRESSION_LEVEL = 6
+
+
+def pack_geometry(geometry: Dict) -> bytes:
+    return zlib.compress(json.dumps(geometry, separators=(",", ":")).encode("utf-8"), GEOMETRY_COMPRESSION_LEVEL)
+
+
+def unpack_geometry(data: bytes) -> Dict:
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def split_map_data(map_data: Dict) -> Tuple[Dict, Optional[Dict]]:
+    """map_data without its geometry (or legacy raw polyline), and that geometry."""
+    geometry = geometry_for_map_data(map_data)
+    markers_only = {key: value for key, value in (map_data or {}).items() if key not in ("geometry", "polyline")}
+    return markers_only, geometry
+
+
+def geometry_row(trip_id: int, geometry: Dict) -> TripGeometry:
+    return TripGeometry(trip_id=trip_id, data=pack_geometry(geometry), point_count=geometry.get("point_count", 0))
+
+
+def save_trip_geometry(trip_id: int, geometry: Optional[Dict]) -> None:
+    if geometry is None:
+        TripGeometry.objects.filter(trip_id=trip_id).delete()
+        return
+    row = geometry_row(trip_id, geometry)
+    TripGeometry.objects.update_or_create(
+        trip_id=trip_id, defaults={"data": row.data, "point_count": row.point_count})
+
+
+def load_trip_geometry(trip: Trip) -> Optional[Dict]:
+    data = TripGeometry.objects.filter(trip_id=trip.pk).values_list("data", flat=True).first()
+    if data is not None:
+        return unpack_geometry(data)
+    # rows the 0009 data migration has not moved yet still carry it inline
+    return geometry_for_map_data(trip.map_data)
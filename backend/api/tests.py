@@ -1 +1,1718 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import json
+import math
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+from unittest import mock
+
+import numpy as np
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from geopy.distance import geodesic
+from rest_framework.test import APIClient
+from django.utils import timezone
+
+from . import benchmarks, conditional, middleware, views
+from .models import GeocodeCacheEntry, Trip, TripGeometry, UpstreamCircuit, UpstreamLock
+from .services import (
+    async_planning, gazetteer, geodesy, hos, http, matrix, metrics, planning, polyline, singleflight, spatial,
+)
+from .services.cache import CACHE_MISS, LRUCache
+from .services.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from .services.geodesy import vincenty_miles
+from .services.http import TokenBucket
+from .services.polyline import build_geometry, render_geometry
+from .services.trip_geometry import load_trip_geometry, pack_geometry
+from .services.feasibility import hos_feasibility
+from .services.hos_logs import compact_hos_logs, expand_hos_logs, hours_to_microseconds, hours_to_microseconds_array
+from .services.hos import (
+    AVERAGE_SPEED_MPH,
+    BREAK_DURATION_HOURS,
+    BREAK_TRIGGER_DRIVING_HOURS,
+    CYCLE_LIMIT_HOURS,
+    DROPOFF_DURATION_HOURS,
+    FUELING_DURATION_HOURS,
+    FUELING_INTERVAL_MILES,
+    MAX_DRIVING_HOURS_PER_DAY,
+    MAX_ON_DUTY_HOURS_PER_DAY,
+    PICKUP_DURATION_HOURS,
+    SLEEPER_BERTH_HOURS,
+)
+
+FIXED_NOW = datetime(2025, 3, 14, 15, 9, 26, tzinfo=dt_timezone.utc)
+
+
+# The loop-based planner _generate_hos_plan replaced, kept verbatim as the
+# oracle for the differential test below.
+def reference_hos_plan(distance_miles: float, cycle_used: float) -> Dict:
+    cycle_total = float(cycle_used)
+    initial_cycle = cycle_total
+    if cycle_total >= CYCLE_LIMIT_HOURS:
+        raise ValueError("Driver has no remaining cycle hours available.")
+
+    start_of_day = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
+    distance_remaining = distance_miles
+    logs = []
+    stops: List[Dict] = []
+    distance_since_fuel = 0.0
+    fueling_index = 1
+    pickup_timestamp: Optional[str] = None
+    dropoff_timestamp: Optional[str] = None
+    total_on_duty_hours = 0.0
+    completion_time = start_of_day
+
+    day_index = 1
+    limit_reached = False
+    pickup_recorded = False
+
+    while distance_remaining > 0:
+        if cycle_total >= CYCLE_LIMIT_HOURS:
+            limit_reached = True
+            break
+
+        day_start = start_of_day + timedelta(days=day_index - 1)
+        current_time = day_start
+        day_entries: List[Dict] = []
+        driving_today = 0.0
+        on_duty_today = 0.0
+        hours_since_break = 0.0
+
+        # Pre-trip inspection
+        pretrip_hours = min(0.5, CYCLE_LIMIT_HOURS - cycle_total)
+        if pretrip_hours <= 0:
+            limit_reached = True
+            break
+        day_entries.append(
+            {
+                "activity": "Pre-Trip Inspection",
+                "status": "On Duty",
+                "start": current_time.isoformat(),
+                "end": (current_time + timedelta(hours=pretrip_hours)).isoformat(),
+                "duration_hours": round(pretrip_hours, 2),
+            }
+        )
+        current_time += timedelta(hours=pretrip_hours)
+        on_duty_today += pretrip_hours
+        cycle_total += pretrip_hours
+        total_on_duty_hours += pretrip_hours
+        completion_time = current_time
+
+        if not pickup_recorded:
+            pickup_hours = min(PICKUP_DURATION_HOURS,
+                               CYCLE_LIMIT_HOURS - cycle_total)
+            if pickup_hours <= 0:
+                limit_reached = True
+                break
+            pickup_entry = {
+                "activity": "Pickup Service",
+                "status": "On Duty",
+                "start": current_time.isoformat(),
+                "end": (current_time + timedelta(hours=pickup_hours)).isoformat(),
+                "duration_hours": round(pickup_hours, 2),
+            }
+            day_entries.append(pickup_entry)
+            pickup_timestamp = pickup_entry["end"]
+            current_time += timedelta(hours=pickup_hours)
+            on_duty_today += pickup_hours
+            cycle_total += pickup_hours
+            total_on_duty_hours += pickup_hours
+            completion_time = current_time
+            pickup_recorded = True
+            stops.append(
+                {
+                    "type": "Pickup",
+                    "details": "Pickup service completed",
+                    "timestamp": pickup_timestamp,
+                }
+            )
+
+        while distance_remaining > 0 and cycle_total < CYCLE_LIMIT_HOURS:
+            if (
+                driving_today >= MAX_DRIVING_HOURS_PER_DAY
+                or on_duty_today >= MAX_ON_DUTY_HOURS_PER_DAY
+            ):
+                break
+
+            break_limit = BREAK_TRIGGER_DRIVING_HOURS - hours_since_break
+            drive_capacity = min(
+                MAX_DRIVING_HOURS_PER_DAY - driving_today,
+                MAX_ON_DUTY_HOURS_PER_DAY - on_duty_today,
+                CYCLE_LIMIT_HOURS - cycle_total,
+                break_limit,
+            )
+
+            distance_hours_possible = distance_remaining / AVERAGE_SPEED_MPH
+            drive_hours = min(drive_capacity, distance_hours_possible)
+
+            if drive_hours <= 0:
+                if (
+                    hours_since_break >= BREAK_TRIGGER_DRIVING_HOURS
+                    and on_duty_today < MAX_ON_DUTY_HOURS_PER_DAY
+                ):
+                    break_entry = {
+                        "activity": "30-Minute Break",
+                        "status": "Off Duty",
+                        "start": current_time.isoformat(),
+                        "end": (current_time + timedelta(hours=BREAK_DURATION_HOURS)).isoformat(),
+                        "duration_hours": BREAK_DURATION_HOURS,
+                    }
+                    day_entries.append(break_entry)
+                    current_time += timedelta(hours=BREAK_DURATION_HOURS)
+                    hours_since_break = 0.0
+                    completion_time = current_time
+                    continue
+                break
+
+            distance_chunk = drive_hours * AVERAGE_SPEED_MPH
+            drive_entry = {
+                "activity": "Driving",
+                "status": "Driving",
+                "start": current_time.isoformat(),
+                "end": (current_time + timedelta(hours=drive_hours)).isoformat(),
+                "duration_hours": round(drive_hours, 2),
+            }
+            day_entries.append(drive_entry)
+            current_time += timedelta(hours=drive_hours)
+            driving_today += drive_hours
+            on_duty_today += drive_hours
+            hours_since_break += drive_hours
+            cycle_total += drive_hours
+            total_on_duty_hours += drive_hours
+            distance_remaining -= distance_chunk
+            distance_since_fuel += distance_chunk
+            completion_time = current_time
+
+            if distance_remaining <= 0:
+                break
+
+            if distance_since_fuel >= FUELING_INTERVAL_MILES:
+                if cycle_total + FUELING_DURATION_HOURS > CYCLE_LIMIT_HOURS:
+                    limit_reached = True
+                    break
+                fuel_entry = {
+                    "activity": "Fueling",
+                    "status": "On Duty",
+                    "start": current_time.isoformat(),
+                    "end": (current_time + timedelta(hours=FUELING_DURATION_HOURS)).isoformat(),
+                    "duration_hours": FUELING_DURATION_HOURS,
+                }
+                day_entries.append(fuel_entry)
+                current_time += timedelta(hours=FUELING_DURATION_HOURS)
+                on_duty_today += FUELING_DURATION_HOURS
+                cycle_total += FUELING_DURATION_HOURS
+                total_on_duty_hours += FUELING_DURATION_HOURS
+                completion_time = current_time
+                stops.append(
+                    {
+                        "type": "Fuel Stop",
+                        "details": f"Fuel stop {fueling_index}",
+                        "timestamp": fuel_entry["end"],
+                    }
+                )
+                fueling_index += 1
+                distance_since_fuel = 0.0
+
+            if cycle_total >= CYCLE_LIMIT_HOURS:
+                limit_reached = True
+                break
+
+        if distance_remaining <= 0:
+            if cycle_total + DROPOFF_DURATION_HOURS <= CYCLE_LIMIT_HOURS:
+                drop_entry = {
+                    "activity": "Dropoff Service",
+                    "status": "On Duty",
+                    "start": current_time.isoformat(),
+                    "end": (current_time + timedelta(hours=DROPOFF_DURATION_HOURS)).isoformat(),
+                    "duration_hours": DROPOFF_DURATION_HOURS,
+                }
+                day_entries.append(drop_entry)
+                current_time += timedelta(hours=DROPOFF_DURATION_HOURS)
+                dropoff_timestamp = drop_entry["end"]
+                on_duty_today += DROPOFF_DURATION_HOURS
+                cycle_total += DROPOFF_DURATION_HOURS
+                total_on_duty_hours += DROPOFF_DURATION_HOURS
+                completion_time = current_time
+                stops.append(
+                    {
+                        "type": "Dropoff",
+                        "details": "Dropoff service completed",
+                        "timestamp": dropoff_timestamp,
+                    }
+                )
+        elif cycle_total < CYCLE_LIMIT_HOURS:
+            sleeper_entry = {
+                "activity": "Sleeper Berth",
+                "status": "Off Duty",
+                "start": current_time.isoformat(),
+                "end": (current_time + timedelta(hours=SLEEPER_BERTH_HOURS)).isoformat(),
+                "duration_hours": SLEEPER_BERTH_HOURS,
+            }
+            day_entries.append(sleeper_entry)
+            current_time += timedelta(hours=SLEEPER_BERTH_HOURS)
+            completion_time = current_time
+            stops.append(
+                {
+                    "type": "Rest",
+                    "details": f"Day {day_index} 10-hour rest",
+                    "timestamp": sleeper_entry["start"],
+                }
+            )
+        else:
+            limit_reached = True
+
+        if day_entries:
+            logs.append(
+                {
+                    "day": day_index,
+                    "start": day_start.isoformat(),
+                    "entries": day_entries,
+                }
+            )
+
+        if distance_remaining <= 0 or limit_reached:
+            break
+
+        day_index += 1
+
+    summary = {
+        "total_distance_miles": round(distance_miles, 2),
+        "estimated_drive_hours": round(distance_miles / AVERAGE_SPEED_MPH, 2),
+        "days_planned": len(logs),
+        "cycle_hours_start": round(initial_cycle, 2),
+        "cycle_hours_consumed": round(max(cycle_total - initial_cycle, 0), 2),
+        "cycle_limit_reached": limit_reached,
+        "remaining_distance_miles": round(max(distance_remaining, 0), 2),
+        "estimated_completion": completion_time.isoformat(),
+    }
+
+    return {
+        "summary": summary,
+        "logs": logs,
+        "stops": stops,
+        "pickup_timestamp": pickup_timestamp,
+        "dropoff_timestamp": dropoff_timestamp,
+    }
+
+
+class HosPlannerDifferentialTests(SimpleTestCase):
+    DISTANCES = [
+        0, 0.4, 1, 27.5, 55, 439.99, 440, 440.01, 604.8, 605, 999.99, 1000,
+        1000.01, 1234.56, 2000, 2500, 2999.5, 4321.09, 6000, 12000, 25000,
+    ]
+    CYCLES = [0, 0.25, 10, 10.25, 33.33, 45.5, 58.6, 60, 65.75, 68.9, 69, 69.4, 69.5, 69.6, 69.99]
+
+    def assertMatchesReference(self, distance, cycle_used):
+        with mock.patch.object(timezone, "now", return_value=FIXED_NOW):
+            expected = reference_hos_plan(distance, cycle_used)
+            actual = hos._generate_hos_plan(distance, cycle_used)
+        # logs come back compact and are only expanded at serialization time
+        actual["logs"] = expand_hos_logs(actual["logs"])
+        # map waypoints postdate the reference planner; check they stay on the route
+        miles = [waypoint["miles_from_start"] for waypoint in actual.pop("waypoints")]
+        self.assertEqual(miles, sorted(miles))
+        self.assertTrue(all(0 <= mile <= distance for mile in miles))
+        self.assertEqual(actual, expected)
+        # identical values must also serialize identically (int vs float durations)
+        self.assertEqual(repr(actual), repr(expected))
+
+    def test_matches_reference_across_distance_and_cycle_grid(self):
+        for distance in self.DISTANCES:
+            for cycle_used in self.CYCLES:
+                with self.subTest(distance=distance, cycle_used=cycle_used):
+                    self.assertMatchesReference(distance, cycle_used)
+
+    def test_matches_reference_for_routed_distances(self):
+        # distances as produced by _fetch_route: rounded to two decimals
+        for step in range(1, 400):
+            distance = round(step * 37.13, 2)
+            with self.subTest(distance=distance):
+                self.assertMatchesReference(distance, (step * 0.37) % 70)
+
+    def test_exhausted_cycle_is_rejected(self):
+        with self.assertRaises(ValueError):
+            hos._generate_hos_plan(100, CYCLE_LIMIT_HOURS)
+
+
+class HosLogsFormatTests(SimpleTestCase):
+    def test_verbose_logs_round_trip_through_compact_format(self):
+        with mock.patch.object(timezone, "now", return_value=FIXED_NOW):
+            verbose = reference_hos_plan(2750.25, 12.5)["logs"]
+        self.assertEqual(expand_hos_logs(compact_hos_logs(verbose)), verbose)
+
+    def test_empty_logs(self):
+        self.assertEqual(expand_hos_logs([]), [])
+        self.assertEqual(expand_hos_logs(compact_hos_logs([])), [])
+
+
+class HosFeasibilityTests(SimpleTestCase):
+    def test_matches_scalar_scheduler(self):
+        distances = HosPlannerDifferentialTests.DISTANCES + [round(step * 37.13, 2) for step in range(1, 120)]
+        cycles = HosPlannerDifferentialTests.CYCLES + [(step * 0.37) % 70 for step in range(1, 40)]
+        sweep = hos_feasibility(distances, cycles)
+        for row, cycle_used in enumerate(cycles):
+            for column, distance in enumerate(distances):
+                schedule = hos._schedule_hos_events(distance, cycle_used)
+                with self.subTest(distance=distance, cycle_used=cycle_used):
+                    self.assertEqual(sweep["days_planned"][row, column], schedule["days_planned"])
+                    self.assertEqual(
+                        (sweep["completion_day"][row, column], sweep["completion_offset"][row, column]),
+                        schedule["completion"],
+                    )
+                    self.assertEqual(sweep["limit_reached"][row, column], schedule["limit_reached"])
+                    self.assertEqual(sweep["cycle_total"][row, column], schedule["cycle_total"])
+                    self.assertEqual(sweep["distance_remaining"][row, column], schedule["distance_remaining"])
+
+    def test_exhausted_cycle_plans_nothing(self):
+        sweep = hos_feasibility([0, 100], [CYCLE_LIMIT_HOURS, 80])
+        self.assertTrue(sweep["limit_reached"].all())
+        self.assertFalse(sweep["days_planned"].any())
+
+    def test_microsecond_conversion_matches_timedelta(self):
+        hours = [0, 0.5, 1, 10, 0.1 + 0.2, 1.5 / 3_600_000_000, 2.5 / 3_600_000_000, 7.123456789, 10.999999999]
+        self.assertEqual(
+            hours_to_microseconds_array(hours).tolist(), [hours_to_microseconds(value) for value in hours])
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_expired_entries_are_misses(self):
+        cache = LRUCache(4)
+        cache.set("fresh", 1, time.time() + 60)
+        cache.set("stale", 2, time.time() - 1)
+        self.assertEqual(cache.get("fresh"), 1)
+        self.assertIs(cache.get("stale"), CACHE_MISS)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        expires = time.time() + 60
+        cache.set("a", 1, expires)
+        cache.set("b", 2, expires)
+        cache.get("a")
+        cache.set("c", 3, expires)
+        self.assertIs(cache.get("b"), CACHE_MISS)
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+
+
+class GeocodeCacheTests(TestCase):
+    def setUp(self):
+        self.cache = hos.GeocodeCache(max_entries=8, ttl_seconds=3600, negative_ttl_seconds=60)
+        self.location = {"latitude": 41.88, "longitude": -87.63, "display_name": "Chicago, Illinois"}
+
+    def test_hit_survives_a_cold_memory_tier(self):
+        self.cache.set("Chicago,  IL", self.location)
+        self.cache.clear()
+        self.assertEqual(self.cache.get("chicago, il"), self.location)
+        self.assertEqual(self.cache.stats()["db_hits"], 1)
+
+    def test_no_result_is_cached_with_the_negative_ttl(self):
+        self.cache.set("Nowhere Special", None)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("nowhere special"))
+        entry = GeocodeCacheEntry.objects.get(query_key="nowhere special")
+        self.assertFalse(entry.found)
+        self.assertLessEqual(entry.expires_at, timezone.now() + timedelta(seconds=60))
+
+    def test_expired_entries_are_misses(self):
+        self.cache.set("Chicago, IL", self.location)
+        GeocodeCacheEntry.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.cache.clear()
+        self.assertIs(self.cache.get("Chicago, IL"), CACHE_MISS)
+
+    def test_long_queries_sharing_a_prefix_get_distinct_keys(self):
+        prefix = "warehouse " * 30
+        first, second = f"{prefix}north dock", f"{prefix}south dock"
+        self.assertNotEqual(hos.normalize_query(first), hos.normalize_query(second))
+        self.assertLessEqual(len(hos.normalize_query(first)), hos.GEOCODE_QUERY_KEY_MAX_LENGTH)
+        self.cache.set(first, self.location)
+        self.cache.set(second, None)
+        self.cache.clear()
+        self.assertEqual(self.cache.get(first), self.location)
+        self.assertIsNone(self.cache.get(second))
+
+
+class RouteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = hos.RouteCache(max_entries=8, precision=4, ttl_seconds=3600, fallback_ttl_seconds=60)
+        self.points = [
+            {"latitude": 41.878114, "longitude": -87.629798},
+            {"latitude": 39.739236, "longitude": -104.990251},
+        ]
+        self.route = {
+            "distance_miles": 1003.2,
+            "duration_hours": 14.9,
+            "polyline": [[41.878114, -87.629798], [39.739236, -104.990251]],
+            "legs": [{"segment": 1, "distance_miles": 1003.2, "duration_hours": 14.9}],
+        }
+
+    def test_nearby_waypoints_share_a_key(self):
+        nudged = [{"latitude": 41.87812, "longitude": -87.62979}, self.points[1]]
+        self.cache.set(self.points, self.route)
+        self.assertEqual(self.cache.get(nudged)["distance_miles"], 1003.2)
+
+    def test_waypoint_order_and_distinct_points_matter(self):
+        self.cache.set(self.points, self.route)
+        self.assertIs(self.cache.get(self.points[::-1]), CACHE_MISS)
+        moved = [{"latitude": 41.8790, "longitude": -87.629798}, self.points[1]]
+        self.assertIs(self.cache.get(moved), CACHE_MISS)
+
+    def test_fallback_routes_use_the_short_ttl(self):
+        with mock.patch.object(hos.time, "time", return_value=1_000_000.0):
+            self.cache.set(self.points, {**self.route, "fallback": True})
+        with mock.patch.object(hos.time, "time", return_value=1_000_000.0 + 61):
+            self.assertIs(self.cache.get(self.points), CACHE_MISS)
+            self.cache.set(self.points, self.route)
+        with mock.patch.object(hos.time, "time", return_value=1_000_000.0 + 61 + 3599):
+            self.assertFalse(self.cache.get(self.points)["fallback"])
+
+    def test_cached_routes_are_returned_as_copies(self):
+        self.cache.set(self.points, self.route)
+        self.cache.get(self.points)["distance_miles"] = 0
+        self.assertEqual(self.cache.get(self.points)["distance_miles"], 1003.2)
+
+
+class VincentyTests(SimpleTestCase):
+    PAIRS = [
+        ((41.878114, -87.629798), (39.739236, -104.990251)),
+        ((0, 0), (0, 10)),
+        ((0, 0), (0, 0)),
+        ((89.9, 0), (-89.9, 180)),
+        ((-33.8688, 151.2093), (51.5072, -0.1276)),
+        # nearly antipodal: Vincenty does not converge and geopy answers
+        ((0, 0), (0.5, 179.7)),
+    ]
+
+    def test_matches_geopy_within_documented_tolerance(self):
+        (lat1, lon1), (lat2, lon2) = (list(zip(*side)) for side in zip(*self.PAIRS))
+        miles = vincenty_miles(lat1, lon1, lat2, lon2)
+        for (start, end), actual in zip(self.PAIRS, miles):
+            with self.subTest(start=start, end=end):
+                self.assertAlmostEqual(actual, geodesic(start, end).miles, delta=1e-6)
+
+    def test_accepts_scalars(self):
+        for start, end in self.PAIRS:
+            with self.subTest(start=start, end=end):
+                miles = vincenty_miles(*start, *end)
+                self.assertEqual(miles.shape, ())
+                self.assertAlmostEqual(float(miles), geodesic(start, end).miles, delta=1e-6)
+
+
+class TripApiTestCase(TestCase):
+    # gazetteer locations and straight-line routes, so nothing reaches Nominatim or OSRM
+    TRIP = {
+        "current_location": "Chicago, IL",
+        "pickup_location": "Denver, CO",
+        "dropoff_location": "Dallas, TX",
+        "current_cycle_used": "20.00",
+    }
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("driver", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch.object(hos, "_request_route", hos.fallback_route)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(hos.route_cache.clear)
+
+    def create_trip(self, **overrides) -> Dict:
+        response = self.client.post("/api/trips/", {**self.TRIP, **overrides}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+
+class TripUpdateTests(TripApiTestCase):
+    def test_replans_outside_the_transaction(self):
+        trip = self.create_trip()
+        depth = len(connection.atomic_blocks)
+        depths = []
+
+        def replan(edited):
+            depths.append(len(connection.atomic_blocks))
+            return hos.replan_trip(edited)
+
+        with mock.patch.object(views, "replan_trip", side_effect=replan):
+            response = self.client.patch(f"/api/trips/{trip['id']}/", {"dropoff_location": "Chicago, IL"}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(depths, [depth])
+        stored = Trip.objects.get(pk=trip["id"])
+        self.assertEqual(stored.dropoff_location, "Chicago, IL")
+        self.assertEqual(stored.route_summary["stops"][2]["details"], "Chicago, IL, United States")
+
+    def test_failed_replan_leaves_the_trip_untouched(self):
+        trip = self.create_trip()
+        before = Trip.objects.get(pk=trip["id"])
+        with mock.patch.object(views, "replan_trip", side_effect=ValueError("No route.")):
+            response = self.client.patch(f"/api/trips/{trip['id']}/", {"dropoff_location": "Chicago, IL"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        after = Trip.objects.get(pk=trip["id"])
+        self.assertEqual(
+            (after.dropoff_location, after.route_summary, after.updated_at),
+            (before.dropoff_location, before.route_summary, before.updated_at),
+        )
+
+
+class StreamingActionTests(TripApiTestCase):
+    def test_export_accepts_its_own_media_type(self):
+        self.create_trip()
+        for export_format, accept in (("csv", "text/csv"), ("ndjson", "application/x-ndjson")):
+            with self.subTest(export_format=export_format):
+                response = self.client.get(f"/api/trips/export/{export_format}/", HTTP_ACCEPT=accept)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response["Content-Type"].startswith(accept))
+                self.assertTrue(b"".join(response.streaming_content))
+
+    def test_export_errors_are_json(self):
+        response = self.client.get("/api/trips/export/csv/?since=yesterday", HTTP_ACCEPT="text/csv")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("since", response.json())
+
+    def test_bulk_accepts_ndjson(self):
+        body = "\n".join(json.dumps(row) for row in (self.TRIP, {**self.TRIP, "current_cycle_used": "oops"}))
+        # the pool thread cannot write to the test transaction's tables; keep coalescing in-process
+        with mock.patch.object(singleflight, "_acquire", return_value=singleflight._UNAVAILABLE):
+            response = self.client.post(
+                "/api/trips/bulk/", body, content_type="application/x-ndjson", HTTP_ACCEPT="application/x-ndjson")
+            content = b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(sorted(line["status"] for line in lines), ["created", "error"])
+
+    def test_unrelated_media_types_are_still_refused(self):
+        response = self.client.get("/api/trips/export/csv/", HTTP_ACCEPT="image/png")
+        self.assertEqual(response.status_code, 406)
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker("test", failure_threshold=3, reset_seconds=30)
+
+    def state(self):
+        return UpstreamCircuit.objects.values_list("state", "failures").get(name="test")
+
+    def cool_down(self):
+        past = timezone.now() - timedelta(seconds=31)
+        UpstreamCircuit.objects.filter(name="test").update(opened_at=past, updated_at=past)
+
+    def open_circuit(self):
+        self.breaker.record_failure(3)
+        self.assertEqual(self.state()[0], OPEN)
+
+    def test_opens_after_threshold_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.state(), (CLOSED, 2))
+        self.breaker.record_failure()
+        self.assertEqual(self.state(), (OPEN, 3))
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.state(), (CLOSED, 0))
+        self.breaker.record_failure()
+        self.assertEqual(self.state(), (CLOSED, 1))
+
+    def test_stays_open_until_the_cooldown_passes(self):
+        self.open_circuit()
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.state()[0], OPEN)
+
+    def test_lets_a_single_probe_through_after_the_cooldown(self):
+        self.open_circuit()
+        self.cool_down()
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.state()[0], HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertFalse(CircuitBreaker("test", failure_threshold=3, reset_seconds=30).allow())
+
+    def test_successful_probe_closes_the_circuit(self):
+        self.open_circuit()
+        self.cool_down()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.state(), (CLOSED, 0))
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens_the_circuit(self):
+        self.open_circuit()
+        self.cool_down()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.state()[0], OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_another_threads_clean_read_does_not_skip_a_reset(self):
+        # an unseen circuit reads as clean, so the worker thread's record_success would skip
+        worker = threading.Thread(target=self.breaker.allow)
+        worker.start()
+        worker.join()
+        UpstreamCircuit.objects.create(name="test", failures=2)
+        self.breaker.record_success()
+        self.assertEqual(self.state(), (CLOSED, 0))
+
+
+# the UpstreamLock table is skipped inside transactions, so these run outside TestCase's
+class SingleFlightTests(TransactionTestCase):
+    def setUp(self):
+        # two instances stand in for two worker processes sharing the table
+        self.here = singleflight.SingleFlight("test")
+        self.there = singleflight.SingleFlight("test")
+
+    def lock_key(self):
+        return f"test:{hashlib.sha256(repr('key').encode('utf-8')).hexdigest()}"
+
+    def test_a_later_caller_does_its_own_lookup(self):
+        self.assertEqual(self.there.run("key", lambda: {"answer": 1}), {"answer": 1})
+        self.assertEqual(self.here.run("key", lambda: {"answer": 2}), {"answer": 2})
+        self.assertEqual(UpstreamLock.objects.get().result, {"answer": 2})
+
+    def test_a_caller_waiting_on_the_lookup_gets_its_result(self):
+        lock_key = self.lock_key()
+        UpstreamLock.objects.create(key=lock_key, expires_at=timezone.now() + timedelta(seconds=60))
+
+        def publish(seconds):
+            UpstreamLock.objects.filter(key=lock_key).update(done=True, result={"answer": 1})
+
+        lookup = mock.Mock(return_value={"answer": 2})
+        with mock.patch.object(singleflight.time, "sleep", side_effect=publish):
+            self.assertEqual(self.here.run("key", lookup), {"answer": 1})
+        lookup.assert_not_called()
+
+    def test_an_abandoned_lock_lets_the_waiter_look_up_itself(self):
+        lock_key = self.lock_key()
+        UpstreamLock.objects.create(key=lock_key, expires_at=timezone.now() + timedelta(seconds=60))
+
+        def give_up(seconds):
+            UpstreamLock.objects.filter(key=lock_key).delete()
+
+        with mock.patch.object(singleflight.time, "sleep", side_effect=give_up):
+            self.assertEqual(self.here.run("key", lambda: {"answer": 2}), {"answer": 2})
+
+
+class NominatimPacingTests(SimpleTestCase):
+    def test_bucket_spaces_out_calls_after_the_burst(self):
+        with mock.patch.object(time, "monotonic", return_value=100.0):
+            bucket = TokenBucket(rate=2, burst=2)
+            delays = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(delays, [0.0, 0.0, 0.5, 1.0])
+
+    def test_blocking_and_async_paths_share_one_bucket(self):
+        self.assertIs(async_planning.nominatim_bucket, hos.nominatim_bucket)
+        with mock.patch.object(hos.nominatim_bucket, "wait") as wait, \
+                mock.patch.object(hos._geolocator, "geocode", return_value=None):
+            hos._geocode("Nowhere Special")
+        wait.assert_called_once_with()
+
+
+class TripConditionalGetTests(TripApiTestCase):
+    def setUp(self):
+        super().setUp()
+        conditional._response_cache.clear()
+        self.addCleanup(conditional._response_cache.clear)
+        self.trip = self.create_trip()
+        self.url = f"/api/trips/{self.trip['id']}/"
+
+    def test_matching_etag_gets_304(self):
+        etag = self.client.get(self.url)["ETag"]
+        for header in (etag, f"W/{etag}", f'"other", {etag}'):
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_IF_NONE_MATCH=header)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_list_etag_changes_with_the_trip_set(self):
+        etag = self.client.get("/api/trips/")["ETag"]
+        self.assertEqual(self.client.get("/api/trips/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.create_trip(dropoff_location="Chicago, IL")
+        response = self.client.get("/api/trips/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_replan_changes_the_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.client.patch(self.url, {"dropoff_location": "Chicago, IL"}, format="json")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["dropoff_location"], "Chicago, IL")
+
+    def test_status_update_changes_the_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        Trip.objects.filter(pk=self.trip["id"]).update(status=Trip.Status.FAILED, updated_at=timezone.now())
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], Trip.Status.FAILED)
+
+    def test_delete_drops_the_cached_body(self):
+        self.client.get(self.url)
+        self.assertIsNot(conditional._response_cache.get(self.trip["id"]), CACHE_MISS)
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertIs(conditional._response_cache.get(self.trip["id"]), CACHE_MISS)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    @override_settings(ALLOWED_HOSTS=["testserver", "api.example.com"])
+    def test_cached_bodies_keep_each_origins_geometry_url(self):
+        for _ in range(2):
+            for host, secure, origin in (
+                ("testserver", False, "http://testserver"),
+                ("api.example.com", True, "https://api.example.com"),
+            ):
+                with self.subTest(origin=origin):
+                    response = self.client.get(self.url, HTTP_HOST=host, secure=secure)
+                    self.assertTrue(response.json()["map_data"]["geometry_url"].startswith(f"{origin}/api/"))
+
+
+ROUTE_POINTS = [[41.8781, -87.6298], [41.5, -90.1], [41.2, -93.4], [40.1, -98.7], [39.7392, -104.9903]]
+
+
+class TripGeometryStorageTests(TestCase):
+    def make_trip(self, map_data):
+        return Trip.objects.create(
+            current_location="Chicago, IL",
+            pickup_location="Denver, CO",
+            dropoff_location="Dallas, TX",
+            current_cycle_used=20,
+            map_data=map_data,
+        )
+
+    def test_loads_the_geometry_row(self):
+        trip = self.make_trip({"markers": []})
+        geometry = build_geometry(ROUTE_POINTS)
+        TripGeometry.objects.create(trip=trip, data=pack_geometry(geometry), point_count=len(ROUTE_POINTS))
+        self.assertEqual(load_trip_geometry(trip), geometry)
+
+    def test_falls_back_to_inline_geometry(self):
+        geometry = build_geometry(ROUTE_POINTS)
+        self.assertEqual(load_trip_geometry(self.make_trip({"geometry": geometry, "markers": []})), geometry)
+
+    def test_falls_back_to_a_legacy_polyline(self):
+        trip = self.make_trip({"polyline": ROUTE_POINTS, "markers": []})
+        self.assertEqual(load_trip_geometry(trip), build_geometry(ROUTE_POINTS))
+
+    def test_no_geometry(self):
+        self.assertIsNone(load_trip_geometry(self.make_trip({"markers": []})))
+
+
+class MoveTripGeometryMigrationTests(TransactionTestCase):
+    before = [("api", "0008_tripgeometry")]
+    after = [("api", "0009_move_trip_geometry")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_moves_geometry_out_and_back(self):
+        apps = self.migrate(self.before)
+        HistoricalTrip = apps.get_model("api", "Trip")
+        fields = {
+            "current_location": "Chicago, IL",
+            "pickup_location": "Denver, CO",
+            "dropoff_location": "Dallas, TX",
+            "current_cycle_used": 20,
+        }
+        geometry = build_geometry(ROUTE_POINTS)
+        inline = HistoricalTrip.objects.create(map_data={"geometry": geometry, "markers": [1]}, **fields)
+        legacy = HistoricalTrip.objects.create(map_data={"polyline": ROUTE_POINTS, "markers": [2]}, **fields)
+        bare = HistoricalTrip.objects.create(map_data={"markers": [3]}, **fields)
+
+        apps = self.migrate(self.after)
+        HistoricalTrip = apps.get_model("api", "Trip")
+        HistoricalGeometry = apps.get_model("api", "TripGeometry")
+        self.assertEqual(
+            {trip.pk: trip.map_data for trip in HistoricalTrip.objects.all()},
+            {inline.pk: {"markers": [1]}, legacy.pk: {"markers": [2]}, bare.pk: {"markers": [3]}},
+        )
+        rows = {row.trip_id: row for row in HistoricalGeometry.objects.all()}
+        self.assertEqual(set(rows), {inline.pk, legacy.pk})
+        for pk in (inline.pk, legacy.pk):
+            self.assertEqual(
+                json.loads(zlib.decompress(bytes(rows[pk].data))), geometry)
+            self.assertEqual(rows[pk].point_count, len(ROUTE_POINTS))
+
+        apps = self.migrate(self.before)
+        HistoricalTrip = apps.get_model("api", "Trip")
+        restored = {trip.pk: trip.map_data for trip in HistoricalTrip.objects.all()}
+        self.assertEqual(restored[inline.pk], {"markers": [1], "geometry": geometry})
+        self.assertEqual(restored[legacy.pk], {"markers": [2], "geometry": geometry})
+        self.assertEqual(restored[bare.pk], {"markers": [3]})
+
+
+class GeocodeLocationsTests(TestCase):
+    def setUp(self):
+        hos._geocode_cache.clear()
+        self.addCleanup(hos._geocode_cache.clear)
+
+    def test_local_resolutions_skip_the_pool(self):
+        queries = ["Chicago, IL", "Pinned location (40.7128, -74.0060)", "Chicago, IL"]
+        with mock.patch.object(hos._geocode_executor, "submit") as submit, \
+                mock.patch.object(hos, "_query_geocoder") as query_geocoder:
+            located = hos.geocode_locations(queries)
+        submit.assert_not_called()
+        query_geocoder.assert_not_called()
+        self.assertEqual([location["query"] for location in located], queries)
+        self.assertEqual((located[1]["latitude"], located[1]["longitude"]), (40.7128, -74.006))
+
+    def test_only_distinct_remote_queries_use_the_pool(self):
+        def query_geocoder(query):
+            return hos.approximate_location(query), None
+
+        queries = ["Chicago, IL", "Nowhere One", "Nowhere Two", "nowhere one"]
+        with mock.patch.object(hos, "_query_geocoder", side_effect=query_geocoder), \
+                mock.patch.object(hos._geocode_executor, "submit", wraps=hos._geocode_executor.submit) as submit:
+            hos.geocode_locations(queries)
+        self.assertEqual(sorted(call.args[1] for call in submit.call_args_list), ["Nowhere One", "Nowhere Two"])
+
+    def test_a_single_remote_query_runs_inline(self):
+        with mock.patch.object(hos, "_query_geocoder", side_effect=lambda query: (hos.approximate_location(query), None)), \
+                mock.patch.object(hos._geocode_executor, "submit") as submit:
+            hos.geocode_locations(["Chicago, IL", "Nowhere One"])
+        submit.assert_not_called()
+
+
+class HttpSessionTests(SimpleTestCase):
+    def test_session_retries_connections_and_gateway_errors_only(self):
+        session = http._build_session()
+        retry = session.get_adapter("https://router.project-osrm.org").max_retries
+        self.assertEqual((retry.total, retry.connect, retry.read), (http.HTTP_MAX_RETRIES, http.HTTP_MAX_RETRIES, 0))
+        self.assertEqual(retry.status, http.HTTP_MAX_RETRIES)
+        self.assertEqual(set(retry.status_forcelist), {502, 503, 504})
+        self.assertEqual(retry.allowed_methods, frozenset({"GET"}))
+        self.assertEqual(retry.backoff_factor, 0.2)
+        self.assertFalse(retry.raise_on_status)
+        self.assertIs(session.get_adapter("http://localhost").max_retries, retry)
+        self.assertEqual(session.headers["User-Agent"], http.HTTP_USER_AGENT)
+
+    def test_session_is_shared(self):
+        self.assertIs(http.get_session(), http.get_session())
+
+    def test_timeout_is_connect_then_read(self):
+        self.assertEqual(http.timeout(15), (http.HTTP_CONNECT_TIMEOUT_SECONDS, 15))
+        self.assertEqual(hos._geolocator.timeout, (http.HTTP_CONNECT_TIMEOUT_SECONDS, hos.NOMINATIM_READ_TIMEOUT_SECONDS))
+
+    def test_osrm_requests_use_the_session_and_timeout(self):
+        session = mock.Mock()
+        session.get.return_value.json.return_value = {"routes": []}
+        points = [{"latitude": 41.8781, "longitude": -87.6298}, {"latitude": 39.7392, "longitude": -104.9903}]
+        with mock.patch.object(hos, "get_session", return_value=session), \
+                mock.patch.object(hos.osrm_breaker, "allow", return_value=True), \
+                mock.patch.object(hos.osrm_breaker, "record_success"):
+            hos._request_route(points)
+        self.assertEqual(
+            session.get.call_args.kwargs["timeout"], (http.HTTP_CONNECT_TIMEOUT_SECONDS, hos.OSRM_READ_TIMEOUT_SECONDS))
+
+
+class TripQueueTests(TripApiTestCase):
+    def queued_trip(self, **fields):
+        return Trip.objects.create(
+            created_by=self.user,
+            current_location="Chicago, IL",
+            pickup_location="Denver, CO",
+            dropoff_location="Dallas, TX",
+            current_cycle_used=20,
+            **{"status": Trip.Status.PENDING, **fields},
+        )
+
+    def test_async_create_returns_202_with_a_status_location(self):
+        response = self.client.post("/api/trips/?async=1", self.TRIP, format="json")
+        self.assertEqual(response.status_code, 202)
+        trip_id = response.json()["id"]
+        self.assertTrue(response["Location"].endswith(f"/api/trips/{trip_id}/status/"))
+        self.assertEqual(Trip.objects.get(pk=trip_id).status, Trip.Status.PENDING)
+        status_response = self.client.get(response["Location"])
+        self.assertEqual(status_response.json()["status"], Trip.Status.PENDING)
+        self.assertIn("Retry-After", status_response)
+
+    def test_a_trip_is_claimed_once(self):
+        trip = self.queued_trip()
+        claimed = planning.claim_next_trip()
+        self.assertEqual(claimed.pk, trip.pk)
+        self.assertEqual(claimed.status, Trip.Status.PROCESSING)
+        self.assertIsNotNone(claimed.planning_started_at)
+        self.assertIsNone(planning.claim_next_trip())
+
+    def test_claims_oldest_first(self):
+        first = self.queued_trip()
+        second = self.queued_trip()
+        self.assertEqual([planning.claim_next_trip().pk, planning.claim_next_trip().pk], [first.pk, second.pk])
+
+    def test_stale_processing_trips_are_requeued(self):
+        cutoff = timezone.now() - timedelta(seconds=planning.PLANNING_STALE_AFTER_SECONDS)
+        stale = self.queued_trip(status=Trip.Status.PROCESSING, planning_started_at=cutoff - timedelta(seconds=1))
+        fresh = self.queued_trip(status=Trip.Status.PROCESSING, planning_started_at=cutoff + timedelta(seconds=30))
+        self.assertEqual(planning.requeue_stale_trips(), 1)
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((stale.status, stale.planning_started_at), (Trip.Status.PENDING, None))
+        self.assertEqual(fresh.status, Trip.Status.PROCESSING)
+
+    def test_planning_error_marks_the_trip_failed(self):
+        self.queued_trip()
+        with mock.patch.object(planning, "build_trip_plan", side_effect=ValueError("No route between these places.")):
+            self.assertTrue(planning.process_next_trip())
+        trip = Trip.objects.get()
+        self.assertEqual((trip.status, trip.status_detail), (Trip.Status.FAILED, "No route between these places."))
+
+    def test_processed_trip_is_completed(self):
+        trip = self.queued_trip()
+        self.assertTrue(planning.process_next_trip())
+        self.assertFalse(planning.process_next_trip())
+        trip.refresh_from_db()
+        self.assertEqual(trip.status, Trip.Status.COMPLETED)
+        self.assertTrue(trip.route_summary["distance_miles"])
+        self.assertTrue(TripGeometry.objects.filter(trip=trip).exists())
+
+    def test_editing_a_processing_trip_requeues_it_and_drops_the_stale_plan(self):
+        trip = self.queued_trip()
+        claimed = planning.claim_next_trip()
+        responses = []
+
+        def plan_while_edited(planned):
+            responses.append(
+                self.client.patch(f"/api/trips/{trip.pk}/", {"dropoff_location": "Chicago, IL"}, format="json"))
+            return hos.build_trip_plan(planned)
+
+        with mock.patch.object(planning, "build_trip_plan", side_effect=plan_while_edited):
+            planning.process_trip(claimed)
+        self.assertEqual(responses[0].status_code, 200, responses[0].content)
+        self.assertEqual(responses[0].json()["status"], Trip.Status.PENDING)
+        trip.refresh_from_db()
+        self.assertEqual((trip.status, trip.planning_started_at, trip.route_summary), (Trip.Status.PENDING, None, {}))
+        self.assertFalse(TripGeometry.objects.filter(trip=trip).exists())
+
+        self.assertTrue(planning.process_next_trip())
+        trip.refresh_from_db()
+        self.assertEqual(trip.status, Trip.Status.COMPLETED)
+        self.assertEqual(trip.route_summary["stops"][2]["details"], "Chicago, IL, United States")
+
+    def patch_after_worker_finishes(self, trip, data):
+        get_object = views.TripViewSet.get_object
+
+        def load_then_finish(viewset):
+            loaded = get_object(viewset)
+            # the worker completes the trip after the view has read it as pending
+            self.assertTrue(planning.process_next_trip())
+            return loaded
+
+        with mock.patch.object(views.TripViewSet, "get_object", load_then_finish):
+            response = self.client.patch(f"/api/trips/{trip.pk}/", data, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        trip.refresh_from_db()
+        return response
+
+    def test_edit_does_not_write_back_stale_plan_columns(self):
+        trip = self.queued_trip()
+        response = self.patch_after_worker_finishes(trip, {"current_location": "Chicago, IL"})
+        self.assertEqual(response.json()["status"], Trip.Status.COMPLETED)
+        self.assertEqual(trip.status, Trip.Status.COMPLETED)
+        self.assertTrue(trip.route_summary["distance_miles"])
+
+    def test_changed_inputs_requeue_a_trip_completed_meanwhile(self):
+        trip = self.queued_trip()
+        self.patch_after_worker_finishes(trip, {"dropoff_location": "Chicago, IL"})
+        self.assertEqual((trip.status, trip.dropoff_location), (Trip.Status.PENDING, "Chicago, IL"))
+
+    def test_failures_for_edited_inputs_are_dropped(self):
+        trip = self.queued_trip()
+        claimed = planning.claim_next_trip()
+        Trip.objects.filter(pk=trip.pk).update(dropoff_location="Chicago, IL")
+        with mock.patch.object(planning, "build_trip_plan", side_effect=ValueError("No route.")):
+            planning.process_trip(claimed)
+        trip.refresh_from_db()
+        self.assertEqual((trip.status, trip.status_detail), (Trip.Status.PROCESSING, ""))
+
+
+class RoutePayloadTests(SimpleTestCase):
+    def test_keeps_the_stored_meters_per_mile_factor(self):
+        payload = {"routes": [{
+            "distance": 4023350.0,
+            "duration": 7200,
+            "geometry": {"coordinates": [[-87.6298, 41.8781], [-88.0, 41.5]]},
+            "legs": [{"distance": 4023350.0, "duration": 7200}],
+        }]}
+        route = hos.route_from_payload(payload, [], time.perf_counter())
+        self.assertEqual((route["distance_miles"], route["legs"][0]["distance_miles"]), (2500.0, 2500.0))
+        self.assertEqual(route["polyline"], [[41.8781, -87.6298], [41.5, -88.0]])
+
+
+def wiggly_route(count=2000):
+    t = np.linspace(0.0, 1.0, count)
+    return np.column_stack((41.8 - 2 * t + np.sin(t * 60) * 0.05, -87.6 - 17 * t)).round(5).tolist()
+
+
+class PolylineTests(SimpleTestCase):
+    REFERENCE_POINTS = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+    REFERENCE_ENCODED = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+    def test_google_reference_vector(self):
+        self.assertEqual(polyline.encode_polyline(self.REFERENCE_POINTS), self.REFERENCE_ENCODED)
+        self.assertEqual(polyline.decode_polyline(self.REFERENCE_ENCODED), self.REFERENCE_POINTS)
+
+    def test_round_trip(self):
+        points = wiggly_route()
+        self.assertTrue(np.allclose(polyline.decode_polyline(polyline.encode_polyline(points)), points, atol=1e-9))
+        self.assertEqual(polyline.encode_polyline([]), "")
+        self.assertEqual(polyline.decode_polyline(""), [])
+
+    def test_simplification_stays_within_tolerance(self):
+        points = np.asarray(wiggly_route())
+        for tolerance in (10.0, 50.0, 250.0):
+            with self.subTest(tolerance=tolerance):
+                simplified = np.asarray(polyline.simplify_polyline(points, tolerance))
+                self.assertLess(len(simplified), len(points))
+                self.assertEqual(simplified[0].tolist(), points[0].tolist())
+                self.assertEqual(simplified[-1].tolist(), points[-1].tolist())
+                # same local projection as the simplifier
+                scale = math.cos(math.radians(float(points[:, 0].mean())))
+                project = lambda array: np.column_stack((array[:, 1] * scale, array[:, 0])) * polyline._METERS_PER_DEGREE
+                xy, kept = project(points), project(simplified)
+                starts, segments = kept[:-1], np.diff(kept, axis=0)
+                offsets = xy[:, None, :] - starts[None, :, :]
+                t = np.clip((offsets * segments).sum(axis=2) / (segments * segments).sum(axis=1), 0.0, 1.0)
+                gaps = np.hypot(*(offsets - t[:, :, None] * segments).transpose(2, 0, 1)).min(axis=1)
+                self.assertLessEqual(gaps.max(), tolerance + 1e-6)
+
+    def test_render_falls_back_to_full_for_unknown_levels(self):
+        geometry = polyline.build_geometry(self.REFERENCE_POINTS)
+        del geometry["levels"]["low"]
+        rendered = polyline.render_geometry(geometry, "low")
+        self.assertEqual(rendered, {"polyline": self.REFERENCE_POINTS, "polyline_level": "full"})
+        self.assertEqual(polyline.render_geometry(None, "low"), {"polyline": [], "polyline_level": "low"})
+
+
+class GeometryActionTests(TripApiTestCase):
+    def setUp(self):
+        super().setUp()
+        route = wiggly_route()
+        points_route = lambda points: {**hos.fallback_route(points), "polyline": route, "fallback": False}
+        patcher = mock.patch.object(hos, "_request_route", points_route)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.route = route
+        self.url = f"/api/trips/{self.create_trip()['id']}/geometry/"
+
+    def test_selects_the_requested_level(self):
+        sizes = {}
+        for level in ("full", "high", "medium", "low"):
+            with self.subTest(level=level):
+                body = self.client.get(self.url, {"polyline_level": level}).json()
+                self.assertEqual(body["polyline_level"], level)
+                sizes[level] = len(body["polyline"])
+        self.assertEqual(sizes["full"], len(self.route))
+        self.assertGreater(sizes["full"], sizes["high"])
+        self.assertGreaterEqual(sizes["high"], sizes["medium"])
+        self.assertGreaterEqual(sizes["medium"], sizes["low"])
+
+    def test_defaults_to_the_configured_level(self):
+        self.assertEqual(self.client.get(self.url).json()["polyline_level"], polyline.POLYLINE_DEFAULT_LEVEL)
+
+    def test_encoded_format(self):
+        body = self.client.get(self.url, {"polyline_level": "full", "polyline_format": "encoded"}).json()
+        self.assertTrue(np.allclose(polyline.decode_polyline(body["polyline"]), self.route))
+        self.assertEqual(body["polyline_encoding"], {"format": "encoded-polyline", "precision": 5})
+
+    def test_unknown_level_is_rejected(self):
+        response = self.client.get(self.url, {"polyline_level": "street"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("polyline_level", response.json())
+
+
+class TripListTests(TripApiTestCase):
+    def setUp(self):
+        super().setUp()
+        other = get_user_model().objects.create_user("dispatcher", password="secret")
+        start = timezone.now()
+        trips = []
+        for index, owner in enumerate([self.user] * 7 + [other]):
+            trip = Trip.objects.create(
+                created_by=owner,
+                **self.TRIP,
+                route_summary={"total_distance_miles": index},
+                hos_logs=[{"date": "2024-01-01"}],
+                map_data={"polyline": [[41.88, -87.63]] * 10},
+            )
+            # distinct cursor positions, newest first
+            Trip.objects.filter(pk=trip.pk).update(created_at=start + timedelta(minutes=index))
+            trips.append(trip)
+        self.expected = [trip.pk for trip in reversed(trips[:7])]
+
+    def test_pages_with_next_and_previous_cursors(self):
+        seen, url = [], "/api/trips/?page_size=3"
+        pages = []
+        while url:
+            body = self.client.get(url).json()
+            pages.append(body)
+            seen.extend(row["id"] for row in body["results"])
+            url = body["next"]
+        self.assertEqual(seen, self.expected)
+        self.assertEqual([len(page["results"]) for page in pages], [3, 3, 1])
+        self.assertIsNone(pages[0]["previous"])
+        self.assertIn("cursor=", pages[1]["previous"])
+
+        back = self.client.get(pages[2]["previous"]).json()
+        self.assertEqual([row["id"] for row in back["results"]], self.expected[3:6])
+
+    def test_defers_heavy_columns_without_n_plus_one(self):
+        for page_size in (1, 7):
+            with self.subTest(page_size=page_size), CaptureQueriesContext(connection) as queries:
+                # the ETag aggregate and one page query, however many trips are listed
+                with self.assertNumQueries(2):
+                    body = self.client.get("/api/trips/", {"page_size": page_size}).json()
+                self.assertEqual(len(body["results"]), page_size)
+                self.assertEqual(body["results"][0]["created_by"], "driver")
+                page_query = queries.captured_queries[-1]["sql"]
+                for field in views.TripViewSet.HEAVY_FIELDS:
+                    self.assertNotIn(f'"{field}"', page_query)
+                    self.assertNotIn(field, body["results"][0])
+
+
+class GazetteerTests(SimpleTestCase):
+    RECORDS = [
+        {"name": "Springfield", "state": "IL", "latitude": "39.80", "longitude": "-89.64", "population": "114394"},
+        {"name": "Springfield", "state": "MO", "latitude": "37.21", "longitude": "-93.29", "population": "169176"},
+        {"name": "Springfield", "state": "MA", "latitude": "42.10", "longitude": "-72.59", "population": "155929"},
+        {"name": "Spring", "state": "TX", "latitude": "30.08", "longitude": "-95.42", "population": "62559"},
+        {"name": "St. Louis", "state": "MO", "latitude": "38.63", "longitude": "-90.20", "population": "301578"},
+        {"name": "Springdale", "state": "AR", "latitude": "36.19", "longitude": "-94.13", "population": "84161"},
+        {"name": "Springdale", "state": "OH", "latitude": "39.29", "longitude": "-84.48", "population": "11007"},
+    ]
+
+    def setUp(self):
+        self.gazetteer = gazetteer.Gazetteer(self.RECORDS)
+
+    def test_lookup_normalizes_queries(self):
+        for query in ("St. Louis, MO", "st louis mo", "ST LOUIS, Missouri", "St Louis, MO, USA", "st. louis"):
+            with self.subTest(query=query):
+                place = self.gazetteer.lookup(query)
+                self.assertEqual(place["label"], "St. Louis, MO")
+                self.assertEqual(place["display_name"], "St. Louis, MO, United States")
+                self.assertEqual((place["latitude"], place["longitude"]), (38.63, -90.20))
+        self.assertIsNone(self.gazetteer.lookup("Atlantis"))
+        self.assertIsNone(self.gazetteer.lookup("  ,  "))
+
+    def test_lookup_prefers_the_largest_place_for_a_bare_name(self):
+        self.assertEqual(self.gazetteer.lookup("Springfield")["label"], "Springfield, MO")
+        self.assertEqual(self.gazetteer.lookup("Springfield, IL")["label"], "Springfield, IL")
+        self.assertEqual(self.gazetteer.lookup("springfield massachusetts")["label"], "Springfield, MA")
+
+    def test_prefix_search_ranks_by_population(self):
+        labels = [place["label"] for place in self.gazetteer.search("spring")]
+        self.assertEqual(labels, [
+            "Springfield, MO", "Springfield, MA", "Springfield, IL", "Springdale, AR", "Spring, TX", "Springdale, OH",
+        ])
+        self.assertEqual([place["label"] for place in self.gazetteer.search("Springfield, M")],
+                         ["Springfield, MO", "Springfield, MA"])
+        self.assertEqual([place["label"] for place in self.gazetteer.search("spring", limit=2)],
+                         ["Springfield, MO", "Springfield, MA"])
+        self.assertEqual(self.gazetteer.search("zz"), [])
+        self.assertEqual(self.gazetteer.search(""), [])
+
+    def test_load_records_reads_csv_and_json(self):
+        fields = ["name", "state", "latitude", "longitude", "population"]
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = Path(directory) / "places.csv"
+            json_path = Path(directory) / "places.json"
+            with csv_path.open("w", newline="", encoding="utf-8") as handle:
+                writer = csv.DictWriter(handle, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(self.RECORDS)
+            json_path.write_text(json.dumps(self.RECORDS), encoding="utf-8")
+            for path in (csv_path, json_path):
+                with self.subTest(path=path.name):
+                    loaded = gazetteer.Gazetteer(gazetteer.load_records(path))
+                    self.assertEqual(len(loaded), len(self.RECORDS))
+                    self.assertEqual(loaded.lookup("Springfield")["label"], "Springfield, MO")
+
+
+class LocationAutocompleteTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user("driver", password="secret"))
+        records = GazetteerTests.RECORDS + [
+            {"name": f"Springtown {index}", "state": "TX", "latitude": "32.9", "longitude": "-97.6", "population": index}
+            for index in range(views.AUTOCOMPLETE_MAX_LIMIT + 10)
+        ]
+        patcher = mock.patch.object(views, "get_gazetteer", return_value=gazetteer.Gazetteer(records))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def labels(self, **params):
+        response = self.client.get("/api/locations/autocomplete/", {"q": "spring", **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [place["label"] for place in response.json()["results"]]
+
+    def test_returns_ranked_matches(self):
+        labels = self.labels(limit=3)
+        self.assertEqual(labels, ["Springfield, MO", "Springfield, MA", "Springfield, IL"])
+        self.assertEqual(len(self.labels()), views.AUTOCOMPLETE_DEFAULT_LIMIT)
+
+    def test_clamps_the_limit(self):
+        self.assertEqual(len(self.labels(limit=0)), 1)
+        self.assertEqual(len(self.labels(limit=-5)), 1)
+        self.assertEqual(len(self.labels(limit=1000)), views.AUTOCOMPLETE_MAX_LIMIT)
+
+    def test_rejects_a_non_integer_limit(self):
+        response = self.client.get("/api/locations/autocomplete/", {"q": "spring", "limit": "ten"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"limit": "Must be an integer."})
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get("/api/locations/autocomplete/", {"q": "spring"}).status_code, 401)
+
+
+class PlaceIndexTests(SimpleTestCase):
+    def random_places(self, count=600, seed=7):
+        rng = np.random.default_rng(seed)
+        latitudes = rng.uniform(25.0, 49.0, count).round(4)
+        longitudes = rng.uniform(-124.0, -67.0, count).round(4)
+        places = [
+            {"name": f"place {i}", "kind": "terminal" if i % 3 == 0 else spatial.CITY,
+             "display_name": f"Place {i}", "latitude": float(lat), "longitude": float(lon)}
+            for i, (lat, lon) in enumerate(zip(latitudes, longitudes))
+        ]
+        # exact duplicates and two places equidistant from (40, -100)
+        places.append({**places[10], "name": "place 10 twin"})
+        for name, latitude in (("north", 40.5), ("south", 39.5)):
+            places.append({"name": name, "kind": spatial.CITY, "display_name": name.title(),
+                           "latitude": latitude, "longitude": -100.0})
+        return places
+
+    def brute_force(self, places, latitude, longitude, kind=None):
+        members = [place for place in places if kind is None or place["kind"] == kind]
+        distances = geodesy.haversine_miles(
+            latitude, longitude, np.array([p["latitude"] for p in members]), np.array([p["longitude"] for p in members]))
+        return members, np.asarray(distances)
+
+    def test_nearest_matches_a_brute_force_scan(self):
+        places = self.random_places()
+        index = spatial.PlaceIndex(places)
+        rng = np.random.default_rng(11)
+        queries = [(40.0, -100.0), (places[10]["latitude"], places[10]["longitude"])]
+        queries += list(zip(rng.uniform(20.0, 52.0, 200), rng.uniform(-130.0, -60.0, 200)))
+        for kind in (None, spatial.CITY, "terminal"):
+            for latitude, longitude in queries:
+                members, distances = self.brute_force(places, latitude, longitude, kind)
+                hit = index.nearest(latitude, longitude, kind=kind)
+                self.assertAlmostEqual(hit["distance_miles"], distances.min(), places=6)
+                if kind:
+                    self.assertEqual(hit["kind"], kind)
+                # on ties any of the closest places is acceptable
+                closest = {members[i]["name"] for i in np.nonzero(distances <= distances.min() + 1e-9)[0]}
+                self.assertIn(hit["name"], closest)
+
+    def test_nearest_respects_max_miles(self):
+        places = self.random_places()
+        index = spatial.PlaceIndex(places)
+        _, distances = self.brute_force(places, 40.0, -100.0)
+        nearest = distances.min()
+        self.assertIsNone(index.nearest(40.0, -100.0, max_miles=nearest * 0.99))
+        self.assertIsNotNone(index.nearest(40.0, -100.0, max_miles=nearest * 1.01))
+
+    def test_within_matches_a_brute_force_scan(self):
+        places = self.random_places()
+        index = spatial.PlaceIndex(places)
+        for kind in (None, "terminal"):
+            for radius in (0.0, 25.0, 150.0, 600.0):
+                with self.subTest(kind=kind, radius=radius):
+                    members, distances = self.brute_force(places, 40.0, -100.0, kind)
+                    expected = {members[i]["name"] for i in np.nonzero(distances <= radius)[0]}
+                    hits = index.within(40.0, -100.0, radius, kind=kind)
+                    self.assertEqual({hit["name"] for hit in hits}, expected)
+                    found = [hit["distance_miles"] for hit in hits]
+                    self.assertEqual(found, sorted(found))
+        ties = {hit["name"] for hit in index.within(40.0, -100.0, 35.0)}
+        self.assertTrue({"north", "south"} <= ties)
+        twins = index.within(places[10]["latitude"], places[10]["longitude"], 0.0)
+        self.assertEqual({hit["name"] for hit in twins}, {"place 10", "place 10 twin"})
+
+    def test_empty_index_and_unknown_kind(self):
+        empty = spatial.PlaceIndex([])
+        self.assertEqual(len(empty), 0)
+        self.assertIsNone(empty.nearest(40.0, -100.0))
+        self.assertEqual(empty.within(40.0, -100.0, 1000.0), [])
+        index = spatial.PlaceIndex(self.random_places(count=20))
+        self.assertIsNone(index.nearest(40.0, -100.0, kind="fuel"))
+        self.assertEqual(index.within(40.0, -100.0, 5000.0, kind="fuel"), [])
+        self.assertIsNone(spatial.KDTree(np.empty((0, 3))).nearest(np.array([1.0, 0.0, 0.0])))
+
+
+class PinnedDisplayNameTests(SimpleTestCase):
+    def setUp(self):
+        index = spatial.PlaceIndex([
+            {"name": "Amarillo", "kind": spatial.CITY, "display_name": "Amarillo, TX, United States",
+             "latitude": 35.2220, "longitude": -101.8313},
+        ])
+        patcher = mock.patch.object(hos, "get_place_index", return_value=index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_snaps_to_a_place_under_a_mile_away(self):
+        self.assertEqual(hos._pinned_display_name(35.2250, -101.8313), "Amarillo, TX, United States")
+
+    def test_reports_the_distance_to_a_nearby_place(self):
+        # 0.2 degrees of latitude is roughly 14 miles
+        self.assertEqual(
+            hos._pinned_display_name(35.4220, -101.8313),
+            "14 mi from Amarillo, TX, United States (35.4220, -101.8313)",
+        )
+
+    def test_falls_back_to_coordinates_past_the_snap_radius(self):
+        self.assertEqual(hos._pinned_display_name(37.0, -101.8313), "Pinned location (37.0000, -101.8313)")
+
+    def test_pinned_queries_use_the_label(self):
+        location = hos.resolve_locally("Pinned location (35.2250, -101.8313)")
+        self.assertEqual(location["display_name"], "Amarillo, TX, United States")
+        self.assertEqual((location["latitude"], location["longitude"]), (35.225, -101.8313))
+
+
+def leg_position(polyline, point, tolerance=1e-5):
+    """Index and fraction of the polyline leg the point lies on, or None."""
+    coordinates = np.asarray(polyline, dtype=float)
+    point = np.asarray(point, dtype=float)
+    for leg, (start, end) in enumerate(zip(coordinates[:-1], coordinates[1:])):
+        delta = end - start
+        length = float(delta @ delta)
+        fraction = 0.0 if length == 0 else float(np.clip((point - start) @ delta / length, 0.0, 1.0))
+        if np.abs(start + delta * fraction - point).max() <= tolerance:
+            return leg, fraction
+    return None
+
+
+class PathInterpolatorTests(SimpleTestCase):
+    POLYLINE = [[41.0, -88.0], [41.0, -87.9], [41.0, -87.9], [41.1, -87.9], [41.2, -87.8]]
+
+    def setUp(self):
+        self.path = geodesy.PathInterpolator(self.POLYLINE)
+        self.cumulative = self.path.distances.cumulative
+
+    def test_vertices_and_ends(self):
+        located = self.path.locate(self.cumulative)
+        self.assertTrue(np.allclose(located[[0, 1, 3, 4]], np.asarray(self.POLYLINE)[[0, 1, 3, 4]]))
+        self.assertAlmostEqual(self.cumulative[-1], self.path.total)
+
+    def test_points_fall_on_their_leg_at_the_requested_distance(self):
+        for miles in np.linspace(0.0, self.path.total, 37):
+            with self.subTest(miles=miles):
+                latitude, longitude = self.path.locate(miles)[0]
+                leg, _ = leg_position(self.POLYLINE, (latitude, longitude))
+                start = self.POLYLINE[leg]
+                along = self.cumulative[leg] + vincenty_miles(start[0], start[1], latitude, longitude)
+                self.assertAlmostEqual(along, miles, delta=0.01)
+
+    def test_clamps_outside_the_path(self):
+        located = self.path.locate([-5.0, self.path.total + 0.001, self.path.total * 3])
+        self.assertEqual(located[0].tolist(), self.POLYLINE[0])
+        self.assertEqual(located[1].tolist(), self.POLYLINE[-1])
+        self.assertEqual(located[2].tolist(), self.POLYLINE[-1])
+
+    def test_degenerate_paths(self):
+        single = geodesy.PathInterpolator([[41.0, -88.0]])
+        self.assertEqual(single.locate([0.0, 10.0]).tolist(), [[41.0, -88.0], [41.0, -88.0]])
+        with self.assertRaises(ValueError):
+            geodesy.PathInterpolator([]).locate(1.0)
+
+
+class LocateWaypointsTests(SimpleTestCase):
+    def setUp(self):
+        self.polyline = wiggly_route(400)
+        self.total = geodesy.PathInterpolator(self.polyline).total
+        # the schedule counts road miles, which run longer than the polyline
+        self.route = {"polyline": self.polyline, "distance_miles": round(self.total * 1.25, 2), "fallback": False}
+
+    def waypoint(self, stop_type, miles):
+        return {"type": stop_type, "details": f"{stop_type} at {miles}", "timestamp": "2024-01-01T10:00:00",
+                "miles_from_start": miles}
+
+    def test_markers_fall_on_the_route_at_their_mileage(self):
+        road_miles = self.route["distance_miles"]
+        waypoints = [
+            self.waypoint(stop_type, round(road_miles * share, 2))
+            for stop_type, share in (("Break", 0.1), ("Fuel Stop", 0.35), ("Rest", 0.5), ("Break", 0.77), ("Rest", 1.0))
+        ]
+        markers = hos._locate_waypoints(self.route, waypoints)
+        self.assertEqual(len(markers), len(waypoints))
+        cumulative = geodesy.PathInterpolator(self.polyline).distances.cumulative
+        for waypoint, marker in zip(waypoints, markers):
+            with self.subTest(waypoint=waypoint["details"]):
+                self.assertEqual(marker["type"], waypoint["type"])
+                self.assertEqual(marker["label"], waypoint["details"])
+                self.assertEqual(marker["timestamp"], waypoint["timestamp"])
+                self.assertEqual(marker["miles_from_start"], waypoint["miles_from_start"])
+                self.assertFalse(marker["approximate"])
+                point = (marker["latitude"], marker["longitude"])
+                leg, _ = leg_position(self.polyline, point)
+                start = self.polyline[leg]
+                along = cumulative[leg] + vincenty_miles(start[0], start[1], *point)
+                expected = waypoint["miles_from_start"] / road_miles * self.total
+                self.assertAlmostEqual(along, expected, delta=0.05)
+
+    def test_clamps_markers_past_the_end_of_the_route(self):
+        markers = hos._locate_waypoints(
+            {**self.route, "fallback": True}, [self.waypoint("Rest", self.route["distance_miles"] + 250)])
+        self.assertEqual([markers[0]["latitude"], markers[0]["longitude"]], self.polyline[-1])
+        self.assertTrue(markers[0]["approximate"])
+
+    def test_no_markers_without_waypoints_or_polyline(self):
+        self.assertEqual(hos._locate_waypoints(self.route, []), [])
+        self.assertEqual(hos._locate_waypoints({**self.route, "polyline": []}, [self.waypoint("Break", 10)]), [])
+
+
+class TripMarkerTests(TripApiTestCase):
+    def test_stop_markers_lie_on_the_stored_route(self):
+        route = wiggly_route()
+        points_route = lambda points: {**hos.fallback_route(points), "polyline": route, "fallback": False}
+        with mock.patch.object(hos, "_request_route", points_route):
+            trip = Trip.objects.get(pk=self.create_trip()["id"])
+        polyline = render_geometry(load_trip_geometry(trip), "full")["polyline"]
+        markers = [marker for marker in trip.map_data["markers"] if "type" in marker]
+        self.assertEqual({marker["type"] for marker in markers}, {"Break", "Fuel Stop", "Rest"})
+        for marker in markers:
+            self.assertIsNotNone(leg_position(polyline, (marker["latitude"], marker["longitude"])), marker)
+
+
+class CompareBenchmarksTests(SimpleTestCase):
+    def results(self, **timings):
+        return {"version": benchmarks.RESULTS_VERSION,
+                "results": {name: {"min": seconds, "median": seconds} for name, seconds in timings.items()}}
+
+    def test_classifies_every_benchmark(self):
+        baseline = self.results(slower=1.0, faster=1.0, steady=1.0, dropped=0.5, zero=0.0)
+        current = self.results(slower=1.5, faster=0.5, steady=1.05, added=0.25, zero=0.001)
+        rows = {row["name"]: row for row in benchmarks.compare_results(baseline, current, threshold=0.25)}
+        self.assertEqual({name: row["status"] for name, row in rows.items()}, {
+            "slower": "regression", "faster": "improvement", "steady": "unchanged",
+            "added": "new", "dropped": "missing", "zero": "regression",
+        })
+        self.assertEqual(rows["slower"], {
+            "name": "slower", "baseline": 1.0, "current": 1.5, "ratio": 1.5, "status": "regression"})
+        self.assertEqual(rows["added"], {
+            "name": "added", "baseline": None, "current": 0.25, "ratio": None, "status": "new"})
+        self.assertEqual(rows["dropped"], {
+            "name": "dropped", "baseline": 0.5, "current": None, "ratio": None, "status": "missing"})
+        self.assertEqual(rows["zero"]["ratio"], float("inf"))
+
+    def test_threshold_boundary_is_unchanged(self):
+        # ratios exactly at 1 +/- threshold stay unchanged; just past them flips the status
+        baseline = self.results(up=1.0, down=1.0, past_up=1.0, past_down=1.0)
+        current = self.results(up=1.25, down=0.75, past_up=1.2500001, past_down=0.7499999)
+        statuses = {row["name"]: row["status"] for row in benchmarks.compare_results(baseline, current, threshold=0.25)}
+        self.assertEqual(statuses, {
+            "up": "unchanged", "down": "unchanged", "past_up": "regression", "past_down": "improvement"})
+
+    def test_rejects_unknown_result_versions(self):
+        with self.assertRaises(ValueError):
+            benchmarks.compare_results({"version": 0, "results": {}}, self.results())
+
+    def test_command_fails_only_on_regressions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = {}
+            for name, data in (
+                ("baseline", self.results(plan=1.0, geocode=1.0)),
+                ("steady", self.results(plan=1.05, geocode=0.5)),
+                ("slower", self.results(plan=2.0, geocode=1.0)),
+            ):
+                paths[name] = Path(directory) / f"{name}.json"
+                paths[name].write_text(json.dumps(data), encoding="utf-8")
+            output = io.StringIO()
+            call_command("compare_benchmarks", str(paths["baseline"]), str(paths["steady"]), stdout=output)
+            self.assertIn("improvement", output.getvalue())
+            with self.assertRaisesMessage(CommandError, "1 benchmark(s) regressed by more than 10%: plan"):
+                call_command("compare_benchmarks", str(paths["baseline"]), str(paths["slower"]), stdout=io.StringIO())
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for name, value in (("METRICS_ENABLED", True), ("METRICS_ALLOWED_IPS", frozenset({"10.0.0.5"}))):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def scrape(self, address="10.0.0.5"):
+        return self.client.get("/api/metrics", REMOTE_ADDR=address)
+
+    def test_serves_prometheus_text_to_allowed_addresses(self):
+        with mock.patch.object(metrics, "METRICS_ENABLED", True):
+            with metrics.stage("metrics-test"):
+                pass
+            metrics.increment(metrics.ROUTE_FALLBACKS, "metrics-test")
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        body = response.content.decode()
+        self.assertIn("# TYPE routelog_stage_seconds histogram\n", body)
+        self.assertIn('routelog_stage_seconds_bucket{stage="metrics-test",le="+Inf"} 1\n', body)
+        self.assertIn('routelog_stage_seconds_count{stage="metrics-test"} 1\n', body)
+        self.assertIn('routelog_route_fallbacks_total{reason="metrics-test"} 1\n', body)
+
+    def test_refuses_other_addresses_unless_staff(self):
+        self.assertEqual(self.scrape("203.0.113.9").status_code, 403)
+        user = get_user_model().objects.create_user("driver", password="secret")
+        self.client.force_login(user)
+        self.assertEqual(self.scrape("203.0.113.9").status_code, 403)
+        user.is_staff = True
+        user.save(update_fields=["is_staff"])
+        self.assertEqual(self.scrape("203.0.113.9").status_code, 200)
+
+    def test_disabled_by_default(self):
+        with mock.patch.object(views, "METRICS_ENABLED", False):
+            self.assertEqual(self.scrape().status_code, 404)
+
+    def test_render_format(self):
+        histogram = metrics.Histogram("test_seconds", "Test latency.", labels=("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            histogram.observe(value, 'say "hi"\n')
+        counter = metrics.Counter("test_total", "Test counter.")
+        counter.inc(amount=2.5)
+        self.assertEqual(histogram.render(), [
+            "# HELP test_seconds Test latency.",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{stage="say \\"hi\\"\\n",le="0.1"} 1',
+            'test_seconds_bucket{stage="say \\"hi\\"\\n",le="1.0"} 3',
+            'test_seconds_bucket{stage="say \\"hi\\"\\n",le="+Inf"} 4',
+            'test_seconds_sum{stage="say \\"hi\\"\\n"} 4.05',
+            'test_seconds_count{stage="say \\"hi\\"\\n"} 4',
+        ])
+        self.assertEqual(counter.render(), [
+            "# HELP test_total Test counter.", "# TYPE test_total counter", "test_total 2.5"])
+
+
+class ServerTimingTests(TripApiTestCase):
+    def test_reports_request_stages(self):
+        url = f"/api/trips/{self.create_trip()['id']}/"
+        with mock.patch.object(middleware, "SERVER_TIMING_ENABLED", True):
+            header = self.client.get(url)["Server-Timing"]
+        entries = dict(entry.split(";dur=") for entry in header.split(", "))
+        self.assertEqual(list(entries), ["serialize", "total"])
+        self.assertTrue(all(float(duration) >= 0 for duration in entries.values()))
+        self.assertGreaterEqual(float(entries["total"]), float(entries["serialize"]))
+
+    def test_omitted_when_disabled(self):
+        url = f"/api/trips/{self.create_trip()['id']}/"
+        with mock.patch.object(middleware, "SERVER_TIMING_ENABLED", False):
+            self.assertNotIn("Server-Timing", self.client.get(url))
+
+    def test_header_sums_repeated_stages(self):
+        header = metrics.server_timing_header([("db", 0.001), ("hos", 0.0105), ("db", 0.002)])
+        self.assertEqual(header, "db;dur=3.0, hos;dur=10.5")
+
+
+class DistanceMatrixTests(TestCase):
+    CHICAGO, DENVER, DALLAS, OMAHA = (41.8781, -87.6298), (39.7392, -104.9903), (32.7767, -96.797), (41.2565, -95.9345)
+
+    def setUp(self):
+        matrix.clear_cache()
+        self.addCleanup(matrix.clear_cache)
+        self.requests = []
+        patcher = mock.patch.object(matrix, "get_session", return_value=mock.Mock(get=self.osrm_table))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def osrm_table(self, url, params, timeout):
+        coordinates = [tuple(float(part) for part in reversed(pair.split(","))) for pair in url.rsplit("/", 1)[1].split(";")]
+        sources = [coordinates[int(index)] for index in params["sources"].split(";")]
+        destinations = [coordinates[int(index)] for index in params["destinations"].split(";")]
+        self.requests.append((sources, destinations))
+        # 1000 m per degree of latitude apart, one minute per 1000 m
+        meters = [[abs(source[0] - destination[0]) * 1000 for destination in destinations] for source in sources]
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {
+            "code": "Ok", "distances": meters, "durations": [[value * 0.06 for value in row] for row in meters]}
+        return response
+
+    def locations(self, *points):
+        return [{"latitude": latitude, "longitude": longitude} for latitude, longitude in points]
+
+    def test_one_table_request_per_miss_then_cache_hits(self):
+        origins, destinations = self.locations(self.CHICAGO, self.DENVER), self.locations(self.DALLAS, self.OMAHA)
+        first = matrix.distance_matrix(origins, destinations)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.requests[0], ([self.CHICAGO, self.DENVER], [self.DALLAS, self.OMAHA]))
+        expected = round(abs(self.CHICAGO[0] - self.DALLAS[0]) * 1000 / geodesy.METERS_PER_MILE, 2)
+        self.assertEqual(first["distances_miles"][0][0], expected)
+        self.assertEqual(first["estimated"], [[False, False], [False, False]])
+
+        hits = matrix._cell_cache.hits
+        self.assertEqual(matrix.distance_matrix(origins, destinations), first)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(matrix._cell_cache.hits, hits + 4)
+
+        # only the new destination's cells go upstream
+        matrix.distance_matrix(origins, self.locations(self.DALLAS, self.OMAHA, (35.4676, -97.5164)))
+        self.assertEqual(self.requests[1], ([self.CHICAGO, self.DENVER], [(35.4676, -97.5164)]))
+
+    def test_estimates_every_cell_when_osrm_fails(self):
+        failing = mock.Mock(get=mock.Mock(side_effect=requests.ConnectionError("down")))
+        with mock.patch.object(matrix, "get_session", return_value=failing), self.assertLogs(matrix.logger, "WARNING"):
+            result = matrix.distance_matrix(self.locations(self.CHICAGO), self.locations(self.DENVER, self.DALLAS))
+        self.assertEqual(failing.get.call_count, 1)
+        self.assertEqual(result["estimated"], [[True, True]])
+        miles = float(vincenty_miles(*self.CHICAGO, *self.DENVER))
+        self.assertEqual(result["distances_miles"][0][0], round(miles, 2))
+        self.assertEqual(result["durations_hours"][0][0], round(miles / AVERAGE_SPEED_MPH, 2))
+
+    def test_estimates_only_the_cells_osrm_could_not_route(self):
+        def partial_table(url, params, timeout):
+            response = self.osrm_table(url, params, timeout)
+            response.json.return_value["distances"][0][1] = None
+            return response
+
+        with mock.patch.object(matrix, "get_session", return_value=mock.Mock(get=partial_table)):
+            result = matrix.distance_matrix(self.locations(self.CHICAGO), self.locations(self.DENVER, self.DALLAS))
+        self.assertEqual(result["estimated"], [[False, True]])
+
+    def test_endpoint_accepts_coordinate_pairs_without_geocoding(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user("dispatcher", password="secret"))
+        body = {
+            "origins": [{"lat": self.CHICAGO[0], "lon": self.CHICAGO[1]}, "Denver, CO"],
+            "destinations": [{"lat": lat, "lon": lon} for lat, lon in (self.DALLAS, self.OMAHA)],
+        }
+        with mock.patch.object(hos, "_geocode_pending", side_effect=AssertionError("geocoded")):
+            response = client.post("/api/matrix/", body, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual((data["origins"][0]["latitude"], data["origins"][0]["longitude"]), self.CHICAGO)
+        self.assertEqual(data["origins"][1]["display_name"], "Denver, CO, United States")
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(data["estimated"], [[False, False], [False, False]])
+
+    def test_endpoint_caps_place_names_and_validates_pairs(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user("dispatcher", password="secret"))
+        names = [f"Town {index}" for index in range(matrix.MATRIX_MAX_PLACE_NAMES)]
+        pairs = [{"lat": 40.0, "lon": -100.0 + index} for index in range(20)]
+        response = client.post("/api/matrix/", {"origins": names, "destinations": ["Denver, CO"]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("name at most", response.json()["non_field_errors"][0])
+        with mock.patch.object(matrix, "geocode_locations", side_effect=lambda queries: [
+                {"query": query, "latitude": 40.0, "longitude": -100.0, "display_name": query} for query in queries]):
+            response = client.post("/api/matrix/", {"origins": pairs, "destinations": names}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        for bad in ({"lat": 91, "lon": 0}, {"lat": 10}, {"lat": "north", "lon": 0}, 12):
+            with self.subTest(location=bad):
+                response = client.post("/api/matrix/", {"origins": [bad], "destinations": ["Denver, CO"]}, format="json")
+                self.assertEqual(response.status_code, 400)
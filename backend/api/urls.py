@@ -1,10 +1,23 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TripViewSet
+from .views import (
+    DistanceMatrixView,
+    FeasibilitySweepView,
+    LocationAutocompleteView,
+    TripViewSet,
+    metrics_view,
+    plan_trip_view,
+)
 
 router = DefaultRouter()
 router.register(r'trips', TripViewSet, basename='trip')
 
 urlpatterns = [
+    path('locations/autocomplete/', LocationAutocompleteView.as_view(), name='location-autocomplete'),
+    path('matrix/', DistanceMatrixView.as_view(), name='distance-matrix'),
+    path('hos/feasibility/', FeasibilitySweepView.as_view(), name='hos-feasibility'),
+    path('metrics', metrics_view, name='metrics'),
+    # before the router, whose trip detail route would otherwise claim trips/plan/
+    path('trips/plan/', plan_trip_view, name='trip-plan'),
     path('', include(router.urls)),
 ]
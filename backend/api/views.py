@@ -1,24 +1,165 @@
+import copy
+import json
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status, viewsets
-from rest_framework.exceptions import ValidationError
+from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
+from .conditional import (
+    CACHE_CONTROL,
+    CACHED_FORMATS,
+    IMMUTABLE_CACHE_CONTROL,
+    cached_body,
+    etag_matches,
+    list_etag,
+    not_modified,
+    request_origin,
+    store_body,
+    trip_etag,
+    trip_version,
+)
 from .models import Trip
-from .serializers import TripSerializer
-from .services.hos import build_trip_plan
+from .negotiation import StreamingContentNegotiation
+from .parsers import JSONLinesParser, NDJSONParser, TextParser
+from .pagination import TripCursorPagination
+from .renderers import CompactJSONRenderer
+from .serializers import (
+    DistanceMatrixRequestSerializer,
+    FeasibilitySweepRequestSerializer,
+    TripListSerializer,
+    TripSerializer,
+    TripStatusSerializer,
+)
+from .services.async_planning import build_trip_plan_async
+from .services.bulk import parse_rows, stream_bulk_plan
+from .services.export import EXPORT_FORMATS, stream_log_export
+from .services.feasibility import feasibility_sweep
+from .services.gazetteer import get_gazetteer
+from .services.hos import build_trip_plan, replan_trip
+from .services.matrix import matrix_for_queries
+from .services.metrics import METRICS_ALLOWED_IPS, METRICS_ENABLED, render_metrics, stage
+from .services.planning import PLANNING_FIELDS, requeue_trip, store_plan
+from .services.polyline import POLYLINE_DEFAULT_LEVEL, available_levels, render_geometry
+from .services.trip_geometry import load_trip_geometry
+
+AUTOCOMPLETE_DEFAULT_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+TRIP_STATUS_RETRY_AFTER_SECONDS = 1
+
+
+def _parse_bound(param: str, value: str) -> datetime:
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({param: "Use an ISO 8601 date or datetime."})
+        parsed = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _is_truthy(value) -> bool:
+    return str(value).lower() in {"1", "true", "yes", "on"}
 
 
 class TripViewSet(viewsets.ModelViewSet):
     serializer_class = TripSerializer
     permission_classes = [IsAuthenticated]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, CompactJSONRenderer]
+    pagination_class = TripCursorPagination
+
+    # the plan JSON can run to megabytes per trip; the list only needs the inputs
+    HEAVY_FIELDS = ("route_summary", "hos_logs", "map_data")
 
     def get_queryset(self):
-        return Trip.objects.filter(created_by=self.request.user).order_by("-created_at")
+        queryset = (
+            Trip.objects.filter(created_by=self.request.user)
+            .select_related("created_by")
+            .order_by("-created_at")
+        )
+        if self.action == "list":
+            queryset = queryset.defer(*self.HEAVY_FIELDS)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == "list":
+            return TripListSerializer
+        return TripSerializer
+
+    def list(self, request, *args, **kwargs):
+        # the aggregate covers every trip the user has, so any change anywhere busts every page
+        etag = list_etag(self.filter_queryset(self.get_queryset()), f"{request.user.pk}:{request.get_full_path()}")
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response = super().list(request, *args, **kwargs)
+        response["ETag"] = etag
+        response["Cache-Control"] = CACHE_CONTROL
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        # updated_at alone decides 304s and body cache hits; the trip is loaded only on a miss
+        updated_at = get_object_or_404(
+            self.get_queryset().values_list("updated_at", flat=True), pk=kwargs[self.lookup_field])
+        trip_id = int(kwargs[self.lookup_field])
+        response_format = request.accepted_renderer.format
+        etag = trip_etag(trip_id, updated_at, response_format)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        origin = request_origin(request)
+        cached = cached_body(trip_id, etag, origin)
+        if cached is not None:
+            response = HttpResponse(cached[1], content_type=cached[0])
+        else:
+            trip = self.get_object()
+            etag = trip_etag(trip.pk, trip.updated_at, response_format)
+            with stage("serialize"):
+                response = Response(self.get_serializer(trip).data)
+            if response_format in CACHED_FORMATS:
+                response.add_post_render_callback(
+                    lambda rendered: store_body(trip.pk, etag, origin, rendered["Content-Type"], rendered.content))
+        response["ETag"] = etag
+        response["Cache-Control"] = CACHE_CONTROL
+        return response
+
+    def _wants_async(self, request) -> bool:
+        if "async" in request.query_params:
+            return _is_truthy(request.query_params["async"])
+        return getattr(settings, "TRIP_PLANNING_ASYNC", False)
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        trip = serializer.save(created_by=request.user)
+
+        if self._wants_async(request):
+            trip = serializer.save(created_by=request.user, status=Trip.Status.PENDING)
+            response_serializer = self.get_serializer(trip)
+            headers = self.get_success_headers(response_serializer.data)
+            headers["Location"] = request.build_absolute_uri(
+                reverse("trip-planning-status", args=[trip.pk]))
+            return Response(response_serializer.data, status=status.HTTP_202_ACCEPTED, headers=headers)
+
+        with stage("db"):
+            trip = serializer.save(created_by=request.user)
 
         try:
             plan = build_trip_plan(trip)
@@ -26,13 +167,219 @@ class TripViewSet(viewsets.ModelViewSet):
             trip.delete()
             raise ValidationError(str(exc)) from exc
 
-        Trip.objects.filter(pk=trip.pk).update(
-            route_summary=plan["route_summary"],
-            hos_logs=plan["hos_logs"],
-            map_data=plan["map_data"],
+        with stage("db"):
+            store_plan(trip, plan)
+            trip.refresh_from_db()
+
+        with stage("serialize"):
+            response_serializer = self.get_serializer(trip)
+            data = response_serializer.data
+        headers = self.get_success_headers(data)
+        return Response(data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop("partial", False)
+        trip = self.get_object()
+        serializer = self.get_serializer(trip, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+
+        # plan against an unsaved copy carrying the new inputs: geocoding and routing
+        # stay outside the transaction, and a failed plan leaves the stored trip untouched
+        edited = copy.copy(trip)
+        for field in PLANNING_FIELDS:
+            if field in serializer.validated_data:
+                setattr(edited, field, serializer.validated_data[field])
+        inputs_changed = any(getattr(edited, field) != getattr(trip, field) for field in PLANNING_FIELDS)
+        plan = None
+        # pending and processing trips are requeued below and replanned by the queue worker
+        if inputs_changed and trip.status in (Trip.Status.COMPLETED, Trip.Status.FAILED):
+            try:
+                plan = replan_trip(edited)
+            except ValueError as exc:
+                raise ValidationError(str(exc)) from exc
+
+        with stage("db"), transaction.atomic():
+            trip = serializer.save()
+            if plan is not None:
+                store_plan(trip, plan)
+            elif inputs_changed:
+                # any queued or in-flight plan is for the old inputs; store_plan will drop it
+                requeue_trip(trip)
+            # status and plan columns may have moved on since get_object read them
+            trip.refresh_from_db()
+
+        with stage("serialize"):
+            data = self.get_serializer(trip).data
+        return Response(data)
+
+    @action(detail=True, methods=["get"], url_path="geometry")
+    def geometry(self, request, pk=None):
+        # ?polyline_level=full|high|medium|low, ?polyline_format=encoded; map_data.geometry_url
+        # adds ?v=<version>, under which the response never changes
+        level = request.query_params.get("polyline_level", POLYLINE_DEFAULT_LEVEL)
+        if level not in available_levels():
+            raise ValidationError({"polyline_level": f"Choose one of: {', '.join(available_levels())}."})
+        encoded = request.query_params.get("polyline_format") == "encoded"
+
+        trip = get_object_or_404(
+            self.get_queryset().select_related(None).only("id", "updated_at", "map_data"), pk=pk)
+        version = trip_version(trip.updated_at)
+        cache_control = IMMUTABLE_CACHE_CONTROL if request.query_params.get("v") == version else CACHE_CONTROL
+        variant = f"geometry-{level}-{'encoded' if encoded else 'coordinates'}-{request.accepted_renderer.format}"
+        etag = trip_etag(trip.pk, trip.updated_at, variant)
+        if etag_matches(request, etag):
+            return not_modified(etag, cache_control)
+
+        with stage("serialize"):
+            response = Response(render_geometry(load_trip_geometry(trip), level, encoded))
+        response["ETag"] = etag
+        response["Cache-Control"] = cache_control
+        return response
+
+    @action(detail=True, methods=["get"], url_path="status")
+    def planning_status(self, request, pk=None):
+        # answers at once rather than holding a worker; Retry-After paces clients while planning runs
+        trip = self.get_object()
+        response = Response(TripStatusSerializer(trip).data)
+        if trip.status in (Trip.Status.PENDING, Trip.Status.PROCESSING):
+            response["Retry-After"] = str(TRIP_STATUS_RETRY_AFTER_SECONDS)
+        return response
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="bulk",
+        parser_classes=[NDJSONParser, JSONLinesParser, TextParser, JSONParser],
+        content_negotiation_class=StreamingContentNegotiation,
+    )
+    def bulk(self, request):
+        # accepts JSON Lines (application/x-ndjson, application/jsonl) or text/csv
+        body = request.data
+        if isinstance(body, list):
+            body = "\n".join(json.dumps(row) for row in body)
+        elif not isinstance(body, str):
+            raise ValidationError("Send trips as JSON Lines or CSV.")
+
+        is_csv = request.content_type.split(";")[0].strip() == "text/csv"
+        return StreamingHttpResponse(
+            stream_bulk_plan(parse_rows(body, is_csv), request.user),
+            content_type="application/x-ndjson",
         )
-        trip.refresh_from_db()
 
-        response_serializer = self.get_serializer(trip)
-        headers = self.get_success_headers(response_serializer.data)
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path=r"export/(?P<export_format>csv|ndjson)",
+        content_negotiation_class=StreamingContentNegotiation,
+    )
+    def export(self, request, export_format=None):
+        # ?since= / ?until= bound created_at (ISO date or datetime, inclusive / exclusive)
+        queryset = Trip.objects.filter(created_by=request.user)
+        for param, lookup in (("since", "created_at__gte"), ("until", "created_at__lt")):
+            if param in request.query_params:
+                queryset = queryset.filter(**{lookup: _parse_bound(param, request.query_params[param])})
+
+        response = StreamingHttpResponse(
+            stream_log_export(queryset, export_format), content_type=EXPORT_FORMATS[export_format])
+        response["Content-Disposition"] = f'attachment; filename="eld-logs.{export_format}"'
+        return response
+
+
+class LocationAutocompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get("q", "")
+        try:
+            limit = int(request.query_params.get("limit", AUTOCOMPLETE_DEFAULT_LIMIT))
+        except ValueError as exc:
+            raise ValidationError({"limit": "Must be an integer."}) from exc
+        limit = max(1, min(limit, AUTOCOMPLETE_MAX_LIMIT))
+        response = Response({"results": get_gazetteer().search(query, limit)})
+        response["Cache-Control"] = "private, max-age=3600"
+        return response
+
+
+class DistanceMatrixView(APIView):
+    """Distances and durations from every origin to every destination."""
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = DistanceMatrixRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            matrix = matrix_for_queries(
+                serializer.validated_data["origins"], serializer.validated_data["destinations"])
+        except ValueError as exc:
+            raise ValidationError(str(exc)) from exc
+        return Response(matrix)
+
+
+class FeasibilitySweepView(APIView):
+    """Days needed and cycle-limit outcome for every cycles_used x distances_miles pair."""
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = FeasibilitySweepRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with stage("hos"):
+            sweep = feasibility_sweep(
+                serializer.validated_data["distances_miles"], serializer.validated_data["cycles_used"])
+        return Response(sweep)
+
+
+def metrics_view(request):
+    if not METRICS_ENABLED:
+        raise Http404("Metrics are disabled.")
+    # scrapers connect from an allowlisted address; staff can also read it from a browser session
+    if request.META.get("REMOTE_ADDR") not in METRICS_ALLOWED_IPS and not request.user.is_staff:
+        raise PermissionDenied("Metrics are restricted.")
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@csrf_exempt
+async def plan_trip_view(request):
+    """POST /api/trips/plan/: TripViewSet.create for ASGI servers.
+
+    DRF views are synchronous, so this one authenticates and validates with
+    the same classes by hand and plans with build_trip_plan_async, holding
+    no thread while Nominatim and OSRM answer.
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    try:
+        authenticated = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as exc:
+        detail = exc.detail if isinstance(exc.detail, dict) else {"detail": exc.detail}
+        return JsonResponse(detail, status=status.HTTP_401_UNAUTHORIZED)
+    if authenticated is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"detail": "JSON parse error."}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = TripSerializer(data=body)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    with stage("db"):
+        trip = await sync_to_async(serializer.save)(created_by=authenticated[0])
+
+    try:
+        plan = await build_trip_plan_async(trip)
+    except ValueError as exc:
+        await trip.adelete()
+        return JsonResponse([str(exc)], status=status.HTTP_400_BAD_REQUEST, safe=False)
+
+    with stage("db"):
+        await sync_to_async(store_plan)(trip, plan)
+        await trip.arefresh_from_db()
+
+    with stage("serialize"):
+        # created_by is loaded lazily after the refresh
+        data = await sync_to_async(lambda: TripSerializer(trip).data)()
+    return JsonResponse(data, status=status.HTTP_201_CREATED, encoder=JSONEncoder)
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.ServerTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,6 +55,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-stage planner timings (geocode, route, hos, db, ...) in a Server-Timing
+# response header, and Prometheus counters/histograms served at /api/metrics.
+# With both off the instrumentation points are no-ops.
+SERVER_TIMING_ENABLED = DEBUG
+METRICS_ENABLED = False
+# /api/metrics answers only these client addresses (REMOTE_ADDR, so list the proxy's
+# address when one sits in front) and logged-in staff users
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -139,3 +149,83 @@ REST_FRAMEWORK = {
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Geocoding cache (in-process LRU backed by the api_geocodecacheentry table)
+GEOCODE_CACHE_MAX_ENTRIES = 2048
+GEOCODE_CACHE_TTL_SECONDS = 30 * 24 * 3600
+GEOCODE_CACHE_NEGATIVE_TTL_SECONDS = 24 * 3600
+# Threads used to run the network part of origin/pickup/dropoff geocoding concurrently
+GEOCODE_MAX_WORKERS = 4
+
+# Route cache; waypoints are rounded to ROUTE_CACHE_COORD_PRECISION decimals
+# (4 is roughly 11 m) before keying. Fallback routes expire much sooner.
+ROUTE_CACHE_MAX_ENTRIES = 512
+ROUTE_CACHE_COORD_PRECISION = 4
+ROUTE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+ROUTE_CACHE_FALLBACK_TTL_SECONDS = 5 * 60
+
+# When enabled (or with ?async=1), POST /api/trips/ returns 202 and leaves
+# planning to `manage.py plan_trips` workers polling the trip table.
+TRIP_PLANNING_ASYNC = False
+TRIP_PLANNING_STALE_AFTER_SECONDS = 300
+TRIP_PLANNING_REQUEUE_INTERVAL_SECONDS = 60
+
+# POST /api/trips/bulk/ limits
+TRIP_BULK_MAX_ROWS = 1000
+TRIP_BULK_MAX_WORKERS = 8
+
+# Douglas-Peucker tolerances (metres) for the stored route geometry levels;
+# /api/trips/<id>/geometry/ serves POLYLINE_DEFAULT_LEVEL unless ?polyline_level= asks otherwise.
+POLYLINE_LEVELS = {"high": 10.0, "medium": 50.0, "low": 250.0}
+POLYLINE_DEFAULT_LEVEL = "medium"
+
+# Upstream services. Point these at self-hosted OSRM / Nominatim instances to
+# avoid the public demo servers' latency and rate limits (a local Nominatim
+# can also drop NOMINATIM_MIN_DELAY_SECONDS to 0).
+OSRM_BASE_URL = "https://router.project-osrm.org"
+OSRM_PROFILE = "driving"
+OSRM_READ_TIMEOUT_SECONDS = 15
+NOMINATIM_BASE_URL = "https://nominatim.openstreetmap.org"
+NOMINATIM_READ_TIMEOUT_SECONDS = 10
+NOMINATIM_MIN_DELAY_SECONDS = 1
+
+# Shared keep-alive HTTP session used for both upstreams
+HTTP_CONNECT_TIMEOUT_SECONDS = 3.05
+HTTP_MAX_RETRIES = 2
+HTTP_POOL_MAXSIZE = 20
+
+# Offline gazetteer consulted before Nominatim and used for location autocomplete
+GAZETTEER_PATH = BASE_DIR / 'api' / 'data' / 'gazetteer.csv'
+
+# Spatial index for labelling pinned map locations; SPATIAL_PLACES_PATH optionally
+# adds terminals and truck stops (CSV: name, kind, latitude, longitude, state)
+SPATIAL_PLACES_PATH = BASE_DIR / 'api' / 'data' / 'places.csv'
+PINNED_SNAP_RADIUS_MILES = 50
+
+# POST /api/matrix/: cached OSRM table lookups; cells share the route cache TTLs
+MATRIX_CACHE_MAX_ENTRIES = 20000
+MATRIX_MAX_LOCATIONS = 100
+# place names may each need a 1 req/s Nominatim lookup; {lat, lon} pairs only count
+# toward MATRIX_MAX_LOCATIONS
+MATRIX_MAX_PLACE_NAMES = 10
+
+# POST /api/hos/feasibility/: largest cycles_used x distances_miles grid accepted
+HOS_SWEEP_MAX_CELLS = 250_000
+
+# GET /api/trips/export/<csv|ndjson>/ streams trips from the database in chunks of this size
+TRIP_EXPORT_CHUNK_SIZE = 200
+
+# OSRM and Nominatim circuit breakers, shared across workers through the database:
+# this many failures in a row opens a circuit, and after RESET_SECONDS one request probes it
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET_SECONDS = 30
+
+# Identical in-flight geocode/route lookups share one upstream call; across processes the
+# caller holding the UpstreamLock row for up to LOCK_SECONDS publishes its result there and
+# the others poll for it, for at most WAIT_SECONDS before calling upstream themselves
+SINGLE_FLIGHT_LOCK_SECONDS = 60
+SINGLE_FLIGHT_WAIT_SECONDS = 30
+SINGLE_FLIGHT_POLL_SECONDS = 0.05
+
+# GET /api/trips/<id>/ keeps the rendered body of this many trips in memory, keyed by ETag
+TRIP_RESPONSE_CACHE_MAX_ENTRIES = 256
@@ -16,12 +16,13 @@ import dayjs from 'dayjs';
 import durationPlugin from 'dayjs/plugin/duration';
 import { useMemo } from 'react';
 import { BarChart } from '@mui/x-charts/BarChart';
-import type { HosDayLog } from '../types/trip';
+import type { CompactHosLogs, HosDayLog } from '../types/trip';
+import { expandHosLogs } from '../utils/hosLogs';
 
 dayjs.extend(durationPlugin);
 
 type ELDLogViewerProps = {
-    logs: HosDayLog[];
+    logs: HosDayLog[] | CompactHosLogs;
 };
 
 const formatDuration = (hours: number) => {
@@ -38,7 +39,8 @@ const STATUS_PALETTE: Record<string, string> = {
     'Sleeper Berth': '#0EA5E9',
 };
 
-const ELDLogViewer: React.FC<ELDLogViewerProps> = ({ logs }) => {
+const ELDLogViewer: React.FC<ELDLogViewerProps> = ({ logs: rawLogs }) => {
+    const logs = useMemo(() => expandHosLogs(rawLogs), [rawLogs]);
     const chartData = useMemo(() => {
         const statusKeys = ['Driving', 'On Duty', 'Off Duty', 'Sleeper Berth'];
         if (!logs || logs.length === 0) {
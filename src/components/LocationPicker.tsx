@@ -17,13 +17,33 @@ import {
     Tooltip,
     Typography,
 } from '@mui/material';
-import { useMemo, useState } from 'react';
+import { useEffect, useMemo, useState } from 'react';
 import type { SyntheticEvent } from 'react';
 import { MapContainer, Marker, TileLayer, useMapEvents } from 'react-leaflet';
 import type { LocationOption } from '../data/locations';
 import { MAJOR_US_LOCATIONS } from '../data/locations';
+import { api } from '../services/api';
 
 const DEFAULT_POSITION: [number, number] = [20, 0]; // global center showing most continents
+const AUTOCOMPLETE_DEBOUNCE_MS = 200;
+const AUTOCOMPLETE_MIN_LENGTH = 2;
+
+// shared by every picker on the page, so origin/pickup/dropoff reuse each other's lookups
+const suggestionCache = new Map<string, LocationOption[]>();
+
+const fetchSuggestions = async (query: string): Promise<LocationOption[]> => {
+    const key = query.trim().toLowerCase();
+    const cached = suggestionCache.get(key);
+    if (cached) {
+        return cached;
+    }
+    const response = await api.get<{ results: LocationOption[] }>('locations/autocomplete/', {
+        params: { q: key },
+    });
+    const results = response.data.results.map(({ label, state, value }) => ({ label, state, value }));
+    suggestionCache.set(key, results);
+    return results;
+};
 
 const MapPinSelector: React.FC<{
     value: [number, number] | null;
@@ -61,7 +81,36 @@ const LocationPicker: React.FC<LocationPickerProps> = ({
         return match ? [parseFloat(match[1]), parseFloat(match[2])] : null;
     });
 
-    const curatedOptions = useMemo(() => MAJOR_US_LOCATIONS, []);
+    const [suggestions, setSuggestions] = useState<LocationOption[]>([]);
+
+    useEffect(() => {
+        const query = value.trim();
+        if (query.length < AUTOCOMPLETE_MIN_LENGTH || query.startsWith('Pinned location')) {
+            setSuggestions([]);
+            return undefined;
+        }
+        let cancelled = false;
+        const timer = window.setTimeout(() => {
+            fetchSuggestions(query)
+                .then((results) => {
+                    if (!cancelled) {
+                        setSuggestions(results);
+                    }
+                })
+                .catch((error) => {
+                    console.error('Failed to load location suggestions', error);
+                });
+        }, AUTOCOMPLETE_DEBOUNCE_MS);
+        return () => {
+            cancelled = true;
+            window.clearTimeout(timer);
+        };
+    }, [value]);
+
+    const curatedOptions = useMemo(() => {
+        const known = new Set(suggestions.map((option) => option.value));
+        return [...suggestions, ...MAJOR_US_LOCATIONS.filter((option) => !known.has(option.value))];
+    }, [suggestions]);
 
     const matchedOption = useMemo(
         () => curatedOptions.find((option) => option.value === value) ?? null,
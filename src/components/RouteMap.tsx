@@ -5,8 +5,9 @@ import markerIcon2x from 'leaflet/dist/images/marker-icon-2x.png';
 import markerIcon from 'leaflet/dist/images/marker-icon.png';
 import markerShadow from 'leaflet/dist/images/marker-shadow.png';
 import { MapContainer, Marker, Polyline, Popup, TileLayer, useMap } from 'react-leaflet';
-import { useEffect } from 'react';
-import type { MapData } from '../types/trip';
+import { useEffect, useState } from 'react';
+import { api } from '../services/api';
+import type { MapData, RouteGeometry } from '../types/trip';
 
 L.Icon.Default.mergeOptions({
     iconRetinaUrl: markerIcon2x,
@@ -61,7 +62,28 @@ type RouteMapProps = {
 };
 
 const RouteMap: React.FC<RouteMapProps> = ({ mapData }) => {
-    if (!mapData || mapData.polyline.length === 0) {
+    const geometryUrl = mapData?.geometry_url;
+    const [polyline, setPolyline] = useState<[number, number][]>([]);
+
+    useEffect(() => {
+        setPolyline([]);
+        if (!geometryUrl) {
+            return;
+        }
+        let cancelled = false;
+        api.get<RouteGeometry>(geometryUrl)
+            .then(({ data }) => {
+                if (!cancelled) {
+                    setPolyline(data.polyline);
+                }
+            })
+            .catch((error) => console.error('Failed to load route geometry', error));
+        return () => {
+            cancelled = true;
+        };
+    }, [geometryUrl]);
+
+    if (!mapData || mapData.markers.length === 0) {
         return (
             <Paper elevation={3} sx={{ p: 3, minHeight: 360 }}>
                 <Typography variant="h6" gutterBottom>
@@ -82,8 +104,8 @@ const RouteMap: React.FC<RouteMapProps> = ({ mapData }) => {
             <Box height={360} borderRadius={2} overflow="hidden">
                 <MapContainer center={[20, 0]} zoom={2} style={{ height: '100%', width: '100%' }}>
                     <TileLayer url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png" />
-                    <FitBounds polyline={mapData.polyline} />
-                    <Polyline positions={mapData.polyline.map(([lat, lng]) => [lat, lng])} color="#F97316" weight={4} />
+                    <FitBounds polyline={polyline} />
+                    <Polyline positions={polyline.map(([lat, lng]) => [lat, lng])} color="#F97316" weight={4} />
                     {mapData.markers.map((marker) => {
                         let icon = L.Icon.Default.prototype;
                         if (marker.label === 'Pickup') {
@@ -102,6 +124,12 @@ const RouteMap: React.FC<RouteMapProps> = ({ mapData }) => {
                             >
                                 <Popup>
                                     <Typography variant="subtitle2">{marker.label}</Typography>
+                                    {marker.timestamp && (
+                                        <Typography variant="caption" display="block">
+                                            {new Date(marker.timestamp).toLocaleString()}
+                                            {marker.miles_from_start !== undefined && ` · mile ${Math.round(marker.miles_from_start)}`}
+                                        </Typography>
+                                    )}
                                     {marker.approximate && (
                                         <Typography variant="caption" color="text.secondary">
                                             Location estimated due to offline geocoding.
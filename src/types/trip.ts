@@ -33,16 +33,48 @@ export type HosDayLog = {
     entries: HosEntry[];
 };
 
+// Columnar HOS logs returned with ?format=compact. Entry i starts `offset[i]`
+// microseconds after `start` and lasts `duration[i]` hours; `activity` and
+// `status` index into the `activities` and `statuses` tables.
+export type CompactHosLogs = {
+    format: 'compact';
+    version: 1;
+    start: string | null;
+    activities: string[];
+    statuses: string[];
+    day: number[];
+    activity: number[];
+    status: number[];
+    offset: number[];
+    duration: number[];
+};
+
+// markers without a `type` are the trip endpoints; the rest are HOS stops
+// placed along the route by `miles_from_start`
 export type MapMarker = {
     label: string;
     latitude: number;
     longitude: number;
     approximate?: boolean;
+    type?: 'Break' | 'Fuel Stop' | 'Rest';
+    timestamp?: string;
+    miles_from_start?: number;
 };
 
+export type PolylineLevel = 'full' | 'high' | 'medium' | 'low';
+
+// The route itself is fetched from `geometry_url`, which is versioned so the
+// response can be cached for good.
 export type MapData = {
-    polyline: [number, number][];
     markers: MapMarker[];
+    geometry_url: string;
+};
+
+// `polyline` is one simplified level of the route (see `polyline_level`);
+// add `polyline_level=full` to `geometry_url` for the complete geometry.
+export type RouteGeometry = {
+    polyline: [number, number][];
+    polyline_level?: PolylineLevel;
 };
 
 export type GeocodingNote = {
@@ -51,6 +83,8 @@ export type GeocodingNote = {
     approximate: boolean;
 };
 
+export type TripStatus = 'pending' | 'processing' | 'completed' | 'failed';
+
 export type TripResponse = {
     id: number;
     created_by: string | null;
@@ -59,8 +93,10 @@ export type TripResponse = {
     dropoff_location: string;
     current_cycle_used: string;
     route_summary: RouteSummary;
-    hos_logs: HosDayLog[];
+    hos_logs: HosDayLog[] | CompactHosLogs;
     map_data: MapData;
+    status: TripStatus;
+    status_detail: string;
     created_at: string;
     updated_at: string;
 };
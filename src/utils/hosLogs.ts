@@ -0,0 +1,44 @@
+import type { CompactHosLogs, HosDayLog } from '../types/trip';
+
+const MS_PER_DAY = 24 * 60 * 60 * 1000;
+const MS_PER_HOUR = 60 * 60 * 1000;
+
+export const isCompactHosLogs = (logs: HosDayLog[] | CompactHosLogs): logs is CompactHosLogs =>
+    !Array.isArray(logs) && logs.format === 'compact';
+
+export const expandHosLogs = (logs: HosDayLog[] | CompactHosLogs | null | undefined): HosDayLog[] => {
+    if (!logs) {
+        return [];
+    }
+    if (!isCompactHosLogs(logs)) {
+        return logs;
+    }
+    if (!logs.start) {
+        return [];
+    }
+
+    const planStart = Date.parse(logs.start);
+    const days: HosDayLog[] = [];
+    for (let index = 0; index < logs.activity.length; index += 1) {
+        const day = logs.day[index];
+        let current = days[days.length - 1];
+        if (!current || current.day !== day) {
+            current = {
+                day,
+                start: new Date(planStart + (day - 1) * MS_PER_DAY).toISOString(),
+                entries: [],
+            };
+            days.push(current);
+        }
+        const startMs = planStart + logs.offset[index] / 1000;
+        const duration = logs.duration[index];
+        current.entries.push({
+            activity: logs.activities[logs.activity[index]],
+            status: logs.statuses[logs.status[index]],
+            start: new Date(startMs).toISOString(),
+            end: new Date(startMs + duration * MS_PER_HOUR).toISOString(),
+            duration_hours: Math.round(duration * 100) / 100,
+        });
+    }
+    return days;
+};